@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+"""
+复杂图文逻辑推理挑战赛 - 日志
+基于标准库logging：调用线程只把日志记录放入队列（QueueHandler），由后台线程（QueueListener）
+写入控制台与按大小轮转的日志文件；WARNING以下带数据条目的日志可按条目抽样，
+级别不足或未被抽中的日志在调用线程中即被丢弃
+"""
+
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+import zlib
+from contextlib import contextmanager
+
+from config import LOG_CONFIG
+
+# 所有模块日志的父logger名称
+LOGGER_NAME = 'reasoner'
+
+# 当前线程正在处理的数据条目，由推理器在处理每个请求单元时设置（日志抽样与指标共用）
+_context = threading.local()
+
+@contextmanager
+def trace_items(item_ids):
+    """
+    在上下文内将当前线程的日志与指标归属到指定数据条目
+
+    Args:
+        item_ids (list): 数据条目id
+    """
+    previous = getattr(_context, 'items', None)
+    _context.items = [str(item_id) for item_id in item_ids]
+    try:
+        yield
+    finally:
+        _context.items = previous
+
+def current_items():
+    """
+    获取当前线程正在处理的数据条目
+
+    Returns:
+        list: 数据条目id，不在trace_items上下文中时为空列表
+    """
+    return list(getattr(_context, 'items', None) or [])
+
+def is_item_sampled(item_id, sample_rate):
+    """
+    按条目id的稳定哈希判断是否抽中（同一条目在各次运行中结果一致）
+
+    Args:
+        item_id (str): 数据条目id
+        sample_rate (float): 抽样比例(0-1)
+
+    Returns:
+        bool: 是否抽中
+    """
+    if sample_rate >= 1:
+        return True
+    return zlib.crc32(str(item_id).encode('utf-8')) % 10000 < sample_rate * 10000
+
+class ItemSampleFilter(logging.Filter):
+    """
+    为日志记录附加当前数据条目，并对WARNING以下带条目的记录按条目抽样
+    """
+
+    def __init__(self, sample_rate=1.0):
+        super().__init__()
+        self.sample_rate = sample_rate
+
+    def filter(self, record):
+        items = getattr(_context, 'items', None)
+        record.item_tag = f"[{','.join(items)}] " if items else ''
+        if not items or record.levelno >= logging.WARNING:
+            return True
+        return is_item_sampled(items[0], self.sample_rate)
+
+_listener = None
+_console_handler = None
+_file_handler = None
+_setup_lock = threading.Lock()
+
+def setup_logging(config=None):
+    """
+    配置日志（只在首次调用时生效）：控制台与轮转文件两个输出，均在后台线程中写入
+
+    Args:
+        config (dict): 日志配置，默认LOG_CONFIG
+    """
+    global _listener, _console_handler, _file_handler
+    if _listener is not None:
+        return
+    with _setup_lock:
+        if _listener is not None:
+            return
+        config = config or LOG_CONFIG
+        file_level = logging.getLevelName(config['level'])
+        console_level = logging.getLevelName(config['console_level'])
+
+        handlers = []
+        _console_handler = logging.StreamHandler(sys.stdout)
+        _console_handler.setLevel(console_level)
+        _console_handler.setFormatter(logging.Formatter(config['console_format']))
+        handlers.append(_console_handler)
+
+        if config['file']:
+            directory = os.path.dirname(config['file'])
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            file_handler = logging.handlers.RotatingFileHandler(
+                config['file'],
+                maxBytes=config['max_bytes'],
+                backupCount=config['backup_count'],
+                encoding='utf-8',
+                delay=True
+            )
+            file_handler.setLevel(file_level)
+            file_handler.setFormatter(logging.Formatter(config['format']))
+            handlers.append(file_handler)
+            _file_handler = file_handler
+
+        # 无界队列，放入不会阻塞调用线程
+        log_queue = queue.SimpleQueue()
+        queue_handler = logging.handlers.QueueHandler(log_queue)
+        queue_handler.addFilter(ItemSampleFilter(config['item_sample_rate']))
+
+        root = logging.getLogger(LOGGER_NAME)
+        root.setLevel(min(file_level, console_level) if config['file'] else console_level)
+        root.addHandler(queue_handler)
+        root.propagate = False
+
+        listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+        listener.start()
+        # 退出时写完队列中剩余的日志
+        atexit.register(listener.stop)
+        _listener = listener
+
+def set_console_level(level):
+    """
+    调整控制台输出级别（如压测时只显示错误），不影响日志文件
+
+    Args:
+        level (str): 日志级别名称
+    """
+    setup_logging()
+    level = logging.getLevelName(level)
+    _console_handler.setLevel(level)
+    root = logging.getLogger(LOGGER_NAME)
+    root.setLevel(min(root.level, level))
+
+def set_log_file(path):
+    """
+    切换日志文件（如分片运行时每个分片写入各自的文件），之后的日志写入新文件
+
+    Args:
+        path (str): 新的日志文件路径
+    """
+    setup_logging()
+    if _file_handler is None:
+        return
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    # 持有处理器的锁，避免后台线程正在写入旧文件；delay=True时下次写入才打开新文件
+    with _file_handler.lock:
+        if _file_handler.stream:
+            _file_handler.stream.close()
+            _file_handler.stream = None
+        _file_handler.baseFilename = os.path.abspath(path)
+
+def get_logger(name):
+    """
+    获取模块的logger，首次调用时按LOG_CONFIG配置日志
+
+    Args:
+        name (str): 模块名称
+
+    Returns:
+        logging.Logger: logger
+    """
+    setup_logging()
+    return logging.getLogger(f"{LOGGER_NAME}.{name}")
@@ -0,0 +1,278 @@
+# -*- coding: utf-8 -*-
+"""
+复杂图文逻辑推理挑战赛 - 端到端吞吐量压测
+在本地模拟MaaS服务上，用train.csv与图像数据集驱动TwoStageReasoner、qwen.py与qwen2.py的调用路径，
+统计吞吐量(条/秒)、单条延迟p50/p95/p99与每条数据的接口调用次数，结果追加到JSONL文件便于逐次对比
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+import qwen
+import qwen2
+from app_logging import set_console_level
+from config import CACHE_CONFIG, DATA_PATHS, METRICS_CONFIG, MODEL_CONFIG, SCHEDULER_CONFIG, TEXT_MODEL_CONFIG, VISION_MODEL_CONFIG
+from executor import run_ordered
+from main import TwoStageReasoner
+from mock_server import MockMaaSServer, config_from_args
+from utils import ensure_dir_exists, load_csv_data
+
+# 可压测的调用路径
+SCENARIOS = ['reasoner', 'reasoner_pipelined', 'qwen', 'qwen2']
+
+# 压测结果默认保存位置
+DEFAULT_RESULTS_FILE = os.path.join('output', 'benchmarks.jsonl')
+
+# 压测的指标追踪单独保存，不混入正式运行的追踪（调度器从中读取最近几次运行的耗时）
+DEFAULT_TRACE_FILE = os.path.join('output', 'benchmark_trace.jsonl')
+
+# 这些字段都相同的压测结果才可以对比
+COMPARABLE_FIELDS = ('scenario', 'items', 'workers', 'order', 'rate_limit', 'server')
+
+class TimedReasoner(TwoStageReasoner):
+    """
+    记录每条数据在各阶段实际处理耗时的推理器（不含排队等待时间）
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.item_seconds = {}
+        self._timing_lock = threading.Lock()
+
+    def _add_time(self, rows, seconds):
+        with self._timing_lock:
+            for row in rows:
+                self.item_seconds[row['id']] = self.item_seconds.get(row['id'], 0.0) + seconds
+
+    def _understand_unit(self, rows, image_dir):
+        start = time.perf_counter()
+        try:
+            return super()._understand_unit(rows, image_dir)
+        finally:
+            self._add_time(rows, time.perf_counter() - start)
+
+    def _answer_row_directly(self, row, image_dir):
+        start = time.perf_counter()
+        try:
+            return super()._answer_row_directly(row, image_dir)
+        finally:
+            self._add_time([row], time.perf_counter() - start)
+
+    def _reason_row(self, row, understanding_results):
+        start = time.perf_counter()
+        try:
+            return super()._reason_row(row, understanding_results)
+        finally:
+            self._add_time([row], time.perf_counter() - start)
+
+def _run_reasoner(rows, image_dir, workers, pipelined):
+    """
+    用TwoStageReasoner处理数据行
+
+    Returns:
+        list: 每条数据的处理耗时(秒)
+    """
+    reasoner = TimedReasoner()
+    reasoner.max_workers = workers
+    reasoner.run(pd.DataFrame(rows), image_dir, pipelined=pipelined)
+    return list(reasoner.item_seconds.values())
+
+def _run_qwen(module, rows, image_dir, workers):
+    """
+    用qwen.py/qwen2.py的call_qwen逐条处理数据行
+
+    Returns:
+        list: 每条数据的处理耗时(秒)，含重试
+    """
+    def process(row):
+        start = time.perf_counter()
+        module.call_qwen(row['question'], module.image_to_base64(os.path.join(image_dir, row['image'])))
+        return time.perf_counter() - start
+
+    return run_ordered(process, rows, max_workers=workers, desc=module.__name__)
+
+def point_clients_to(api_url, rate_limit=True):
+    """
+    将所有模型客户端指向模拟服务，并关闭响应缓存（否则重复压测只命中缓存）
+
+    Args:
+        api_url (str): 模拟服务地址（不含/chat/completions）
+        rate_limit (bool): 是否保留客户端限流
+    """
+    for model_config in (VISION_MODEL_CONFIG, TEXT_MODEL_CONFIG):
+        model_config['api_url'] = api_url
+        if not rate_limit:
+            model_config['rate_limit'] = None
+    qwen.URL = qwen2.URL = f"{api_url}/chat/completions"
+    CACHE_CONFIG['enabled'] = False
+
+def summarize(scenario, latencies, seconds, calls, items):
+    """
+    汇总一次压测的指标
+
+    Returns:
+        dict: 吞吐量、延迟分位数与调用次数
+    """
+    latencies = np.asarray(latencies, dtype=np.float64)
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) if len(latencies) else (0.0, 0.0, 0.0)
+    return {
+        'scenario': scenario,
+        'items': items,
+        'seconds': round(seconds, 3),
+        'items_per_sec': round(items / seconds, 3) if seconds else 0.0,
+        'p50': round(float(p50), 3),
+        'p95': round(float(p95), 3),
+        'p99': round(float(p99), 3),
+        'calls_per_item': round(calls / items, 3) if items else 0.0
+    }
+
+def run_scenario(scenario, server, rows, image_dir, workers, verbose=False):
+    """
+    运行一个压测场景
+
+    Args:
+        scenario (str): SCENARIOS之一
+        server (MockMaaSServer): 模拟服务
+        rows (list): 数据行
+        image_dir (str): 图像目录
+        workers (int): 并发数
+        verbose (bool): 是否显示推理过程的输出
+
+    Returns:
+        dict: 压测结果
+    """
+    before = server.state.stats()
+    output = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(io.StringIO())
+    start = time.perf_counter()
+    with output:
+        if scenario in ('reasoner', 'reasoner_pipelined'):
+            latencies = _run_reasoner(rows, image_dir, workers, scenario == 'reasoner_pipelined')
+        elif scenario == 'qwen':
+            latencies = _run_qwen(qwen, rows, image_dir, workers)
+        elif scenario == 'qwen2':
+            latencies = _run_qwen(qwen2, rows, image_dir, workers)
+        else:
+            raise ValueError(f"未知的压测场景: {scenario}")
+    seconds = time.perf_counter() - start
+
+    after = server.state.stats()
+    result = summarize(scenario, latencies, seconds, after['requests'] - before['requests'], len(rows))
+    result['outcomes'] = {
+        key: value - before['outcomes'].get(key, 0) for key, value in after['outcomes'].items()
+    }
+    return result
+
+def load_previous(path, record):
+    """
+    读取与record可对比（场景、数据量、并发数、调度顺序、限流与模拟服务配置相同）的上一次压测结果
+
+    Args:
+        path (str): 结果文件
+        record (dict): 本次压测结果
+
+    Returns:
+        dict: 上一次结果，没有时返回None
+    """
+    if not os.path.exists(path):
+        return None
+    previous = None
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                line_record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if all(line_record.get(field) == record[field] for field in COMPARABLE_FIELDS):
+                previous = line_record
+    return previous
+
+def format_result(result, previous=None):
+    """
+    格式化压测结果，有上一次结果时附上变化
+    """
+    def change(key):
+        if not previous or not previous.get(key):
+            return ''
+        return f" ({(result[key] - previous[key]) / previous[key]:+.1%})"
+
+    return (
+        f"{result['scenario']}: {result['items']} 条 / {result['seconds']:.2f}s, "
+        f"{result['items_per_sec']:.2f} 条/s{change('items_per_sec')}, "
+        f"p50 {result['p50']:.2f}s{change('p50')}, p95 {result['p95']:.2f}s{change('p95')}, "
+        f"p99 {result['p99']:.2f}s{change('p99')}, "
+        f"每条调用 {result['calls_per_item']:.2f} 次{change('calls_per_item')}, "
+        f"服务端结果 {result['outcomes']}"
+    )
+
+def parse_args(argv=None):
+    """
+    解析命令行参数，模拟服务参数与mock_server.py一致
+    """
+    parser = argparse.ArgumentParser(description="复杂图文逻辑推理挑战赛 - 端到端吞吐量压测")
+    parser.add_argument('--scenario', choices=SCENARIOS, nargs='+', default=['reasoner'], help="压测场景")
+    parser.add_argument('--limit', type=int, default=50, help="使用train.csv的前N条数据")
+    parser.add_argument('--workers', type=int, default=MODEL_CONFIG['max_workers'], help="并发数")
+    parser.add_argument('--no-rate-limit', action='store_true', help="关闭客户端限流，只测服务端与客户端本身")
+    parser.add_argument(
+        '--order', choices=['input', 'lpt'], default=SCHEDULER_CONFIG['order'],
+        help="TwoStageReasoner的请求提交顺序，对比两者可看出LPT调度对总耗时的影响"
+    )
+    parser.add_argument('--label', default='', help="本次压测的说明，记录在结果中")
+    parser.add_argument('--output', default=DEFAULT_RESULTS_FILE, help="结果追加保存的JSONL文件")
+    parser.add_argument('--trace', default=DEFAULT_TRACE_FILE, help="压测的指标追踪文件，与正式运行的追踪分开")
+    parser.add_argument('--verbose', action='store_true', help="显示推理过程的输出")
+    parser.add_argument('--port', type=int, default=0, help="模拟服务端口，默认随机")
+    parser.add_argument('--latency', choices=['fixed', 'uniform', 'lognormal'])
+    parser.add_argument('--latency-median', type=float)
+    parser.add_argument('--latency-sigma', type=float)
+    parser.add_argument('--latency-per-kb', type=float)
+    parser.add_argument('--error-rate', type=float)
+    parser.add_argument('--rate-limit-rate', type=float)
+    parser.add_argument('--moderation-rate', type=float)
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    if not args.verbose:
+        # 控制台只显示错误，完整日志仍写入日志文件
+        set_console_level('ERROR')
+    train_df = load_csv_data(DATA_PATHS['train_csv'])
+    if train_df is None:
+        print("训练数据加载失败")
+        return
+    rows = train_df.head(args.limit)[['id', 'image', 'question']].to_dict('records')
+
+    SCHEDULER_CONFIG['order'] = args.order
+    METRICS_CONFIG['trace_file'] = args.trace
+    with MockMaaSServer(config_from_args(args)) as server:
+        point_clients_to(server.api_url, rate_limit=not args.no_rate_limit)
+        server_config = {key: value for key, value in server.state.config.items() if key not in ('host', 'port')}
+        print(f"模拟服务: {server.api_url}，{len(rows)} 条数据，并发数 {args.workers}")
+
+        ensure_dir_exists(os.path.dirname(args.output) or '.')
+        for scenario in args.scenario:
+            result = run_scenario(scenario, server, rows, DATA_PATHS['image_dir'], args.workers, args.verbose)
+            record = dict(
+                result,
+                label=args.label,
+                time=datetime.now().isoformat(timespec='seconds'),
+                workers=args.workers,
+                order=args.order,
+                rate_limit=not args.no_rate_limit,
+                server=server_config
+            )
+            print(format_result(result, load_previous(args.output, record)))
+            with open(args.output, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+"""
+复杂图文逻辑推理挑战赛 - 断点续跑存储
+以JSONL追加写入每条数据在各阶段的处理状态与结果，按id读回，支持中断后续跑
+"""
+
+import json
+import os
+import threading
+from datetime import datetime
+
+from utils import ensure_dir_exists
+
+# 阶段名称
+STAGE_VISION = 'vision'
+STAGE_TEXT = 'text'
+
+# 处理状态
+STATUS_DONE = 'done'
+STATUS_FAILED = 'failed'
+STATUS_REJECTED = 'rejected'  # 内容审核等确定性失败，续跑时不再重试
+STATUS_PARKED = 'parked'  # 接口熔断期间暂缓处理，等待恢复后重试
+
+class CheckpointStore:
+    """
+    追加写入的JSONL检查点，每行一条记录，同一(id, 阶段)以最后一条为准
+    """
+
+    def __init__(self, path):
+        """
+        Args:
+            path (str): JSONL文件路径，不存在时自动创建
+        """
+        self.path = path
+        self.records = {}
+        self._lock = threading.Lock()
+        ensure_dir_exists(os.path.dirname(path) or '.')
+        self.load()
+
+    def load(self):
+        """
+        读取已有记录，忽略中断时写了一半的行
+
+        Returns:
+            int: 读取的记录数
+        """
+        self.records = {}
+        if not os.path.exists(self.path):
+            return 0
+
+        count = 0
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                self.records[(record['id'], record['stage'])] = record
+                count += 1
+        return count
+
+    def record(self, item_id, stage, status, result=None, **extra):
+        """
+        追加一条记录并立即刷新到磁盘
+
+        Args:
+            item_id: 数据id
+            stage (str): 阶段名称
+            status (str): 处理状态
+            result (str): 处理结果
+            **extra: 其他需要保存的字段（如图像、问题）
+
+        Returns:
+            dict: 写入的记录
+        """
+        record = {
+            'id': str(item_id),
+            'stage': stage,
+            'status': status,
+            'result': result,
+            'time': datetime.now().isoformat(timespec='seconds')
+        }
+        record.update(extra)
+        line = json.dumps(record, ensure_ascii=False, default=str)
+
+        with self._lock:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(line + '\n')
+            self.records[(record['id'], stage)] = record
+        return record
+
+    def get(self, item_id, stage):
+        """
+        获取某条数据在某阶段的最新记录
+
+        Args:
+            item_id: 数据id
+            stage (str): 阶段名称
+
+        Returns:
+            dict: 记录，不存在返回None
+        """
+        return self.records.get((str(item_id), stage))
+
+    def is_done(self, item_id, stage):
+        """
+        判断某条数据在某阶段是否无需再处理（已成功，或被确定性拒绝）
+
+        Args:
+            item_id: 数据id
+            stage (str): 阶段名称
+
+        Returns:
+            bool: 是否已完成
+        """
+        record = self.get(item_id, stage)
+        return record is not None and record['status'] in (STATUS_DONE, STATUS_REJECTED)
+
+    def count(self, stage, status):
+        """
+        统计某阶段处于某状态的数据条数
+
+        Args:
+            stage (str): 阶段名称
+            status (str): 处理状态
+
+        Returns:
+            int: 条数
+        """
+        return sum(
+            1 for (_, record_stage), record in self.records.items()
+            if record_stage == stage and record['status'] == status
+        )
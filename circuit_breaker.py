@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+"""
+复杂图文逻辑推理挑战赛 - 熔断器
+接口连续失败达到阈值后熔断，熔断期间请求立即失败；冷却时间过后放行一个探测请求，
+探测成功则恢复，失败则继续熔断
+"""
+
+import threading
+import time
+
+from app_logging import get_logger
+from retry import APIError, ERROR_CIRCUIT_OPEN, ERROR_SERVER, ERROR_TIMEOUT, ERROR_CONNECTION, classify_exception
+
+logger = get_logger('circuit_breaker')
+
+# 熔断器状态
+STATE_CLOSED = 'closed'  # 正常
+STATE_OPEN = 'open'  # 熔断中，请求立即失败
+STATE_HALF_OPEN = 'half_open'  # 冷却结束，放行探测请求
+
+# 表示接口不可用的错误类型（内容审核、4xx等说明服务本身正常，不计入失败）
+OUTAGE_ERRORS = {ERROR_SERVER, ERROR_TIMEOUT, ERROR_CONNECTION}
+
+class CircuitOpenError(APIError):
+    """
+    熔断期间请求被拒绝
+    """
+
+    def __init__(self, name, retry_in):
+        """
+        Args:
+            name (str): 接口名称
+            retry_in (float): 距离下次允许探测的秒数
+        """
+        super().__init__(ERROR_CIRCUIT_OPEN, f"{name} 已熔断，{retry_in:.0f}秒后探测恢复")
+        self.retry_in = retry_in
+
+class CircuitBreaker:
+    """
+    接口熔断器，线程安全
+    """
+
+    def __init__(self, name, failure_threshold=5, recovery_timeout=30.0):
+        """
+        Args:
+            name (str): 接口名称
+            failure_threshold (int): 连续失败多少次后熔断
+            recovery_timeout (float): 熔断后多久放行探测请求(秒)
+        """
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.state = STATE_CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def time_until_probe(self):
+        """
+        距离下次允许探测的秒数
+
+        Returns:
+            float: 未熔断时为0
+        """
+        with self._lock:
+            if self.state != STATE_OPEN:
+                return 0.0
+            return max(0.0, self.opened_at + self.recovery_timeout - time.monotonic())
+
+    def before_call(self):
+        """
+        请求前检查是否放行
+
+        Raises:
+            CircuitOpenError: 熔断中，或已有探测请求在进行
+        """
+        with self._lock:
+            if self.state == STATE_CLOSED:
+                return
+            now = time.monotonic()
+            if self.state == STATE_OPEN:
+                retry_in = self.opened_at + self.recovery_timeout - now
+                if retry_in > 0:
+                    raise CircuitOpenError(self.name, retry_in)
+                self.state = STATE_HALF_OPEN
+            if self.probe_in_flight:
+                raise CircuitOpenError(self.name, self.recovery_timeout)
+            self.probe_in_flight = True
+            logger.info("%s 熔断冷却结束，发送探测请求", self.name)
+
+    def on_success(self):
+        """
+        请求成功（或服务端正常返回的确定性错误），关闭熔断
+        """
+        with self._lock:
+            if self.state != STATE_CLOSED:
+                logger.info("%s 探测成功，恢复正常", self.name)
+            self.state = STATE_CLOSED
+            self.failures = 0
+            self.probe_in_flight = False
+
+    def on_failure(self):
+        """
+        请求因接口不可用而失败，累计失败次数，达到阈值或探测失败时熔断
+        """
+        with self._lock:
+            self.failures += 1
+            self.probe_in_flight = False
+            if self.state == STATE_HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != STATE_OPEN:
+                    logger.warning("%s 连续失败 %d 次，熔断 %.0f 秒", self.name, self.failures, self.recovery_timeout)
+                self.state = STATE_OPEN
+                self.opened_at = time.monotonic()
+
+    def call(self, func):
+        """
+        在熔断器保护下执行func
+
+        Args:
+            func (callable): 无参函数
+
+        Returns:
+            func的返回值
+
+        Raises:
+            CircuitOpenError: 熔断中
+        """
+        self.before_call()
+        try:
+            result = func()
+        except Exception as e:
+            if classify_exception(e) in OUTAGE_ERRORS:
+                self.on_failure()
+            else:
+                self.on_success()
+            raise
+        self.on_success()
+        return result
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+def get_circuit_breaker(name, config):
+    """
+    获取指定接口的共享熔断器
+
+    Args:
+        name (str): 接口名称
+        config (dict): 熔断配置，包含failure_threshold/recovery_timeout，None表示不熔断
+
+    Returns:
+        CircuitBreaker: 熔断器，未配置时返回None
+    """
+    if not config:
+        return None
+    with _breakers_lock:
+        if name not in _breakers:
+            _breakers[name] = CircuitBreaker(name, **config)
+        return _breakers[name]
@@ -24,7 +24,27 @@ VISION_MODEL_CONFIG = {
     'api_url': 'https://maas-api.cn-huabei-1.xf-yun.com/v1',
     'service_name': 'zzs',
     'temperature': 0.1,
-    'max_tokens': 2048
+    'max_tokens': 2048,
+    # 限流配置（所有并发线程共享），设为None关闭限流
+    'rate_limit': {
+        'requests_per_second': 2.0,  # 每秒请求数上限
+        'tokens_per_minute': 120000,  # 每分钟token数上限
+        'burst': 2  # 允许的突发请求数
+    },
+    # 熔断配置：连续失败达到阈值后熔断，冷却后放行探测请求，设为None关闭
+    'circuit_breaker': {
+        'failure_threshold': 5,  # 连续失败次数阈值
+        'recovery_timeout': 30.0  # 熔断冷却时间(秒)
+    },
+    # 对冲请求配置：超过延迟分位数仍未返回时再发一次相同请求，取先返回的结果
+    'hedging': {
+        'enabled': False,  # 是否启用对冲请求
+        'percentile': 95,  # 对冲触发的延迟分位数
+        'min_samples': 20,  # 延迟样本少于该数量时不对冲
+        'window': 200,  # 延迟统计窗口（最近成功请求数）
+        'min_delay': 1.0,  # 对冲等待时间下限(秒)
+        'max_hedge_ratio': 0.1  # 对冲请求数占请求总数的比例上限
+    }
 }
 
 # 新的讯飞文本模型配置
@@ -36,7 +56,20 @@ TEXT_MODEL_CONFIG = {
     'api_url': 'https://maas-api.cn-huabei-1.xf-yun.com/v1',
     'service_name': 'hinemusk',
     'temperature': 0.1,
-    'max_tokens': 1024
+    'max_tokens': 1024,
+    'stream': False,  # 是否以流式(SSE)接收文本推理结果
+    'early_stop': True,  # 流式接收时，输出中已有完整答案即断开，不再等待剩余输出
+    # 限流配置（所有并发线程共享），设为None关闭限流
+    'rate_limit': {
+        'requests_per_second': 4.0,  # 每秒请求数上限
+        'tokens_per_minute': 200000,  # 每分钟token数上限
+        'burst': 4  # 允许的突发请求数
+    },
+    # 熔断配置：连续失败达到阈值后熔断，冷却后放行探测请求，设为None关闭
+    'circuit_breaker': {
+        'failure_threshold': 5,  # 连续失败次数阈值
+        'recovery_timeout': 30.0  # 熔断冷却时间(秒)
+    }
 }
 
 # 数据路径配置
@@ -48,18 +81,108 @@ DATA_PATHS = {
     'output_dir': 'output',
     'model_dir': 'models',
     'intermediate_dir': 'intermediate_results',  # 中间结果存储目录
-    'vision_results_file': 'vision_understanding.txt'  # 视觉理解结果文件
+    'checkpoint_file': 'checkpoint.jsonl'  # 各阶段逐条处理状态（断点续跑）
 }
 
 # 模型配置
 MODEL_CONFIG = {
     'batch_size': 5,  # API调用批次大小
-    'api_delay': 1.0,  # API调用间隔(秒)
-    'timeout': 30,  # API超时时间(秒)
-    'max_retries': 3,  # 最大重试次数
+    'max_workers': 8,  # 并发API调用数，设为1时按原顺序逐条执行
+    'pipeline': False,  # 是否默认使用流水线模式（视觉理解与文本推理重叠执行）
+    'pipeline_queue_size': 16,  # 流水线中待推理队列的长度上限
+    'group_by_image': False,  # 是否将同一图像的多个问题合并为一次视觉请求
+    'vision_batch_max_questions': 4,  # 合并请求时每次最多包含的问题数
+    'vision_batch_tokens_per_question': 800,  # 合并请求时每个问题的输出token预算（未启用TOKEN_BUDGET_CONFIG时）
+    'connect_timeout': 10,  # 建立连接超时时间(秒)
+    'read_timeout': 60,  # 等待响应超时时间(秒)
+    'max_retries': 3,  # 最大重试次数（不含首次请求）
+    'retry_base_delay': 1.0,  # 重试退避的基础等待时间(秒)，每次翻倍并加随机抖动
+    'retry_max_delay': 30.0,  # 单次重试等待时间上限(秒)
+    'parked_retry_rounds': 2,  # 熔断期间暂缓的条目在本次运行中的补跑轮数
     'random_state': 42  # 随机种子
 }
 
+# HTTP连接配置（所有模型客户端共享）
+HTTP_CONFIG = {
+    'pool_size': 16,  # 每个主机的连接池大小，应不小于max_workers
+    'http2': False  # 是否使用HTTP/2（需要安装httpx[http2]）
+}
+
+# 响应缓存配置
+CACHE_CONFIG = {
+    'enabled': True,  # 是否启用响应缓存
+    'path': 'cache/responses.sqlite',  # 缓存文件路径
+    'max_bytes': 256 * 1024 * 1024,  # 缓存总大小上限(字节)，超出后按LRU淘汰
+    'bypass': False  # 为True时不读缓存、只写入新结果
+}
+
+# 图像预处理配置（减小视觉请求体积）
+IMAGE_CONFIG = {
+    'enabled': True,  # 是否启用预处理，关闭时发送原始图像
+    'max_side': 1600,  # 最长边上限(像素)，超出时等比缩小，None表示不缩放
+    'format': 'auto',  # 输出格式：auto(保持原格式并优化)/png/jpeg/webp
+    'quality': 85,  # JPEG/WebP质量(1-100)
+    'cache_dir': 'cache/images',  # 预处理结果的磁盘缓存目录，None表示不缓存
+    'memory_cache_bytes': 128 * 1024 * 1024  # 进程内base64编码缓存上限(字节)，按LRU淘汰
+}
+
+# 图像感知哈希索引配置：内容相同或近似重复（缩放、重新压缩）的图像视为同一张，
+# 第一阶段共享图像编码、合并请求与响应缓存
+IMAGE_INDEX_CONFIG = {
+    'dedupe': False,  # 是否合并近似重复图像
+    'index_dir': 'cache/image_index',  # 索引保存目录，缺失或图像集变化时自动重建
+    'method': 'phash',  # 哈希算法：ahash/dhash/phash；合并近似重复（dedupe）只支持phash，aHash会把不同的文字截图判为重复
+    'threshold': 2,  # 汉明距离不超过该值视为候选近似重复（64位），文字细节不同的图表可能哈希相近，不宜过大
+    'verify_size': 64,  # 候选图像缩小到该边长的灰度图后逐像素比较
+    'max_mse': 10.0,  # 像素均方误差不超过该值才确认为近似重复（重新压缩的同一图像约为1，不同图像通常在80以上）
+    'max_workers': 8  # 构建索引时的并发数
+}
+
+# token预算配置：按问题类型(FEATURE_CONFIG['question_keywords'])设置输出上限，
+# 并限制传入第二阶段的图像描述长度；命中多个类型时取最大值
+TOKEN_BUDGET_CONFIG = {
+    'enabled': True,  # 关闭时使用固定上限（视觉2000、文本500），描述原样传入
+    'vision_max_tokens': {  # 第一阶段每个问题的输出上限
+        'default': 1500,
+        'time': 1000,
+        'who': 1000,
+        'number': 1000,
+        'why': 2000,
+        'how': 2000
+    },
+    'text_max_tokens': {  # 第二阶段的输出上限
+        'default': 500,
+        'time': 300,
+        'who': 300,
+        'number': 300,
+        'why': 500,
+        'how': 500
+    },
+    'description_budget': 1200  # 传入文本推理的图像描述token上限，超出时按与问题的相关性抽取
+}
+
+# 问题路由配置：简单的查找类问题由视觉模型直接作答（一次调用），其余走两阶段，
+# 直接作答失败或答案不确定时升级为两阶段
+ROUTER_CONFIG = {
+    'enabled': False,  # 是否启用路由，关闭时所有条目走两阶段
+    'direct_categories': ['time', 'who', 'number'],  # 可直接作答的问题类型（FEATURE_CONFIG['question_keywords']）
+    'complex_categories': ['why', 'how'],  # 命中时必须走两阶段的问题类型
+    'complex_markers': ['可能', '推测', '判断', '比较', '哪些'],  # 含这些词的问题需要推理，走两阶段
+    'max_question_length': 30,  # 超过该长度的问题走两阶段
+    'escalation_keywords': ['无法确定', '无法判断', '无法回答', '无法看清', '不清楚', '未提及', '没有提到', '抱歉']  # 直接答案含这些词时升级
+}
+
+# 训练集检索配置：按问题字符片段与图像感知哈希检索相似的已解答样本，作为文本推理的少样本示例
+RETRIEVAL_CONFIG = {
+    'enabled': False,  # 是否在文本推理提示词中加入少样本示例
+    'index_dir': 'cache/retrieval',  # 索引保存目录，缺失或训练集变化时自动重建
+    'k': 3,  # 每条数据的示例数量
+    'shingle_size': 2,  # 问题文本的字符片段长度
+    'question_weight': 0.7,  # 问题Jaccard相似度的权重
+    'image_weight': 0.3,  # 图像哈希相似度(1-汉明距离/64)的权重
+    'min_score': 0.3  # 低于该相似度的样本不作为示例（无关图像的哈希相似度约0.5，仅图像相近不足以入选）
+}
+
 # 特征工程配置
 FEATURE_CONFIG = {
     'question_keywords': {
@@ -77,9 +200,63 @@ FEATURE_CONFIG = {
     }
 }
 
+# 指标配置：按数据条目与阶段记录编码耗时、请求大小、首字节时间、总耗时、token、重试与缓存命中
+METRICS_CONFIG = {
+    'enabled': True,  # 是否记录指标
+    'trace_file': 'output/metrics_trace.jsonl',  # 逐事件的JSONL追踪（追加写入，run字段区分每次运行），None表示不写
+    'prometheus_file': 'output/metrics.prom',  # 运行结束时写入的Prometheus文本文件，None表示不写
+    'http_port': None  # 设置后在该端口通过HTTP提供/metrics
+}
+
+# 本地模拟MaaS服务配置（mock_server.py / benchmark.py），离线压测时使用，不消耗真实配额
+MOCK_SERVER_CONFIG = {
+    'host': '127.0.0.1',
+    'port': 8765,  # 0表示随机选择空闲端口
+    'latency': 'lognormal',  # 响应延迟分布：fixed(固定为中位数)/uniform(0到2倍中位数)/lognormal(长尾)
+    'latency_median': 0.5,  # 延迟中位数(秒)
+    'latency_sigma': 0.6,  # lognormal的对数标准差，越大长尾越重
+    'latency_per_kb': 0.0,  # 每KB请求体增加的延迟(秒)，模拟大图与长文本处理更慢
+    'error_rate': 0.02,  # 返回500的比例
+    'rate_limit_rate': 0.02,  # 返回429的比例
+    'retry_after': 1,  # 429响应的Retry-After(秒)
+    'moderation_rate': 0.01,  # 返回内容审核拒绝的比例
+    'description_chars': 400,  # 视觉理解输出的长度(字)
+    'stream_chunk_chars': 20,  # 流式输出每段的字数
+    'stream_chunk_delay': 0.02,  # 流式输出每段的间隔(秒)
+    'seed': 42  # 随机种子，相同配置的压测结果可复现
+}
+
 # 日志配置
 LOG_CONFIG = {
-    'level': 'INFO',
-    'format': '%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    'file': 'logs/app.log'
-}
\ No newline at end of file
+    'level': 'INFO',  # 日志文件的级别，设为DEBUG时记录每次调用的地址、模型与状态码
+    'console_level': 'INFO',  # 控制台的级别，正式运行可设为WARNING减少输出
+    'format': '%(asctime)s - %(name)s - %(levelname)s - %(item_tag)s%(message)s',  # item_tag为"[数据条目id] "
+    'console_format': '%(item_tag)s%(message)s',
+    'file': 'logs/app.log',  # None表示只输出到控制台
+    'max_bytes': 10 * 1024 * 1024,  # 单个日志文件的大小上限(字节)，超出后轮转
+    'backup_count': 5,  # 保留的历史日志文件数
+    'item_sample_rate': 1.0  # WARNING以下带数据条目的日志按条目抽样的比例，1.0表示全部记录
+}
+# 分片运行配置（python main.py --shard i/N，i从0开始，按id的md5哈希分配数据）
+SHARD_CONFIG = {
+    'output_dir': 'output/shards',  # 各分片结果的保存目录，python main.py --merge N 合并为output/submission.csv
+    # 按分片序号覆盖模型配置，例如 {0: {'vision': {'api_key': '...'}}, 1: {'text': {'api_url': '...'}}}；
+    # 命令行的--vision-api-key等参数优先
+    'overrides': {}
+}
+
+# 任务调度配置
+SCHEDULER_CONFIG = {
+    'order': 'lpt',  # 请求提交顺序：lpt(预估耗时长的先提交，缩短并发运行的尾部)/input(按CSV顺序)
+    'failed_first': True,  # 检查点中上次失败或暂缓的条目优先处理
+    'history_runs': 5,  # 历史耗时只取指标追踪文件中最近几次运行（从文件末尾读取）
+    'min_history': 20,  # 本批数据中有历史耗时的请求达到该数量时，用它们拟合无历史请求的耗时模型
+    # 没有足够历史时的耗时模型系数(秒)：视觉[基础, 每MB图像, 每千字问题]，文本[基础, 每千字问题, 每千字图像描述]
+    'default_coefficients': {
+        'vision': [3.0, 2.0, 1.0],
+        'text': [1.0, 1.0, 0.5]
+    },
+    # 每个接口地址同时进行的请求数上限，例如 {'default': 8, 'https://maas-api.cn-huabei-1.xf-yun.com/v1': 4}，
+    # 视觉与文本模型使用同一地址时共享上限；空表示不限制（仍受各阶段并发数约束）
+    'endpoint_concurrency': {}
+}
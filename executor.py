@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+"""
+复杂图文逻辑推理挑战赛 - 并发执行引擎
+在有界线程池中并发执行API调用，结果按输入顺序返回
+"""
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from tqdm import tqdm
+
+def run_ordered(func, items, max_workers=1, desc=None, on_result=None):
+    """
+    对每个元素执行func，最多max_workers个调用同时进行，结果按输入顺序返回
+
+    Args:
+        func (callable): 处理单个元素的函数 func(item) -> result
+        items (list): 待处理元素列表
+        max_workers (int): 最大并发数，小于等于1时顺序执行
+        desc (str): 进度条描述
+        on_result (callable): 完成回调 on_result(index, item, result)，始终在调用线程中执行
+
+    Returns:
+        list: 与items顺序一致的结果列表
+    """
+    items = list(items)
+    results = [None] * len(items)
+
+    if max_workers <= 1:
+        for index, item in enumerate(tqdm(items, desc=desc)):
+            results[index] = func(item)
+            if on_result:
+                on_result(index, item, results[index])
+        return results
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {pool.submit(func, item): index for index, item in enumerate(items)}
+        try:
+            for future in tqdm(as_completed(futures), total=len(futures), desc=desc):
+                index = futures[future]
+                results[index] = future.result()
+                if on_result:
+                    on_result(index, items[index], results[index])
+        except BaseException:
+            # 出错或被中断时取消尚未开始的调用，避免继续消耗配额
+            for future in futures:
+                future.cancel()
+            raise
+
+    return results
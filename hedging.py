@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+"""
+复杂图文逻辑推理挑战赛 - 对冲请求
+请求在观测到的延迟分位数内仍未返回时，再发送一个相同请求，取先成功返回的结果，
+以少量额外调用换取更低的长尾延迟；额外请求数受预算比例限制
+"""
+
+import threading
+import time
+from collections import deque
+from contextlib import nullcontext
+from concurrent.futures import Future, FIRST_COMPLETED, wait
+
+class LatencyTracker:
+    """
+    滑动窗口内的请求延迟统计，线程安全
+    """
+
+    def __init__(self, window=200):
+        """
+        Args:
+            window (int): 保留最近多少次成功请求的延迟
+        """
+        self.samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, latency):
+        """
+        记录一次成功请求的延迟(秒)
+        """
+        with self._lock:
+            self.samples.append(latency)
+
+    def count(self):
+        with self._lock:
+            return len(self.samples)
+
+    def percentile(self, q):
+        """
+        计算延迟分位数
+
+        Args:
+            q (float): 分位数(0-100)
+
+        Returns:
+            float: 延迟(秒)，没有样本时返回None
+        """
+        with self._lock:
+            samples = sorted(self.samples)
+        if not samples:
+            return None
+        index = min(len(samples) - 1, int(round(q / 100 * (len(samples) - 1))))
+        return samples[index]
+
+class Hedger:
+    """
+    对冲请求执行器，线程安全
+    """
+
+    def __init__(self, name, percentile=95, min_samples=20, window=200,
+                 min_delay=1.0, max_hedge_ratio=0.1):
+        """
+        Args:
+            name (str): 接口名称
+            percentile (float): 超过该延迟分位数仍未返回时发送对冲请求
+            min_samples (int): 延迟样本少于该数量时不对冲
+            window (int): 延迟统计窗口大小
+            min_delay (float): 对冲等待时间下限(秒)
+            max_hedge_ratio (float): 对冲请求数占请求总数的比例上限
+        """
+        self.name = name
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.min_delay = min_delay
+        self.max_hedge_ratio = max_hedge_ratio
+        self.latency = LatencyTracker(window)
+        self.calls = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self._lock = threading.Lock()
+
+    def hedge_delay(self):
+        """
+        当前的对冲等待时间
+
+        Returns:
+            float: 等待秒数，样本不足时返回None（不对冲）
+        """
+        if self.latency.count() < self.min_samples:
+            return None
+        return max(self.min_delay, self.latency.percentile(self.percentile))
+
+    def _start(self, func, admit):
+        """
+        在后台线程中通过本地准入后执行func，成功时记录准入之后的延迟
+
+        Returns:
+            tuple: (Future: 执行结果, threading.Event: 已通过准入或准入失败)
+        """
+        future = Future()
+        admitted = threading.Event()
+
+        def run():
+            try:
+                with admit():
+                    admitted.set()
+                    start = time.monotonic()
+                    result = func()
+            except BaseException as e:
+                admitted.set()
+                future.set_exception(e)
+                return
+            self.latency.record(time.monotonic() - start)
+            future.set_result(result)
+
+        threading.Thread(target=run, daemon=True).start()
+        return future, admitted
+
+    def _take_hedge_budget(self):
+        with self._lock:
+            if self.hedges + 1 > self.max_hedge_ratio * self.calls:
+                return False
+            self.hedges += 1
+            return True
+
+    def call(self, func, admit=None):
+        """
+        执行func，发出后超过对冲等待时间仍未返回时并行执行第二次，返回先成功的结果；
+        落后的请求不会被中断，其结果被丢弃
+
+        Args:
+            func (callable): 无参函数，可安全重复执行
+            admit (callable): 返回上下文管理器的无参函数，每次执行func前进入（如限流、并发名额），
+                其中的等待不计入对冲等待时间与延迟统计
+
+        Returns:
+            func的返回值
+
+        Raises:
+            Exception: 所有已发出的请求都失败时，抛出最先发出的请求的异常
+        """
+        admit = admit or nullcontext
+        with self._lock:
+            self.calls += 1
+
+        delay = self.hedge_delay()
+        if delay is None:
+            with admit():
+                start = time.monotonic()
+                result = func()
+            self.latency.record(time.monotonic() - start)
+            return result
+
+        primary, admitted = self._start(func, admit)
+        # 本地排队期间请求尚未发出，对冲计时从通过准入开始
+        admitted.wait()
+        done, _ = wait([primary], timeout=delay)
+        if done or not self._take_hedge_budget():
+            return primary.result()
+
+        hedge, _ = self._start(func, admit)
+        pending = {primary, hedge}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is hedge:
+                        with self._lock:
+                            self.hedge_wins += 1
+                    return future.result()
+        return primary.result()
+
+    def stats(self):
+        """
+        获取对冲统计信息
+
+        Returns:
+            dict: 请求数、对冲数、对冲胜出数与当前对冲等待时间
+        """
+        with self._lock:
+            stats = {'calls': self.calls, 'hedges': self.hedges, 'hedge_wins': self.hedge_wins}
+        stats['hedge_delay'] = self.hedge_delay()
+        return stats
+
+_hedgers = {}
+_hedgers_lock = threading.Lock()
+
+def get_hedger(name, config):
+    """
+    获取指定接口的共享对冲执行器
+
+    Args:
+        name (str): 接口名称
+        config (dict): 对冲配置，enabled为False或None表示不对冲
+
+    Returns:
+        Hedger: 对冲执行器，未启用时返回None
+    """
+    if not config or not config.get('enabled'):
+        return None
+    params = {key: value for key, value in config.items() if key != 'enabled'}
+    with _hedgers_lock:
+        if name not in _hedgers:
+            _hedgers[name] = Hedger(name, **params)
+        return _hedgers[name]
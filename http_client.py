@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+"""
+复杂图文逻辑推理挑战赛 - 共享HTTP客户端
+所有模型客户端共用一个带连接池与keep-alive的会话，避免每次请求重新建立TCP/TLS连接
+"""
+
+import threading
+from contextlib import contextmanager
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from app_logging import get_logger
+from config import HTTP_CONFIG
+
+logger = get_logger('http_client')
+
+# httpx为可选依赖，仅在开启HTTP/2时使用
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+class HttpClient:
+    """
+    带连接池的HTTP客户端，默认基于requests.Session，开启HTTP/2时使用httpx.Client
+    """
+
+    def __init__(self, pool_size=16, http2=False):
+        """
+        Args:
+            pool_size (int): 每个主机保持的最大连接数，应不小于并发数
+            http2 (bool): 是否使用HTTP/2（需要安装httpx[http2]）
+        """
+        self.pool_size = pool_size
+        self.http2 = False
+        self._client = None
+
+        if http2:
+            if httpx is None:
+                logger.warning("未安装httpx，HTTP/2不可用，回退到HTTP/1.1连接池")
+            else:
+                try:
+                    limits = httpx.Limits(
+                        max_connections=pool_size,
+                        max_keepalive_connections=pool_size
+                    )
+                    self._client = httpx.Client(http2=True, limits=limits)
+                    self.http2 = True
+                except ImportError:
+                    logger.warning("未安装h2，HTTP/2不可用，回退到HTTP/1.1连接池")
+
+        if self._client is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            self._client = session
+
+    def _convert_timeout(self, timeout):
+        # requests使用(connect, read)元组，httpx使用httpx.Timeout
+        if self.http2 and isinstance(timeout, tuple):
+            connect, read = timeout
+            return httpx.Timeout(read, connect=connect)
+        return timeout
+
+    def post(self, url, headers=None, json=None, timeout=None):
+        """
+        发送POST请求，复用连接池中的连接
+
+        Args:
+            url (str): 请求地址
+            headers (dict): 请求头
+            json (dict): JSON请求体
+            timeout (float|tuple): 超时时间(秒)，或(连接超时, 读取超时)
+
+        Returns:
+            响应对象（requests.Response或httpx.Response，均提供status_code/text/json()/headers）
+        """
+        return self._client.post(url, headers=headers, json=json, timeout=self._convert_timeout(timeout))
+
+    @contextmanager
+    def stream_post(self, url, headers=None, json=None, timeout=None):
+        """
+        发送POST请求并以流的方式读取响应体，退出上下文时关闭响应（提前退出即中断读取）
+
+        Args:
+            url (str): 请求地址
+            headers (dict): 请求头
+            json (dict): JSON请求体
+            timeout (float|tuple): 超时时间(秒)，或(连接超时, 读取超时)
+
+        Yields:
+            StreamResponse: 提供status_code/headers/text/iter_lines()
+        """
+        if self.http2:
+            with self._client.stream(
+                'POST', url, headers=headers, json=json, timeout=self._convert_timeout(timeout)
+            ) as response:
+                yield StreamResponse(response, response.iter_lines, response.read)
+        else:
+            response = self._client.post(url, headers=headers, json=json, timeout=timeout, stream=True)
+            try:
+                yield StreamResponse(
+                    response,
+                    # 按到达的数据块读取（默认512字节缓冲会推迟提前结束）；
+                    # SSE响应通常不声明charset，按字节返回由调用方以UTF-8解码
+                    lambda: response.iter_lines(chunk_size=None),
+                    lambda: response.content
+                )
+            finally:
+                response.close()
+
+    def close(self):
+        """
+        关闭客户端并释放连接
+        """
+        self._client.close()
+
+class StreamResponse:
+    """
+    流式响应的统一封装（requests与httpx的流式接口不同）
+    """
+
+    def __init__(self, response, iter_lines, read):
+        """
+        Args:
+            response: 底层响应对象
+            iter_lines (callable): 返回逐行迭代器的函数
+            read (callable): 读取完整响应体的函数
+        """
+        self.status_code = response.status_code
+        self.headers = response.headers
+        self._response = response
+        self._iter_lines = iter_lines
+        self._read = read
+
+    @property
+    def text(self):
+        # 读取完整响应体，只应在非流式内容（如错误响应）上使用
+        self._read()
+        return self._response.text
+
+    def iter_lines(self):
+        return self._iter_lines()
+
+_client = None
+_client_lock = threading.Lock()
+
+def get_http_client():
+    """
+    获取进程内共享的HTTP客户端，首次调用时按HTTP_CONFIG创建
+
+    Returns:
+        HttpClient: 共享客户端
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = HttpClient(
+                    pool_size=HTTP_CONFIG['pool_size'],
+                    http2=HTTP_CONFIG['http2']
+                )
+    return _client
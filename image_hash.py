@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+"""
+复杂图文逻辑推理挑战赛 - 图像感知哈希
+对图像计算64位感知哈希（均值哈希aHash、差值哈希dHash、DCT哈希pHash）：
+内容相同或相近的图像（缩放、压缩、轻微修改）哈希接近，以汉明距离衡量图像相似度
+"""
+
+import threading
+
+import numpy as np
+from PIL import Image
+
+from app_logging import get_logger
+from similarity import POPCOUNT_TABLE
+
+logger = get_logger('image_hash')
+
+# 哈希位数 = HASH_SIZE * HASH_SIZE
+HASH_SIZE = 8
+HASH_BITS = HASH_SIZE * HASH_SIZE
+
+# pHash先缩小到该边长再做DCT，取左上角HASH_SIZE×HASH_SIZE的低频系数
+PHASH_IMAGE_SIZE = 32
+
+def _grayscale_pixels(image_path, size):
+    """
+    读取图像并缩小为灰度像素矩阵
+
+    Args:
+        image_path (str): 图像路径
+        size (tuple): (宽, 高)
+
+    Returns:
+        np.ndarray: 形状为(高, 宽)的float64矩阵，读取失败返回None
+    """
+    try:
+        with Image.open(image_path) as image:
+            # JPEG可在解码时直接缩小，大图只解码一部分像素
+            image.draft('L', (size[0] * 4, size[1] * 4))
+            return np.asarray(image.convert('L').resize(size, Image.LANCZOS), dtype=np.float64)
+    except Exception as e:
+        logger.warning("图像哈希计算失败 %s: %s", image_path, e)
+        return None
+
+def pixel_mse(path_a, path_b, size=64):
+    """
+    将两张图像缩小为同样大小的灰度图后计算像素均方误差，用于确认哈希相近的图像内容确实相同
+
+    Args:
+        path_a (str): 图像路径
+        path_b (str): 图像路径
+        size (int): 比较前缩小到的边长
+
+    Returns:
+        float: 均方误差（像素值0-255），任一图像读取失败返回None
+    """
+    pixels_a = _grayscale_pixels(path_a, (size, size))
+    pixels_b = _grayscale_pixels(path_b, (size, size))
+    if pixels_a is None or pixels_b is None:
+        return None
+    return float(np.mean((pixels_a - pixels_b) ** 2))
+
+def _bits_to_int(bits):
+    return int.from_bytes(np.packbits(bits.flatten()).tobytes(), 'big')
+
+def ahash(image_path, hash_size=HASH_SIZE):
+    """
+    计算图像的均值哈希：缩小为hash_size×hash_size灰度图，与平均亮度比较
+
+    Args:
+        image_path (str): 图像路径
+        hash_size (int): 哈希边长，hash_size=8时为64位
+
+    Returns:
+        int: 哈希值，读取失败返回None
+    """
+    pixels = _grayscale_pixels(image_path, (hash_size, hash_size))
+    if pixels is None:
+        return None
+    return _bits_to_int(pixels > pixels.mean())
+
+def dhash(image_path, hash_size=HASH_SIZE):
+    """
+    计算图像的差值哈希：缩小为(hash_size+1)×hash_size灰度图，比较每行相邻像素的明暗
+
+    Args:
+        image_path (str): 图像路径
+        hash_size (int): 哈希边长，hash_size=8时为64位
+
+    Returns:
+        int: 哈希值，读取失败返回None
+    """
+    pixels = _grayscale_pixels(image_path, (hash_size + 1, hash_size))
+    if pixels is None:
+        return None
+    return _bits_to_int(pixels[:, 1:] > pixels[:, :-1])
+
+def _dct_matrix(size):
+    # 正交DCT-II变换矩阵，二维DCT为 C @ X @ C.T
+    k = np.arange(size)[:, None]
+    n = np.arange(size)[None, :]
+    matrix = np.sqrt(2.0 / size) * np.cos(np.pi * (2 * n + 1) * k / (2 * size))
+    matrix[0] /= np.sqrt(2.0)
+    return matrix
+
+_DCT_MATRIX = _dct_matrix(PHASH_IMAGE_SIZE)
+
+def phash(image_path, hash_size=HASH_SIZE):
+    """
+    计算图像的DCT哈希：缩小为32×32灰度图做二维DCT，低频系数与其中位数比较；
+    对亮度、对比度调整和压缩比aHash/dHash更稳定
+
+    Args:
+        image_path (str): 图像路径
+        hash_size (int): 哈希边长，hash_size=8时为64位
+
+    Returns:
+        int: 哈希值，读取失败返回None
+    """
+    pixels = _grayscale_pixels(image_path, (PHASH_IMAGE_SIZE, PHASH_IMAGE_SIZE))
+    if pixels is None:
+        return None
+    low = (_DCT_MATRIX @ pixels @ _DCT_MATRIX.T)[:hash_size, :hash_size]
+    # 直流分量只反映平均亮度，不参与中位数
+    return _bits_to_int(low > np.median(low.flatten()[1:]))
+
+# 可选的哈希算法
+HASH_FUNCTIONS = {
+    'ahash': ahash,
+    'dhash': dhash,
+    'phash': phash
+}
+
+def compute_hash(image_path, method='dhash'):
+    """
+    按指定算法计算图像的64位感知哈希
+
+    Args:
+        image_path (str): 图像路径
+        method (str): 'ahash'、'dhash'或'phash'
+
+    Returns:
+        int: 哈希值，读取失败返回None
+    """
+    if method not in HASH_FUNCTIONS:
+        raise ValueError(f"未知的图像哈希算法: {method}")
+    return HASH_FUNCTIONS[method](image_path)
+
+def hamming_distances(image_hash, hashes):
+    """
+    一对多计算64位哈希的汉明距离
+
+    Args:
+        image_hash (int): 查询哈希
+        hashes (np.ndarray): uint64哈希数组
+
+    Returns:
+        np.ndarray: 汉明距离数组
+    """
+    diff = np.bitwise_xor(np.asarray(hashes, dtype=np.uint64), np.uint64(image_hash))
+    return POPCOUNT_TABLE[diff.view(np.uint8)].reshape(len(diff), 8).sum(axis=1, dtype=np.int64)
+
+_hash_cache = {}
+_hash_cache_lock = threading.Lock()
+
+def cached_dhash(image_path):
+    """
+    带进程内缓存的dHash，同一图像的多个问题只计算一次
+
+    Args:
+        image_path (str): 图像路径
+
+    Returns:
+        int: 哈希值，读取失败返回None
+    """
+    with _hash_cache_lock:
+        if image_path in _hash_cache:
+            return _hash_cache[image_path]
+    value = dhash(image_path)
+    with _hash_cache_lock:
+        _hash_cache[image_path] = value
+    return value
@@ -0,0 +1,288 @@
+# -*- coding: utf-8 -*-
+"""
+复杂图文逻辑推理挑战赛 - 图像感知哈希索引
+并发计算图像目录中所有图像的感知哈希，保存为紧凑的数组索引；
+按汉明距离查找重复或近似重复的候选图像，经字节比较或缩小后的像素均方误差确认后，
+将每组近似重复图像映射到同一张代表图像，使第一阶段对它们共享图像编码、合并请求与响应缓存
+"""
+
+import filecmp
+import json
+import os
+import threading
+from pathlib import Path
+
+import numpy as np
+
+from app_logging import get_logger
+from config import DATA_PATHS, IMAGE_INDEX_CONFIG
+from executor import run_ordered
+from image_hash import HASH_FUNCTIONS, compute_hash, hamming_distances, pixel_mse
+from utils import atomic_directory
+
+logger = get_logger('image_index')
+
+# 索引格式版本，修改文件内容时需同步修改
+INDEX_VERSION = 1
+
+# 可用于合并近似重复图像（以代表图像替代）的哈希算法；aHash在文字截图上误判较多
+DEDUPE_METHODS = {'phash'}
+
+# 参与索引的图像扩展名
+IMAGE_EXTENSIONS = {'.png', '.jpg', '.jpeg', '.webp', '.bmp', '.gif'}
+
+# 索引文件
+HASHES_FILE = 'hashes.npy'
+VALID_FILE = 'valid.npy'
+META_FILE = 'meta.json'
+
+def list_images(image_dir):
+    """
+    列出图像目录中的所有图像
+
+    Args:
+        image_dir (str): 图像目录
+
+    Returns:
+        list: 相对image_dir的路径（与数据中的image字段一致），按名称排序
+    """
+    base = Path(image_dir)
+    if not base.exists():
+        return []
+    return sorted(
+        path.relative_to(base).as_posix()
+        for path in base.rglob('*')
+        if path.suffix.lower() in IMAGE_EXTENSIONS and path.is_file()
+    )
+
+class ImageHashIndex:
+    """
+    图像目录的感知哈希索引：names[i]的哈希为hashes[i]，首次使用时加载（缺失或图像集变化时重建），线程安全
+    """
+
+    def __init__(self, index_dir, image_dir, config=None):
+        """
+        Args:
+            index_dir (str): 索引目录
+            image_dir (str): 图像目录
+            config (dict): 索引配置，默认IMAGE_INDEX_CONFIG
+        """
+        config = config or IMAGE_INDEX_CONFIG
+        if config['method'] not in HASH_FUNCTIONS:
+            raise ValueError(f"未知的图像哈希算法: {config['method']}")
+        self.index_dir = index_dir
+        self.image_dir = image_dir
+        self.method = config['method']
+        self.threshold = config['threshold']
+        self.verify_size = config['verify_size']
+        self.max_mse = config['max_mse']
+        self.max_workers = config['max_workers']
+        self.names = None
+        self.hashes = None
+        self.valid = None
+        self._positions = None
+        self._canonical = None
+        self._lock = threading.Lock()
+
+    def build(self):
+        """
+        并发计算图像目录中所有图像的哈希并保存
+
+        Returns:
+            int: 索引的图像数
+        """
+        names = list_images(self.image_dir)
+        values = run_ordered(
+            lambda name: compute_hash(os.path.join(self.image_dir, name), self.method),
+            names,
+            max_workers=self.max_workers,
+            desc="计算图像哈希"
+        )
+        hashes = np.array([value or 0 for value in values], dtype=np.uint64)
+        valid = np.array([value is not None for value in values], dtype=bool)
+
+        # 写入临时目录后整体替换，同时构建的其他进程不会读到写了一半的索引
+        with atomic_directory(self.index_dir) as temp_dir:
+            np.save(os.path.join(temp_dir, HASHES_FILE), hashes)
+            np.save(os.path.join(temp_dir, VALID_FILE), valid)
+            meta = {'version': INDEX_VERSION, 'method': self.method, 'names': names}
+            with open(os.path.join(temp_dir, META_FILE), 'w', encoding='utf-8') as f:
+                json.dump(meta, f, ensure_ascii=False)
+
+        logger.info("图像哈希索引已构建: %d 张图像（%s），保存到 %s", len(names), self.method, self.index_dir)
+        self._set(names, hashes, valid)
+        return len(names)
+
+    def _set(self, names, hashes, valid):
+        self.names = names
+        self.hashes = hashes
+        self.valid = valid
+        self._positions = {name: i for i, name in enumerate(names)}
+        self._canonical = None
+
+    def _read_meta(self):
+        meta_path = os.path.join(self.index_dir, META_FILE)
+        if not os.path.exists(meta_path):
+            return None
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        if (
+            meta.get('version') != INDEX_VERSION
+            or meta.get('method') != self.method
+            or meta.get('names') != list_images(self.image_dir)
+        ):
+            return None
+        return meta
+
+    def _load(self):
+        if self.names is not None:
+            return
+        with self._lock:
+            if self.names is not None:
+                return
+            meta = self._read_meta()
+            if meta is None:
+                self.build()
+                return
+            self._set(
+                meta['names'],
+                np.load(os.path.join(self.index_dir, HASHES_FILE)),
+                np.load(os.path.join(self.index_dir, VALID_FILE))
+            )
+
+    def __len__(self):
+        self._load()
+        return len(self.names)
+
+    def lookup(self, image_hash, threshold=None):
+        """
+        查找与给定哈希的汉明距离不超过阈值的图像
+
+        Args:
+            image_hash (int): 查询哈希（与索引使用相同算法）
+            threshold (int): 汉明距离阈值，默认按配置
+
+        Returns:
+            list: [(图像, 距离), ...]，按距离从近到远排列
+        """
+        self._load()
+        threshold = self.threshold if threshold is None else threshold
+        distances = hamming_distances(image_hash, self.hashes)
+        matched = np.nonzero(self.valid & (distances <= threshold))[0]
+        matched = matched[np.argsort(distances[matched], kind='stable')]
+        return [(self.names[i], int(distances[i])) for i in matched]
+
+    def images_match(self, image_a, image_b):
+        """
+        确认两张哈希相近的图像内容相同：文件字节相同，或缩小后的像素均方误差不超过max_mse
+
+        Args:
+            image_a (str): 相对image_dir的图像路径
+            image_b (str): 相对image_dir的图像路径
+
+        Returns:
+            bool: 是否可以互相替代
+        """
+        if image_a == image_b:
+            return True
+        path_a = os.path.join(self.image_dir, image_a)
+        path_b = os.path.join(self.image_dir, image_b)
+        try:
+            if filecmp.cmp(path_a, path_b, shallow=False):
+                return True
+        except OSError:
+            return False
+        mse = pixel_mse(path_a, path_b, self.verify_size)
+        return mse is not None and mse <= self.max_mse
+
+    def _build_canonical(self):
+        # 按名称顺序贪心聚类：尚未归组的图像与其阈值内、且经像素比较确认的其他未归组图像成为一组，以它作为代表
+        canonical = {}
+        assigned = ~self.valid.copy()
+        for i in np.nonzero(self.valid)[0]:
+            if assigned[i]:
+                continue
+            candidates = np.nonzero(~assigned & (hamming_distances(int(self.hashes[i]), self.hashes) <= self.threshold))[0]
+            members = [j for j in candidates if self.images_match(self.names[i], self.names[j])]
+            for j in members:
+                canonical[self.names[j]] = self.names[i]
+            assigned[members] = True
+        return canonical
+
+    def canonical(self, image):
+        """
+        获取图像所在近似重复组的代表图像
+
+        Args:
+            image (str): 相对image_dir的图像路径（数据中的image字段）
+
+        Returns:
+            str: 代表图像，没有近似重复或无法计算哈希时返回image本身
+        """
+        self._load()
+        with self._lock:
+            if self._canonical is None:
+                self._canonical = self._build_canonical()
+            if image in self._canonical:
+                return self._canonical[image]
+        if image in self._positions:
+            # 已在索引中但哈希计算失败
+            return image
+
+        # 索引之后新增的图像：与哈希相近的已有图像逐一确认
+        image_hash = compute_hash(os.path.join(self.image_dir, image), self.method)
+        matches = self.lookup(image_hash) if image_hash is not None else []
+        result = image
+        for name, _ in matches:
+            representative = self._canonical.get(name, name)
+            if self.images_match(image, representative):
+                result = representative
+                break
+        with self._lock:
+            self._canonical[image] = result
+        return result
+
+    def duplicate_groups(self):
+        """
+        列出所有近似重复组
+
+        Returns:
+            dict: {代表图像: [组内图像, ...]}，只包含两张及以上的组
+        """
+        self._load()
+        groups = {}
+        for image in self.names:
+            groups.setdefault(self.canonical(image), []).append(image)
+        return {key: members for key, members in groups.items() if len(members) > 1}
+
+_index = None
+_index_lock = threading.Lock()
+
+def get_image_index():
+    """
+    获取进程内共享的图像哈希索引（只创建对象，首次使用时才加载）
+
+    Returns:
+        ImageHashIndex: 索引，未启用近似重复合并时返回None
+    """
+    global _index
+    if not IMAGE_INDEX_CONFIG['dedupe']:
+        return None
+    if IMAGE_INDEX_CONFIG['method'] not in DEDUPE_METHODS:
+        raise ValueError(
+            f"合并近似重复图像只支持 {sorted(DEDUPE_METHODS)}，当前为 {IMAGE_INDEX_CONFIG['method']}"
+        )
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = ImageHashIndex(IMAGE_INDEX_CONFIG['index_dir'], DATA_PATHS['image_dir'])
+    return _index
+
+if __name__ == "__main__":
+    # 构建索引并列出近似重复图像：python image_index.py
+    index = ImageHashIndex(IMAGE_INDEX_CONFIG['index_dir'], DATA_PATHS['image_dir'])
+    index.build()
+    groups = index.duplicate_groups()
+    print(f"近似重复图像: {len(groups)} 组，共 {sum(len(members) for members in groups.values())} 张")
+    for key, members in groups.items():
+        print(f"  {key}: {', '.join(member for member in members if member != key)}")
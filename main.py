@@ -8,40 +8,377 @@
 import os
 import json
 import time
-import requests
+import argparse
+import queue
+import threading
+from contextlib import contextmanager, nullcontext
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
 from tqdm import tqdm
-from datetime import datetime
 
-from config import XUNFEI_CONFIG, DATA_PATHS, MODEL_CONFIG, VISION_MODEL_CONFIG, TEXT_MODEL_CONFIG
+from config import DATA_PATHS, MODEL_CONFIG, VISION_MODEL_CONFIG, TEXT_MODEL_CONFIG, RETRIEVAL_CONFIG, METRICS_CONFIG, LOG_CONFIG
 from utils import *
+from executor import run_ordered
+from http_client import get_http_client
+from rate_limiter import get_rate_limiter, estimate_request_tokens, is_throttled, parse_retry_after
+from response_cache import get_response_cache, make_cache_key
+from retry import APIError, ERROR_MODERATION, ERROR_TIMEOUT, ERROR_CONNECTION, classify_exception, default_retry_policy, extract_message_content, raise_for_response
+from circuit_breaker import CircuitOpenError, get_circuit_breaker
+from hedging import get_hedger
+from streaming import extract_early_answer, iter_chat_chunks
+from token_budget import TokenUsage, fit_description, max_tokens_for
+from image_index import get_image_index
+from app_logging import current_items, get_logger, set_log_file, trace_items
+from metrics import get_metrics
+from retrieval_index import get_retrieval_index
+from scheduler import WorkScheduler, get_endpoint_slots
+from router import QuestionRouter, ROUTE_SINGLE, ROUTE_TWO_STAGE, ROUTE_ESCALATED, summarize_routes
+from sharding import apply_model_overrides, merge_shard_outputs, parse_shard_count, parse_shard_spec, select_shard, shard_output_path, shard_path
+from checkpoint import CheckpointStore, STAGE_VISION, STAGE_TEXT, STATUS_DONE, STATUS_FAILED, STATUS_REJECTED, STATUS_PARKED
 
-class XunfeiVisionAPI:
+logger = get_logger('main')
+
+# 提示词模板版本，修改提示词时需同步更新，使旧的缓存结果失效
+VISION_PROMPT_VERSION = 'vision-v1'
+VISION_BATCH_PROMPT_VERSION = 'vision-batch-v1'
+VISION_DIRECT_PROMPT_VERSION = 'vision-direct-v1'
+TEXT_PROMPT_VERSION = 'text-v1'
+
+# 视觉API失败时返回的结果（本地错误以"错误："开头）
+VISION_REJECTED_RESULT = "内容审核限制，无法处理此图片"
+VISION_FAILURE_RESULTS = ("图像理解失败", VISION_REJECTED_RESULT, "API调用异常，无法处理此图片")
+
+# 接口熔断期间暂缓处理的条目（两个阶段通用），接口恢复后补跑，不使用默认答案
+PARKED_RESULT = "暂缓处理：接口熔断中"
+
+def is_vision_failure(understanding):
+    """
+    判断第一阶段结果是否为失败
+    
+    Args:
+        understanding (str): 图像理解结果
+        
+    Returns:
+        bool: 是否失败
+    """
+    return (
+        not understanding
+        or understanding.startswith("错误：")
+        or understanding in VISION_FAILURE_RESULTS
+        or understanding == PARKED_RESULT
+    )
+
+def parse_batch_analyses(content, count):
+    """
+    从批量视觉理解的输出中按问题编号拆分结果
+    
+    Args:
+        content (str): 模型输出，应为{"1": "...", "2": "..."}形式的JSON
+        count (int): 问题数量
+        
+    Returns:
+        list: 按编号排列的分析结果，缺失或无法解析的为None
+    """
+    start = content.find('{')
+    end = content.rfind('}')
+    if start == -1 or end <= start:
+        return [None] * count
+    try:
+        parsed = json.loads(content[start:end + 1])
+    except json.JSONDecodeError:
+        return [None] * count
+    if not isinstance(parsed, dict):
+        return [None] * count
+    
+    analyses = []
+    for i in range(1, count + 1):
+        analysis = parsed.get(str(i))
+        if isinstance(analysis, (dict, list)):
+            analysis = json.dumps(analysis, ensure_ascii=False)
+        analyses.append(str(analysis).strip() if analysis else None)
+    return analyses
+
+class XunfeiChatAPI:
+    """
+    讯飞MaaS对话接口客户端基类，负责鉴权、限流、熔断、对冲请求、连接复用、响应缓存与指标记录
+    """
+    
+    # 指标中的阶段名，由子类设置
+    stage = None
+    
+    def __init__(self, model_config):
+        self.api_key = model_config['api_key']
+        self.api_url = model_config['api_url']
+        self.model_id = model_config['model_id']
+        # 同一模型的所有客户端实例与并发线程共享一个限流器
+        self.rate_limiter = get_rate_limiter(
+            f"{self.api_url}#{self.model_id}", model_config.get('rate_limit')
+        )
+        self.circuit_breaker = get_circuit_breaker(
+            f"{self.api_url}#{self.model_id}", model_config.get('circuit_breaker')
+        )
+        self.hedger = get_hedger(f"{self.api_url}#{self.model_id}", model_config.get('hedging'))
+        # 同一接口地址的所有模型与线程共享并发上限
+        self.endpoint_slots = get_endpoint_slots(self.api_url)
+        self.response_cache = get_response_cache()
+        self.metrics = get_metrics()
+        self.retry_policy = default_retry_policy(MODEL_CONFIG)
+        self.timeout = (MODEL_CONFIG['connect_timeout'], MODEL_CONFIG['read_timeout'])
+        
+    def _cache_get(self, cache_key):
+        """
+        读取响应缓存，未启用缓存时返回None
+        """
+        if not self.response_cache:
+            return None
+        content = self.response_cache.get(cache_key)
+        if self.metrics:
+            self.metrics.record_cache(self.stage, content is not None)
+        return content
+        
+    def _cache_put(self, cache_key, content):
+        """
+        写入响应缓存，只应写入成功的响应
+        """
+        if self.response_cache:
+            self.response_cache.put(cache_key, content)
+        
+    def _headers(self):
+        return {
+            'Authorization': f'Bearer {self.api_key}',
+            'Content-Type': 'application/json'
+        }
+        
+    @contextmanager
+    def _admitted(self, estimated_tokens, items=None):
+        """
+        请求发出前的本地等待：先取得接口地址的并发名额，再按限流配额等待，退出时归还名额；
+        这段等待单独记录为local_wait，不计入请求耗时指标、对冲等待时间与延迟统计
+        
+        Args:
+            estimated_tokens (int): 本次请求的预估token数
+            items (list): 数据条目id，用于指标
+            
+        Raises:
+            CircuitOpenError: 接口熔断中（不占用名额与配额）
+        """
+        if self.circuit_breaker:
+            retry_in = self.circuit_breaker.time_until_probe()
+            if retry_in > 0:
+                raise CircuitOpenError(self.circuit_breaker.name, retry_in)
+        start = time.perf_counter()
+        with self.endpoint_slots or nullcontext():
+            if self.rate_limiter:
+                self.rate_limiter.acquire(estimated_tokens)
+            if self.metrics:
+                self.metrics.record_wait(self.stage, time.perf_counter() - start, items)
+            yield
+        
+    def _record_response(self, response, estimated_tokens, usage=None):
+        """
+        根据响应调整限流速率，并用实际token用量修正预估值
+        """
+        if not self.rate_limiter:
+            return
+        if response.status_code == 200:
+            self.rate_limiter.on_success()
+            self.rate_limiter.record_usage(estimated_tokens, (usage or {}).get('total_tokens'))
+        elif is_throttled(response.status_code, response.text):
+            logger.warning("触发限流，降低请求速率: %s", self.model_id)
+            self.rate_limiter.on_throttled(parse_retry_after(response.headers))
+        
+    def _post_chat(self, data, estimated_tokens, timeout=None, trace=None):
+        """
+        发送chat/completions请求，并根据响应调整限流速率；限流等待由调用方通过_admitted完成。
+        响应体只解析一次，不是JSON时同样记录响应，由调用方按格式错误处理
+        
+        Args:
+            data (dict): 请求体
+            estimated_tokens (int): 本次请求的预估token数
+            timeout (float|tuple): 超时时间(秒)或(连接超时, 读取超时)，默认按MODEL_CONFIG
+            trace (CallTrace): 本次请求的指标记录，可选
+            
+        Returns:
+            tuple: (响应对象, 响应JSON，状态码不是200或响应体不是JSON时为None)
+        """
+        response = get_http_client().post(
+            f"{self.api_url}/chat/completions",
+            headers=self._headers(),
+            json=data,
+            timeout=timeout or self.timeout
+        )
+        if trace:
+            # 非流式响应在模型生成完毕后才返回，首字节时间即收到响应头的时间
+            elapsed = getattr(response, 'elapsed', None)
+            trace.first_byte(elapsed.total_seconds() if elapsed is not None else None)
+        
+        result = None
+        if response.status_code == 200:
+            try:
+                result = response.json()
+            except ValueError:
+                logger.warning("响应体不是有效的JSON: %s", self.model_id)
+        usage = result.get('usage') if isinstance(result, dict) else None
+        self._record_response(response, estimated_tokens, usage)
+        return response, result
+        
+    def _stream_chat(self, data, estimated_tokens, stop_when=None, token_usage=None, trace=None):
+        """
+        以流式(SSE)发送chat/completions请求并逐段累积输出；
+        stop_when判断已有完整答案时立即断开连接，不再等待剩余输出
+        
+        Args:
+            data (dict): 请求体，包含"stream": True
+            estimated_tokens (int): 本次请求的预估token数，限流等待由调用方通过_admitted完成
+            stop_when (callable): stop_when(目前的输出) -> 截断后的输出，答案不完整时返回None
+            token_usage (TokenUsage): 累计本次调用消耗的token，可选
+            trace (CallTrace): 本次请求的指标记录，可选
+            
+        Returns:
+            str: 模型输出内容（提前结束时为截断后的输出）
+            
+        Raises:
+            APIError: 响应状态不是200
+        """
+        content = None
+        usage = None
+        with get_http_client().stream_post(
+            f"{self.api_url}/chat/completions",
+            headers=self._headers(),
+            json=data,
+            timeout=self.timeout
+        ) as response:
+            logger.debug("API响应状态码: %s", response.status_code)
+            if response.status_code != 200:
+                self._record_response(response, estimated_tokens)
+                raise_for_response(response)
+            
+            parts = []
+            for delta, chunk_usage in iter_chat_chunks(response.iter_lines()):
+                if trace and delta:
+                    trace.first_byte()
+                parts.append(delta)
+                usage = chunk_usage or usage
+                if stop_when and delta:
+                    content = stop_when(''.join(parts))
+                    if content is not None:
+                        break
+            if content is None:
+                content = ''.join(parts)
+        
+        self._record_response(response, estimated_tokens, usage)
+        if token_usage is not None:
+            token_usage.add(usage, data, content)
+        if trace:
+            trace.set_output(usage, content)
+        return content
+        
+    def _chat_completion(self, data, stop_when=None, token_usage=None):
+        """
+        发送请求并按重试策略处理失败：内容审核等确定性错误不重试，
+        5xx、超时与限流按指数退避重试；每次尝试都经过熔断器，熔断期间立即失败；
+        启用对冲时，单次尝试发出后超过延迟分位数仍未返回则并行发送相同请求
+        （并发名额与限流配额的等待不计入对冲等待时间）
+        
+        Args:
+            data (dict): 请求体，包含"stream": True时以流式接收
+            stop_when (callable): 流式接收时判断是否已有完整答案，见_stream_chat
+            token_usage (TokenUsage): 累计成功调用消耗的token，可选
+            
+        Returns:
+            str: 模型输出内容
+            
+        Raises:
+            CircuitOpenError: 接口熔断中
+            APIError: 不可重试的错误，或重试次数用尽
+        """
+        # 对冲请求在其他线程中发送，数据条目需在调用线程中取出
+        items = current_items()
+        estimated_tokens = estimate_request_tokens(data)
+        
+        def send():
+            trace = self.metrics.start_call(self.stage, self.model_id, data, items) if self.metrics else None
+            status = 'ok'
+            try:
+                if data.get('stream'):
+                    return self._stream_chat(data, estimated_tokens, stop_when, token_usage, trace)
+                response, result = self._post_chat(data, estimated_tokens, trace=trace)
+                logger.debug("API响应状态码: %s", response.status_code)
+                raise_for_response(response)
+                content = extract_message_content(result)
+                if token_usage is not None:
+                    token_usage.add(result.get('usage'), data, content)
+                if trace:
+                    trace.set_output(result.get('usage'), content)
+                return content
+            except Exception as e:
+                status = classify_exception(e)
+                raise
+            finally:
+                if trace:
+                    trace.finish(status)
+        
+        def guarded_send():
+            if self.circuit_breaker:
+                return self.circuit_breaker.call(send)
+            return send()
+        
+        def admit():
+            return self._admitted(estimated_tokens, items)
+        
+        def attempt():
+            if self.hedger:
+                return self.hedger.call(guarded_send, admit)
+            with admit():
+                return guarded_send()
+        
+        def on_retry(failures, error, wait):
+            logger.warning(
+                "%s 第%d次调用失败（%s）: %.200s，%.1f秒后重试", self.model_id, failures, error.kind, error, wait
+            )
+            if self.metrics:
+                self.metrics.record_retry(self.stage, failures, error.kind, wait, items)
+        
+        return self.retry_policy.call(attempt, on_retry=on_retry)
+
+class XunfeiVisionAPI(XunfeiChatAPI):
     """
     讯飞视觉模型API客户端 (xqwen2d5s32bvl)
     """
     
+    stage = STAGE_VISION
+    
     def __init__(self):
-        self.api_key = VISION_MODEL_CONFIG['api_key']
-        self.api_url = VISION_MODEL_CONFIG['api_url']
-        self.model_id = VISION_MODEL_CONFIG['model_id']
+        super().__init__(VISION_MODEL_CONFIG)
+        
+    @staticmethod
+    def _failure_result(error):
+        """
+        将API错误转换为第一阶段的失败结果
+        """
+        if error.kind == ERROR_MODERATION:
+            logger.info("遇到内容审核限制，跳过此图片")
+            return VISION_REJECTED_RESULT
+        if error.kind in (ERROR_TIMEOUT, ERROR_CONNECTION):
+            return "API调用异常，无法处理此图片"
+        return "图像理解失败"
         
-    def understand_image(self, image_base64, question):
+    def understand_image(self, image_base64, question, mime_type='image/png', token_usage=None):
         """
         使用视觉模型理解图像
         
         Args:
             image_base64 (str): base64编码的图像
             question (str): 问题文本
+            mime_type (str): 图像的MIME类型
+            token_usage (TokenUsage): 累计消耗的token，可选
             
         Returns:
-            str: 图像理解结果，失败返回None
+            str: 图像理解结果，失败时返回失败说明
+            
+        Raises:
+            CircuitOpenError: 接口熔断中，请求未发出
         """
-        headers = {
-            'Authorization': f'Bearer {self.api_key}',
-            'Content-Type': 'application/json'
-        }
-        
         # 构建详细的提示词，要求模型进行深度图像理解
         prompt = f"""
 请仔细观察这张图片，并进行详细的分析和理解：
@@ -78,75 +415,241 @@ class XunfeiVisionAPI:
                         {
                             "type": "image_url",
                             "image_url": {
-                                "url": f"data:image/jpeg;base64,{image_base64}"
+                                "url": f"data:{mime_type};base64,{image_base64}"
                             }
                         }
                     ]
                 }
             ],
-            "max_tokens": 2000,
+            "max_tokens": max_tokens_for(question, 'vision', 2000),
             "temperature": 0.1
         }
         
+        # 相同图像、问题与参数的结果直接从缓存读取
+        cache_key = make_cache_key(
+            self.model_id, VISION_PROMPT_VERSION, question,
+            {'max_tokens': data['max_tokens'], 'temperature': data['temperature']},
+            image=image_base64
+        )
+        cached = self._cache_get(cache_key)
+        if cached is not None:
+            return cached
+        
         try:
-            print(f"正在调用视觉API: {self.api_url}/chat/completions")
-            print(f"使用模型: {self.model_id}")
-            response = requests.post(
-                f"{self.api_url}/chat/completions",
-                headers=headers,
-                json=data,
-                timeout=60
-            )
-            print(f"API响应状态码: {response.status_code}")
+            logger.debug("正在调用视觉API: %s/chat/completions，模型: %s", self.api_url, self.model_id)
+            understanding = self._chat_completion(data, token_usage=token_usage)
+        except CircuitOpenError:
+            raise
+        except APIError as e:
+            logger.warning("视觉API调用失败（%s）: %.200s", e.kind, e)
+            return self._failure_result(e)
+        
+        self._cache_put(cache_key, understanding)
+        return understanding
+    
+    def answer_directly(self, image_base64, question, mime_type='image/png', token_usage=None):
+        """
+        由视觉模型直接回答问题（单阶段，用于简单的查找类问题）
+        
+        Args:
+            image_base64 (str): base64编码的图像
+            question (str): 问题文本
+            mime_type (str): 图像的MIME类型
+            token_usage (TokenUsage): 累计消耗的token，可选
             
-            if response.status_code == 200:
-                result = response.json()
-                if 'choices' in result and len(result['choices']) > 0:
-                    return result['choices'][0]['message']['content']
-                else:
-                    print(f"API响应格式错误: {result}")
-                    return "图像理解失败"
-            else:
-                print(f"API调用失败，状态码: {response.status_code}")
-                response_text = response.text
-                print(f"响应内容: {response_text[:200]}...")  # 只打印前200字符
-                
-                # 检查是否是内容审核错误
-                if "相关法律法规" in response_text or "内容审核" in response_text:
-                    print("遇到内容审核限制，跳过此图片")
-                    return "内容审核限制，无法处理此图片"
-                
-                return "图像理解失败"
-                
-        except Exception as e:
-            print(f"视觉API调用异常: {str(e)}")
-            return "API调用异常，无法处理此图片"
+        Returns:
+            str: 答案，失败返回None
+            
+        Raises:
+            CircuitOpenError: 接口熔断中，请求未发出
+        """
+        prompt = f"""
+仅根据图片中的信息回答问题，不要输出任何与图片无关的内容。
+如果图片中没有回答问题所需的信息，请回答"无法确定"。
+
+问题：{question}
+
+请直接给出简洁明确的答案，不要解释过程。
+"""
+        
+        data = {
+            "model": self.model_id,
+            "messages": [
+                {
+                    "role": "user",
+                    "content": [
+                        {
+                            "type": "text",
+                            "text": prompt
+                        },
+                        {
+                            "type": "image_url",
+                            "image_url": {
+                                "url": f"data:{mime_type};base64,{image_base64}"
+                            }
+                        }
+                    ]
+                }
+            ],
+            "max_tokens": max_tokens_for(question, 'text', 500),
+            "temperature": 0.1
+        }
+        
+        cache_key = make_cache_key(
+            self.model_id, VISION_DIRECT_PROMPT_VERSION, question,
+            {'max_tokens': data['max_tokens'], 'temperature': data['temperature']},
+            image=image_base64
+        )
+        cached = self._cache_get(cache_key)
+        if cached is not None:
+            return cached.strip()
+        
+        try:
+            logger.debug("正在调用视觉API直接作答: %s/chat/completions，模型: %s", self.api_url, self.model_id)
+            content = self._chat_completion(data, token_usage=token_usage)
+        except CircuitOpenError:
+            raise
+        except APIError as e:
+            logger.warning("视觉直接作答失败（%s）: %.200s", e.kind, e)
+            return None
+        
+        self._cache_put(cache_key, content)
+        return content.strip()
+    
+    def understand_image_batch(self, image_base64, questions, mime_type='image/png', token_usage=None):
+        """
+        一次请求分析同一图像的多个问题，按问题拆分返回
+        
+        Args:
+            image_base64 (str): base64编码的图像
+            questions (list): 问题文本列表
+            mime_type (str): 图像的MIME类型
+            token_usage (TokenUsage): 累计消耗的token，可选
+            
+        Returns:
+            list: 与questions对应的图像理解结果，无法拆分出的问题为None
+            
+        Raises:
+            CircuitOpenError: 接口熔断中，请求未发出
+        """
+        question_lines = "\n".join(f"{i}. {question}" for i, question in enumerate(questions, 1))
+        example = ", ".join(f'"{i}": "问题{i}的分析"' for i in range(1, len(questions) + 1))
+        prompt = f"""
+请仔细观察这张图片，并进行详细的分析和理解。下面有多个关于这张图片的问题：
+
+{question_lines}
+
+对每个问题分别给出一段独立、完整的分析：
+- 描述回答该问题所需的图片内容（文字、数字、图形、颜色、人物、物体等）
+- 分析相关元素之间的关系与逻辑
+- 进行初步的逻辑推理
 
-class XunfeiTextAPI:
+请严格按以下JSON格式输出，键为问题编号，不要输出JSON以外的内容：
+{{{example}}}
+"""
+        
+        data = {
+            "model": self.model_id,
+            "messages": [
+                {
+                    "role": "user",
+                    "content": [
+                        {
+                            "type": "text",
+                            "text": prompt
+                        },
+                        {
+                            "type": "image_url",
+                            "image_url": {
+                                "url": f"data:{mime_type};base64,{image_base64}"
+                            }
+                        }
+                    ]
+                }
+            ],
+            "max_tokens": min(
+                sum(
+                    max_tokens_for(question, 'vision', MODEL_CONFIG['vision_batch_tokens_per_question'])
+                    for question in questions
+                ),
+                VISION_MODEL_CONFIG['max_tokens']
+            ),
+            "temperature": 0.1
+        }
+        
+        cache_key = make_cache_key(
+            self.model_id, VISION_BATCH_PROMPT_VERSION, "\n".join(questions),
+            {'max_tokens': data['max_tokens'], 'temperature': data['temperature']},
+            image=image_base64
+        )
+        content = self._cache_get(cache_key)
+        
+        if content is None:
+            try:
+                logger.debug(
+                    "正在调用视觉API（%d个问题）: %s/chat/completions，模型: %s",
+                    len(questions), self.api_url, self.model_id
+                )
+                content = self._chat_completion(data, token_usage=token_usage)
+            except CircuitOpenError:
+                raise
+            except APIError as e:
+                logger.warning("批量视觉API调用失败（%s）: %.200s", e.kind, e)
+                if e.kind == ERROR_MODERATION:
+                    return [self._failure_result(e)] * len(questions)
+                # 其他失败由调用方逐个问题单独请求
+                return [None] * len(questions)
+        
+        analyses = parse_batch_analyses(content, len(questions))
+        if any(analysis is not None for analysis in analyses):
+            self._cache_put(cache_key, content)
+        return analyses
+
+class XunfeiTextAPI(XunfeiChatAPI):
     """
     讯飞文本模型API客户端 (xopgptoss120b)
     """
     
+    stage = STAGE_TEXT
+    
     def __init__(self):
-        self.api_key = TEXT_MODEL_CONFIG['api_key']
-        self.api_url = TEXT_MODEL_CONFIG['api_url']
-        self.model_id = TEXT_MODEL_CONFIG['model_id']
+        super().__init__(TEXT_MODEL_CONFIG)
+        self.stream = TEXT_MODEL_CONFIG.get('stream', False)
+        self.early_stop = TEXT_MODEL_CONFIG.get('early_stop', False)
         
-    def reason_with_text(self, image_understanding, question):
+    @staticmethod
+    def _clean_answer(content):
+        """
+        清理答案，只保留核心内容
+        """
+        answer = content.strip()
+        if '答案：' in answer:
+            answer = answer.split('答案：')[-1].strip()
+        return answer
+        
+    def reason_with_text(self, image_understanding, question, token_usage=None, examples=None):
         """
         基于图像理解结果进行文本推理
         
         Args:
             image_understanding (str): 第一阶段的图像理解结果
             question (str): 问题文本
+            token_usage (TokenUsage): 累计消耗的token，可选
+            examples (list): 训练集中相似问题的少样本示例 [{'question', 'answer'}, ...]，可选
             
         Returns:
             str: 推理结果答案，失败返回None
+            
+        Raises:
+            CircuitOpenError: 接口熔断中，请求未发出
         """
-        headers = {
-            'Authorization': f'Bearer {self.api_key}',
-            'Content-Type': 'application/json'
-        }
+        # 少样本示例只提供答案的格式与粒度参考
+        examples_text = ''
+        if examples:
+            examples_text = "参考示例（训练集中的相似问题及标准答案，仅供参考答案格式）：\n" + "\n".join(
+                f"示例{i}：问题：{example['question']} 答案：{example['answer']}"
+                for i, example in enumerate(examples, 1)
+            ) + "\n\n"
         
         # 构建推理提示词
         prompt = f"""
@@ -155,7 +658,7 @@ class XunfeiTextAPI:
 图像理解结果：
 {image_understanding}
 
-问题：{question}
+{examples_text}问题：{question}
 
 请根据图像理解结果中的信息，进行逻辑推理并给出准确答案。
 
@@ -176,55 +679,305 @@ class XunfeiTextAPI:
                     "content": prompt
                 }
             ],
-            "max_tokens": 500,
+            "max_tokens": max_tokens_for(question, 'text', 500),
             "temperature": 0.1
         }
         
+        params = {'max_tokens': data['max_tokens'], 'temperature': data['temperature']}
+        stop_when = None
+        if self.stream:
+            data['stream'] = True
+            if self.early_stop:
+                # 提前结束时只保留到答案行，与完整输出不同，缓存分开存放
+                stop_when = extract_early_answer
+                params['early_stop'] = True
+        
+        cache_key = make_cache_key(
+            self.model_id, TEXT_PROMPT_VERSION, question, params,
+            context=image_understanding + examples_text
+        )
+        cached = self._cache_get(cache_key)
+        if cached is not None:
+            return self._clean_answer(cached)
+        
         try:
-            print(f"正在调用文本API: {self.api_url}/chat/completions")
-            print(f"使用模型: {self.model_id}")
-            response = requests.post(
-                f"{self.api_url}/chat/completions",
-                headers=headers,
-                json=data,
-                timeout=60
-            )
-            print(f"API响应状态码: {response.status_code}")
-            
-            if response.status_code == 200:
-                result = response.json()
-                if 'choices' in result and len(result['choices']) > 0:
-                    answer = result['choices'][0]['message']['content'].strip()
-                    # 清理答案，只保留核心内容
-                    if '答案：' in answer:
-                        answer = answer.split('答案：')[-1].strip()
-                    return answer
-                else:
-                    print(f"文本推理API响应格式错误: {result}")
-                    return "A"  # 默认返回A
-            else:
-                print(f"文本推理API调用失败，状态码: {response.status_code}")
-                response_text = response.text
-                print(f"响应内容: {response_text[:200]}...")  # 只打印前200字符
-                
-                # 检查是否是内容审核错误
-                if "相关法律法规" in response_text or "内容审核" in response_text:
-                    print("遇到内容审核限制，返回默认答案")
-                
-                return "A"  # 默认返回A
-                
-        except Exception as e:
-            print(f"文本API调用异常: {str(e)}")
-            return "A"  # 默认返回A
+            logger.debug("正在调用文本API: %s/chat/completions，模型: %s", self.api_url, self.model_id)
+            content = self._chat_completion(data, stop_when=stop_when, token_usage=token_usage)
+        except CircuitOpenError:
+            raise
+        except APIError as e:
+            logger.warning("文本推理API调用失败（%s）: %.200s", e.kind, e)
+            if e.kind == ERROR_MODERATION:
+                logger.info("遇到内容审核限制，无法推理")
+            return None
+        
+        self._cache_put(cache_key, content)
+        return self._clean_answer(content)
 
 class TwoStageReasoner:
     """
     两阶段推理器
     """
     
-    def __init__(self):
+    def __init__(self, checkpoint=None, resume=False):
+        """
+        Args:
+            checkpoint (CheckpointStore): 断点续跑存储，None表示不记录
+            resume (bool): 是否跳过检查点中已完成的条目
+        """
         self.vision_api = XunfeiVisionAPI()
         self.text_api = XunfeiTextAPI()
+        self.max_workers = MODEL_CONFIG['max_workers']
+        self.pipeline_queue_size = MODEL_CONFIG['pipeline_queue_size']
+        self.group_by_image = MODEL_CONFIG['group_by_image']
+        self.batch_questions = MODEL_CONFIG['vision_batch_max_questions']
+        self.parked_retry_rounds = MODEL_CONFIG['parked_retry_rounds']
+        self.checkpoint = checkpoint
+        self.resume = resume
+        # 每条数据各阶段实际消耗的token {id: {stage: tokens}}，合并请求按问题数均摊
+        self.token_usage = {}
+        self._token_lock = threading.Lock()
+        # 每条数据的处理路径 {id: route}
+        self.router = QuestionRouter()
+        self.routes = {}
+        # 训练集检索索引，未启用时为None
+        self.retrieval = get_retrieval_index()
+        # 图像感知哈希索引，合并近似重复图像；未启用时为None
+        self.image_index = get_image_index()
+        self.metrics = get_metrics()
+        # 请求提交顺序：失败条目优先，其余按预估耗时从长到短
+        self.scheduler = WorkScheduler(checkpoint)
+        
+    def _split_completed(self, rows, stage):
+        """
+        续跑时从检查点取出已完成条目的结果，其余条目待处理
+        
+        Args:
+            rows (list): 数据行列表
+            stage (str): 阶段名称
+            
+        Returns:
+            tuple: ({id: result}, 待处理的数据行列表)
+        """
+        completed = {}
+        pending = []
+        for row in rows:
+            if self.resume and self.checkpoint and self.checkpoint.is_done(row['id'], stage):
+                completed[row['id']] = self.checkpoint.get(row['id'], stage)['result']
+            else:
+                pending.append(row)
+        
+        if completed:
+            logger.info("续跑：跳过已完成的 %d 条，待处理 %d 条", len(completed), len(pending))
+        return completed, pending
+    
+    def _vision_image(self, row):
+        """
+        第一阶段实际使用的图像：启用近似重复合并时为所在组的代表图像，否则为数据行的image字段
+        """
+        if self.image_index is None:
+            return row['image']
+        return self.image_index.canonical(row['image'])
+    
+    def _report_shared_images(self, rows):
+        """
+        统计共享同一图像的数据行（这些图像只读取和编码一次）
+        """
+        groups = group_rows_by_image(rows, key=self._vision_image)
+        if len(groups) < len(rows):
+            logger.info("%d 条数据共使用 %d 张图像，共享图像只编码一次", len(rows), len(groups))
+        if self.image_index is not None:
+            merged = len({row['image'] for row in rows}) - len(groups)
+            if merged:
+                logger.info("近似重复图像合并：%d 张图像复用其代表图像的编码与缓存", merged)
+        
+    def _encode_image(self, image_path):
+        """
+        预处理并编码图像，记录编码耗时与大小
+        
+        Returns:
+            tuple: (base64字符串, MIME类型)，失败返回(None, None)
+        """
+        start = time.perf_counter()
+        image_base64, mime_type = encode_image_for_api(image_path)
+        if self.metrics:
+            self.metrics.record_encode(time.perf_counter() - start, len(image_base64 or ''))
+        return image_base64, mime_type
+        
+    def _understand_row(self, row, image_dir, token_usage=None):
+        """
+        对单条数据进行视觉理解
+        
+        Args:
+            row (dict): 数据行
+            image_dir (str): 图像目录
+            token_usage (TokenUsage): 累计消耗的token，可选
+            
+        Returns:
+            str: 图像理解结果，本地错误以"错误："开头
+        """
+        image = self._vision_image(row)
+        image_path = validate_image_path(image, image_dir)
+        if not image_path:
+            return f"错误：图像文件不存在 - {image}"
+        
+        # 预处理并编码图像
+        image_base64, mime_type = self._encode_image(image_path)
+        if not image_base64:
+            return "错误：图像编码失败"
+        
+        # 调用视觉API
+        return self.vision_api.understand_image(image_base64, row['question'], mime_type, token_usage)
+    
+    def _answer_row_directly(self, row, image_dir):
+        """
+        由视觉模型直接回答单条数据
+        
+        Returns:
+            str: 答案，失败返回None，接口熔断时返回PARKED_RESULT
+        """
+        with trace_items([row['id']]):
+            image_path = validate_image_path(self._vision_image(row), image_dir)
+            if not image_path:
+                return None
+            image_base64, mime_type = self._encode_image(image_path)
+        if not image_base64:
+            return None
+        
+        # 直接作答的token计入视觉阶段
+        token_usage = TokenUsage()
+        try:
+            with trace_items([row['id']]):
+                return self.vision_api.answer_directly(image_base64, row['question'], mime_type, token_usage)
+        except CircuitOpenError as e:
+            logger.warning("视觉接口熔断，暂缓 %s: %s", row['id'], e)
+            return PARKED_RESULT
+        finally:
+            self._record_tokens([row], STAGE_VISION, token_usage)
+    
+    def _route_rows(self, rows, image_dir):
+        """
+        按问题路由：简单问题先由视觉模型直接作答，答案不可用时升级为两阶段
+        
+        Args:
+            rows (list): 数据行列表
+            image_dir (str): 图像目录
+            
+        Returns:
+            tuple: (直接作答得到的{id: answer}, 需要走两阶段的数据行列表)
+        """
+        single, two_stage = [], []
+        for row in rows:
+            if self.resume and self.checkpoint and self.checkpoint.is_done(row['id'], STAGE_VISION):
+                # 第一阶段已完成的条目只差文本推理，继续走两阶段
+                two_stage.append(row)
+            elif self.router.route(row['question']) == ROUTE_SINGLE:
+                single.append(row)
+            else:
+                two_stage.append(row)
+        for row in two_stage:
+            self.routes.setdefault(row['id'], ROUTE_TWO_STAGE)
+        if not single:
+            return {}, two_stage
+        
+        answers, pending = self._split_completed(single, STAGE_TEXT)
+        logger.info("问题路由：%d 条由视觉模型直接作答，%d 条走两阶段", len(single), len(two_stage))
+        
+        escalated = []
+        
+        def save_direct(index, row, answer):
+            if answer != PARKED_RESULT and self.router.needs_escalation(answer):
+                self.routes[row['id']] = ROUTE_ESCALATED
+                escalated.append(row)
+                return
+            self.routes[row['id']] = ROUTE_SINGLE
+            answers[row['id']] = answer
+            self._save_answer(row, answer)
+        
+        run_ordered(
+            lambda row: self._answer_row_directly(row, image_dir),
+            self.scheduler.order(pending, STAGE_VISION, image_dir),
+            max_workers=self.max_workers,
+            desc="直接作答",
+            on_result=save_direct
+        )
+        
+        if escalated:
+            logger.info("问题路由：%d 条直接作答不可用，升级为两阶段", len(escalated))
+        return answers, two_stage + escalated
+    
+    def _vision_units(self, rows):
+        """
+        划分第一阶段的请求单元：默认每条数据一个请求；
+        按图像分组时，同一图像（含合并的近似重复图像）的问题（每组最多batch_questions个）合并为一个请求
+        
+        Args:
+            rows (list): 数据行列表
+            
+        Returns:
+            list: 请求单元列表，每个单元是数据行列表
+        """
+        if not self.group_by_image:
+            return [[row] for row in rows]
+        
+        units = []
+        for group in group_rows_by_image(rows, key=self._vision_image).values():
+            for start in range(0, len(group), self.batch_questions):
+                units.append(group[start:start + self.batch_questions])
+        return units
+    
+    def _understand_unit(self, rows, image_dir):
+        """
+        对一个请求单元进行视觉理解，多个问题时一次上传图像、合并请求
+        
+        Args:
+            rows (list): 共享同一图像的数据行
+            image_dir (str): 图像目录
+            
+        Returns:
+            list: 与rows对应的图像理解结果，接口熔断时为PARKED_RESULT
+        """
+        token_usage = TokenUsage()
+        try:
+            with trace_items([row['id'] for row in rows]):
+                return self._request_unit(rows, image_dir, token_usage)
+        except CircuitOpenError as e:
+            logger.warning("视觉接口熔断，暂缓 %d 条: %s", len(rows), e)
+            return [PARKED_RESULT] * len(rows)
+        finally:
+            self._record_tokens(rows, STAGE_VISION, token_usage)
+    
+    def _request_unit(self, rows, image_dir, token_usage):
+        """
+        发送一个请求单元的视觉请求
+        
+        Raises:
+            CircuitOpenError: 接口熔断中
+        """
+        if len(rows) == 1:
+            return [self._understand_row(rows[0], image_dir, token_usage)]
+        
+        image = self._vision_image(rows[0])
+        image_path = validate_image_path(image, image_dir)
+        if not image_path:
+            return [f"错误：图像文件不存在 - {image}"] * len(rows)
+        
+        image_base64, mime_type = self._encode_image(image_path)
+        if not image_base64:
+            return ["错误：图像编码失败"] * len(rows)
+        
+        analyses = self.vision_api.understand_image_batch(
+            image_base64, [row['question'] for row in rows], mime_type, token_usage
+        )
+        results = []
+        for row, analysis in zip(rows, analyses):
+            if analysis is None:
+                # 批量结果中缺少该问题时单独请求
+                analysis = self.vision_api.understand_image(
+                    image_base64, row['question'], mime_type, token_usage
+                )
+            results.append(analysis)
+        return results
         
     def stage1_vision_understanding(self, df, image_dir):
         """
@@ -235,68 +988,78 @@ class TwoStageReasoner:
             image_dir (str): 图像目录
             
         Returns:
-            dict: {id: understanding_result}
+            dict: {id: understanding_result}，按输入顺序排列
+        """
+        return self._understand_rows(df.to_dict('records'), image_dir)
+    
+    def _understand_rows(self, rows, image_dir):
         """
-        understanding_results = {}
-        intermediate_file = os.path.join(DATA_PATHS['intermediate_dir'], 'vision_understanding.txt')
+        对数据行列表执行第一阶段，返回按输入顺序排列的{id: understanding_result}
+        """
+        understanding_results, pending = self._split_completed(rows, STAGE_VISION)
+        self._report_shared_images(pending)
+        
+        units = self.scheduler.order(self._vision_units(pending), STAGE_VISION, image_dir)
+        logger.info("第一阶段：开始视觉理解（并发数: %d，请求数: %d）...", self.max_workers, len(units))
+        
+        def save_unit(index, unit, understandings):
+            for row, understanding in zip(unit, understandings):
+                self._save_understanding(row, understanding)
         
-        # 确保中间结果目录存在
-        ensure_dir_exists(DATA_PATHS['intermediate_dir'])
+        results = run_ordered(
+            lambda unit: self._understand_unit(unit, image_dir),
+            units,
+            max_workers=self.max_workers,
+            desc="视觉理解",
+            on_result=save_unit
+        )
+        for unit, understandings in zip(units, results):
+            understanding_results.update(
+                {row['id']: understanding for row, understanding in zip(unit, understandings)}
+            )
         
-        print("第一阶段：开始视觉理解...")
+        if self.checkpoint:
+            logger.info("第一阶段完成，结果已保存到: %s", self.checkpoint.path)
+        return {row['id']: understanding_results[row['id']] for row in rows}
+    
+    def _reason_row(self, row, understanding_results):
+        """
+        对单条数据进行文本推理
         
-        with open(intermediate_file, 'w', encoding='utf-8') as f:
-            f.write(f"视觉理解结果 - {datetime.now()}\n")
-            f.write("=" * 50 + "\n\n")
+        Args:
+            row (dict): 数据行
+            understanding_results (dict): 第一阶段的理解结果
             
-            for idx, row in tqdm(df.iterrows(), total=len(df), desc="视觉理解"):
-                image_path = validate_image_path(row['image'], image_dir)
-                
-                if not image_path:
-                    result = f"错误：图像文件不存在 - {row['image']}"
-                    understanding_results[row['id']] = result
-                    f.write(f"ID: {row['id']}\n")
-                    f.write(f"图像: {row['image']}\n")
-                    f.write(f"问题: {row['question']}\n")
-                    f.write(f"理解结果: {result}\n")
-                    f.write("-" * 30 + "\n\n")
-                    continue
-                
-                # 编码图像
-                image_base64 = encode_image_to_base64(image_path)
-                if not image_base64:
-                    result = "错误：图像编码失败"
-                    understanding_results[row['id']] = result
-                    f.write(f"ID: {row['id']}\n")
-                    f.write(f"图像: {row['image']}\n")
-                    f.write(f"问题: {row['question']}\n")
-                    f.write(f"理解结果: {result}\n")
-                    f.write("-" * 30 + "\n\n")
-                    continue
-                
-                # 调用视觉API
-                understanding = self.vision_api.understand_image(image_base64, row['question'])
-                
-                # 保存结果（无论成功失败都保存）
-                understanding_results[row['id']] = understanding
-                f.write(f"ID: {row['id']}\n")
-                f.write(f"图像: {row['image']}\n")
-                f.write(f"问题: {row['question']}\n")
-                f.write(f"理解结果: {understanding}\n")
-                f.write("-" * 30 + "\n\n")
-                
-                # 检查是否有问题
-                if "失败" in understanding or "限制" in understanding or "异常" in understanding:
-                    print(f"图像 {row['id']} 处理有问题: {understanding[:50]}...")
-                
-                # API调用间隔
-                time.sleep(MODEL_CONFIG['api_delay'])
-                
-                # 实时刷新文件
-                f.flush()
-        
-        print(f"第一阶段完成，结果已保存到: {intermediate_file}")
-        return understanding_results
+        Returns:
+            str: 答案，第一阶段或推理失败时返回None，接口熔断时返回PARKED_RESULT
+        """
+        understanding = understanding_results.get(row['id'])
+        
+        if understanding == PARKED_RESULT:
+            # 第一阶段暂缓，本条随之暂缓
+            return PARKED_RESULT
+        if is_vision_failure(understanding):
+            # 第一阶段失败，不调用文本推理
+            return None
+        
+        # 过长的描述按问题相关性压缩到预算以内
+        understanding = fit_description(understanding, row['question'])
+        
+        # 检索训练集中的相似样本作为少样本示例
+        examples = None
+        if self.retrieval is not None:
+            examples = self.retrieval.query_row(row, RETRIEVAL_CONFIG['k'])
+        
+        # 调用文本推理API
+        token_usage = TokenUsage()
+        try:
+            with trace_items([row['id']]):
+                return self.text_api.reason_with_text(understanding, row['question'], token_usage, examples)
+        except CircuitOpenError as e:
+            logger.warning("文本接口熔断，暂缓 %s: %s", row['id'], e)
+            return PARKED_RESULT
+        finally:
+            self._record_tokens([row], STAGE_TEXT, token_usage)
     
     def stage2_text_reasoning(self, df, understanding_results):
         """
@@ -309,52 +1072,401 @@ class TwoStageReasoner:
         Returns:
             pd.DataFrame: 预测结果
         """
-        predictions = []
+        rows = df.to_dict('records')
+        return self._build_predictions(rows, self._reason_rows(rows, understanding_results))
+    
+    def _reason_rows(self, rows, understanding_results):
+        """
+        对数据行列表执行第二阶段，返回{id: answer}
+        """
+        answers, pending = self._split_completed(rows, STAGE_TEXT)
+        pending = self.scheduler.order(pending, STAGE_TEXT, understanding_results=understanding_results)
         
-        print("第二阶段：开始文本推理...")
+        logger.info("第二阶段：开始文本推理（并发数: %d）...", self.max_workers)
         
-        for idx, row in tqdm(df.iterrows(), total=len(df), desc="文本推理"):
-            understanding = understanding_results.get(row['id'], "无图像理解结果")
-            
-            if understanding.startswith("错误："):
-                # 如果第一阶段失败，使用默认答案
-                answer = "A"  # 默认答案
-            else:
-                # 调用文本推理API
-                answer = self.text_api.reason_with_text(understanding, row['question'])
-                
-                if not answer:
-                    answer = "A"  # 默认答案
+        results = run_ordered(
+            lambda row: self._reason_row(row, understanding_results),
+            pending,
+            max_workers=self.max_workers,
+            desc="文本推理",
+            on_result=lambda index, row, answer: self._save_answer(row, answer)
+        )
+        answers.update({row['id']: answer for row, answer in zip(pending, results)})
+        return answers
+    
+    def run_pipelined(self, df, image_dir):
+        """
+        流水线模式：每条数据的视觉理解一完成就送入有界队列，由文本推理线程立即处理，
+        两个阶段同时进行，队列满时视觉线程阻塞等待（背压）
+        
+        Args:
+            df (pd.DataFrame): 数据框
+            image_dir (str): 图像目录
             
-            predictions.append({
-                'id': row['id'],
-                'answer': answer
-            })
+        Returns:
+            tuple: ({id: understanding_result}, 预测结果pd.DataFrame)
+        """
+        rows = df.to_dict('records')
+        understanding_results, answers = self._run_rows_pipelined(rows, image_dir)
+        return understanding_results, self._build_predictions(rows, answers)
+    
+    def _run_rows_pipelined(self, rows, image_dir):
+        """
+        对数据行列表执行流水线，返回({id: understanding_result}, {id: answer})
+        """
+        answers, pending = self._split_completed(rows, STAGE_TEXT)
+        understanding_results, vision_pending = self._split_completed(pending, STAGE_VISION)
+        self._report_shared_images(vision_pending)
+        
+        logger.info("流水线模式：视觉与推理各 %d 个并发，队列长度 %d", self.max_workers, self.pipeline_queue_size)
+        
+        work_queue = queue.Queue(maxsize=self.pipeline_queue_size)
+        lock = threading.Lock()
+        vision_bar = tqdm(total=len(vision_pending), desc="视觉理解", position=0)
+        text_bar = tqdm(total=len(pending), desc="文本推理", position=1)
+        
+        def vision_task(unit):
+            understandings = self._understand_unit(unit, image_dir)
+            for row, understanding in zip(unit, understandings):
+                self._save_understanding(row, understanding)
+                with lock:
+                    understanding_results[row['id']] = understanding
+                    vision_bar.update()
+                work_queue.put(row)
+        
+        def text_worker():
+            while True:
+                row = work_queue.get()
+                if row is None:
+                    break
+                try:
+                    answer = self._reason_row(row, understanding_results)
+                except Exception as e:
+                    # 推理线程退出会使队列堵塞，异常按失败处理
+                    logger.exception("文本推理异常 %s: %s", row['id'], e)
+                    answer = None
+                self._save_answer(row, answer)
+                with lock:
+                    answers[row['id']] = answer
+                    text_bar.update()
+        
+        text_threads = [threading.Thread(target=text_worker, daemon=True) for _ in range(self.max_workers)]
+        for thread in text_threads:
+            thread.start()
+        
+        # 第一阶段已完成（续跑）的条目直接进入第二阶段
+        ready = self.scheduler.order(
+            [row for row in pending if row['id'] in understanding_results],
+            STAGE_TEXT, understanding_results=understanding_results
+        )
+        units = self.scheduler.order(self._vision_units(vision_pending), STAGE_VISION, image_dir)
+        
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+                futures = [pool.submit(vision_task, unit) for unit in units]
+                for row in ready:
+                    work_queue.put(row)
+                for future in futures:
+                    future.result()
+        finally:
+            for _ in text_threads:
+                work_queue.put(None)
+            for thread in text_threads:
+                thread.join()
+            vision_bar.close()
+            text_bar.close()
+        
+        ordered_understanding = {
+            row['id']: understanding_results.get(row['id']) for row in rows
+        }
+        return ordered_understanding, answers
+    
+    def _recovery_wait(self):
+        """
+        距离两个接口都允许探测的秒数
+        """
+        breakers = [api.circuit_breaker for api in (self.vision_api, self.text_api) if api.circuit_breaker]
+        return max([breaker.time_until_probe() for breaker in breakers], default=0.0)
+    
+    def run(self, df, image_dir, pipelined=False):
+        """
+        执行两个阶段；因接口熔断而暂缓的条目在冷却结束后补跑，
+        补跑轮数用尽仍暂缓的条目答案留空，可使用--resume继续
+        
+        Args:
+            df (pd.DataFrame): 数据框
+            image_dir (str): 图像目录
+            pipelined (bool): 是否使用流水线模式
             
-            # API调用间隔
-            time.sleep(MODEL_CONFIG['api_delay'])
+        Returns:
+            tuple: ({id: understanding_result}, 预测结果pd.DataFrame)
+        """
+        rows = df.to_dict('records')
+        understanding_results, answers = self._run_rows(rows, image_dir, pipelined)
+        
+        for round_index in range(self.parked_retry_rounds):
+            parked = [row for row in rows if answers.get(row['id']) == PARKED_RESULT]
+            if not parked:
+                break
+            wait = self._recovery_wait()
+            logger.warning("%d 条因接口熔断暂缓，%.0f 秒后第 %d 轮补跑...", len(parked), wait, round_index + 1)
+            time.sleep(wait)
+            retried_understanding, retried_answers = self._run_rows(
+                parked, image_dir, pipelined, understanding_results
+            )
+            understanding_results.update(retried_understanding)
+            answers.update(retried_answers)
+        
+        return understanding_results, self._build_predictions(rows, answers)
+    
+    def _run_rows(self, rows, image_dir, pipelined, known_understanding=None):
+        """
+        对数据行列表按路由执行，返回({id: understanding_result}, {id: answer})，
+        直接作答的条目没有图像理解结果
+        
+        Args:
+            known_understanding (dict): 已有的第一阶段结果（补跑时传入），
+                已完成第一阶段、只在第二阶段暂缓的条目只补跑文本推理
+        """
+        known_understanding = known_understanding or {}
+        text_only = [
+            row for row in rows
+            if known_understanding.get(row['id']) not in (None, PARKED_RESULT)
+        ]
+        text_only_ids = {row['id'] for row in text_only}
+        
+        answers, staged_rows = self._route_rows(
+            [row for row in rows if row['id'] not in text_only_ids], image_dir
+        )
+        understanding_results = dict(known_understanding)
+        if staged_rows and pipelined:
+            staged_understanding, staged_answers = self._run_rows_pipelined(staged_rows, image_dir)
+            understanding_results.update(staged_understanding)
+            answers.update(staged_answers)
+        elif staged_rows:
+            understanding_results.update(self._understand_rows(staged_rows, image_dir))
+            answers.update(self._reason_rows(staged_rows, understanding_results))
+        if text_only:
+            answers.update(self._reason_rows(text_only, understanding_results))
+        return {row['id']: understanding_results.get(row['id']) for row in rows}, answers
+    
+    def _record_tokens(self, rows, stage, token_usage):
+        """
+        记录一个请求单元消耗的token，多条数据共享的请求按条均摊
+        """
+        share = round(token_usage.total_tokens / len(rows))
+        with self._token_lock:
+            for row in rows:
+                item = self.token_usage.setdefault(row['id'], {})
+                # 升级或补跑的条目会多次调用同一阶段，累计计算
+                item[stage] = item.get(stage, 0) + share
+    
+    def _item_tokens(self, item_id, stage):
+        with self._token_lock:
+            return self.token_usage.get(item_id, {}).get(stage, 0)
+    
+    def route_report(self):
+        """
+        统计本次运行各处理路径的条数
         
-        return pd.DataFrame(predictions)
+        Returns:
+            dict: {route: 条数}
+        """
+        return summarize_routes(self.routes)
+    
+    def token_report(self):
+        """
+        汇总本次运行消耗的token
+        
+        Returns:
+            dict: 各阶段总token数、处理条数与每条平均token数
+        """
+        with self._token_lock:
+            usage = list(self.token_usage.values())
+        report = {'items': len(usage)}
+        for stage in (STAGE_VISION, STAGE_TEXT):
+            report[f'{stage}_tokens'] = sum(item.get(stage, 0) for item in usage)
+        total = report[f'{STAGE_VISION}_tokens'] + report[f'{STAGE_TEXT}_tokens']
+        report['tokens_per_item'] = round(total / len(usage), 1) if usage else 0
+        return report
+    
+    def _save_understanding(self, row, understanding):
+        """
+        保存第一阶段结果（无论成功失败都保存），并发时按完成顺序写入
+        """
+        failed = is_vision_failure(understanding)
+        if self.checkpoint:
+            if understanding == VISION_REJECTED_RESULT:
+                # 内容审核拒绝是确定性的，续跑时不再重试
+                status = STATUS_REJECTED
+            elif understanding == PARKED_RESULT:
+                status = STATUS_PARKED
+            else:
+                status = STATUS_FAILED if failed else STATUS_DONE
+            self.checkpoint.record(
+                row['id'], STAGE_VISION, status,
+                understanding, image=row['image'], question=row['question'],
+                tokens=self._item_tokens(row['id'], STAGE_VISION)
+            )
+        
+        # 检查是否有问题
+        if failed:
+            logger.warning("图像 %s 处理有问题: %.50s...", row['id'], understanding)
+    
+    def _save_answer(self, row, answer):
+        """
+        保存第二阶段结果
+        """
+        if self.checkpoint:
+            if answer == PARKED_RESULT:
+                status = STATUS_PARKED
+            else:
+                status = STATUS_DONE if answer else STATUS_FAILED
+            route = self.routes.get(row['id'], ROUTE_TWO_STAGE)
+            # 直接作答的条目只调用了视觉模型
+            token_stage = STAGE_VISION if route == ROUTE_SINGLE else STAGE_TEXT
+            self.checkpoint.record(
+                row['id'], STAGE_TEXT, status, answer,
+                route=route, tokens=self._item_tokens(row['id'], token_stage)
+            )
+    
+    @staticmethod
+    def _build_predictions(rows, answers):
+        """
+        按输入顺序生成预测结果，失败条目使用默认答案，暂缓条目留空；
+        没有数据时（例如未分到数据的分片）返回只有id、answer列的空结果
+        """
+        predictions = []
+        for row in rows:
+            answer = answers.get(row['id'])
+            if answer == PARKED_RESULT:
+                answer = ""
+            elif not answer:
+                answer = "A"  # 默认答案
+            predictions.append({'id': row['id'], 'answer': answer})
+        return pd.DataFrame(predictions, columns=['id', 'answer'])
 
-def main():
+def parse_args(argv=None):
+    """
+    解析命令行参数
+    
+    Args:
+        argv (list): 命令行参数，None表示使用sys.argv
+        
+    Returns:
+        argparse.Namespace: 参数
+    """
+    parser = argparse.ArgumentParser(description="复杂图文逻辑推理挑战赛 - 两阶段推理")
+    parser.add_argument(
+        '--resume', action='store_true',
+        help="从检查点续跑：跳过已完成的条目，只重试失败或缺失的条目"
+    )
+    parser.add_argument(
+        '--pipeline', action='store_true', default=MODEL_CONFIG['pipeline'],
+        help="流水线模式：视觉理解与文本推理同时进行"
+    )
+    parser.add_argument(
+        '--shard', type=parse_shard_spec, metavar='i/N',
+        help="只处理第i个分片（i从0开始，共N个分片，按id哈希分配），检查点、结果与日志按分片分开保存"
+    )
+    parser.add_argument(
+        '--merge', type=parse_shard_count, metavar='N',
+        help="合并N个分片的结果为output/submission.csv，检查缺失与重复的id（不调用接口）"
+    )
+    parser.add_argument('--vision-api-key', help="覆盖视觉模型的API密钥（优先于SHARD_CONFIG）")
+    parser.add_argument('--vision-api-url', help="覆盖视觉模型的API地址")
+    parser.add_argument('--text-api-key', help="覆盖推理模型的API密钥")
+    parser.add_argument('--text-api-url', help="覆盖推理模型的API地址")
+    args = parser.parse_args(argv)
+    if args.shard and args.merge is not None:
+        parser.error("--shard与--merge不能同时使用")
+    return args
+
+def merge_shards(count):
+    """
+    合并各分片的结果为提交文件
+
+    Args:
+        count (int): 分片总数
+
+    Returns:
+        bool: 是否合并成功
+    """
+    test_df = load_csv_data(DATA_PATHS['test_csv'])
+    if test_df is None:
+        print("测试数据加载失败")
+        return False
+    merged, report = merge_shard_outputs(test_df, count)
+    if report['missing_files']:
+        print(f"缺少分片结果: {', '.join(report['missing_files'])}")
+    if report['duplicates']:
+        print(f"重复的id（{len(report['duplicates'])} 个，答案一致，已去重）: {report['duplicates'][:10]}")
+    if report['conflicts']:
+        print(f"答案不一致的重复id（{len(report['conflicts'])} 个）: {report['conflicts'][:10]}")
+    if report['missing']:
+        print(f"缺失的id（{len(report['missing'])} 个）: {report['missing'][:10]}")
+    if merged is None:
+        print("合并失败，未写入提交文件")
+        return False
+
+    ensure_dir_exists(DATA_PATHS['output_dir'])
+    output_path = os.path.join(DATA_PATHS['output_dir'], 'submission.csv')
+    save_csv_data(merged, output_path)
+    print(f"已合并 {count} 个分片，共 {len(merged)} 条，保存到: {output_path}")
+    parked = (merged['answer'] == "").sum()
+    if parked:
+        print(f"暂缓条目：{parked} 条答案为空，可在对应分片使用 --resume 继续后重新合并")
+    return True
+
+def main(argv=None):
     """
     主函数 - 两阶段推理流程
     """
+    args = parse_args(argv)
+    if args.merge is not None:
+        merge_shards(args.merge)
+        return
     print("=== 复杂图文逻辑推理挑战赛 - 两阶段推理 ===")
     
-    # 初始化推理器
-    reasoner = TwoStageReasoner()
+    # 分片运行：检查点、日志与指标文件按分片分开，模型配置需在创建客户端之前覆盖
+    shard_index, shard_count = args.shard or (None, None)
+    overridden = apply_model_overrides(shard_index, {
+        'vision': {'api_key': args.vision_api_key, 'api_url': args.vision_api_url},
+        'text': {'api_key': args.text_api_key, 'api_url': args.text_api_url}
+    })
+    checkpoint_path = os.path.join(DATA_PATHS['intermediate_dir'], DATA_PATHS['checkpoint_file'])
+    if args.shard:
+        checkpoint_path = shard_path(checkpoint_path, shard_index, shard_count)
+        if LOG_CONFIG['file']:
+            set_log_file(shard_path(LOG_CONFIG['file'], shard_index, shard_count))
+        for key in ('trace_file', 'prometheus_file'):
+            if METRICS_CONFIG[key]:
+                METRICS_CONFIG[key] = shard_path(METRICS_CONFIG[key], shard_index, shard_count)
+        if METRICS_CONFIG['http_port']:
+            METRICS_CONFIG['http_port'] += shard_index
+        print(f"分片运行: 第 {shard_index} 个分片（共 {shard_count} 个）")
+    if overridden:
+        print(f"已覆盖模型配置: {', '.join(overridden)}")
+    
+    # 初始化推理器，测试集的每条结果都写入检查点
+    checkpoint = CheckpointStore(checkpoint_path)
+    reasoner = TwoStageReasoner(checkpoint=checkpoint, resume=args.resume)
+    if args.resume:
+        print(f"续跑模式，检查点: {checkpoint_path}")
     
     # 加载训练数据（用于第一阶段理解，可选）
     print("\n1. 加载训练数据...")
     train_df = load_csv_data(DATA_PATHS['train_csv'])
-    if train_df is not None:
+    if train_df is not None and shard_index:
+        # 流程验证只在第0个分片进行
+        print(f"训练数据: {len(train_df)} 条（流程验证由第0个分片进行）")
+    elif train_df is not None:
         print(f"训练数据: {len(train_df)} 条")
         
-        # 可选：对部分训练数据进行视觉理解以验证流程
+        # 可选：对部分训练数据进行视觉理解以验证流程（不写入测试集检查点）
         print("\n2. 处理部分训练数据（验证流程）...")
         train_sample = train_df.head(5)  # 只处理5条验证流程
-        train_understanding = reasoner.stage1_vision_understanding(
+        train_understanding = TwoStageReasoner().stage1_vision_understanding(
             train_sample, DATA_PATHS['image_dir']
         )
         print("训练数据视觉理解完成")
@@ -367,32 +1479,62 @@ def main():
         return
     
     print(f"测试数据: {len(test_df)} 条")
+    if args.shard:
+        test_df = select_shard(test_df, shard_index, shard_count)
+        print(f"本分片: {len(test_df)} 条")
     
-    # 第一阶段：视觉理解
-    print("\n4. 第一阶段：视觉理解...")
-    understanding_results = reasoner.stage1_vision_understanding(
-        test_df, DATA_PATHS['image_dir']
+    # 视觉理解与文本推理（流水线模式下两个阶段重叠执行），熔断暂缓的条目恢复后补跑
+    mode = "流水线" if args.pipeline else "分阶段"
+    print(f"\n4-5. 视觉理解与文本推理（{mode}）...")
+    understanding_results, predictions_df = reasoner.run(
+        test_df, DATA_PATHS['image_dir'], pipelined=args.pipeline
     )
     
-    # 第二阶段：文本推理
-    print("\n5. 第二阶段：文本推理...")
-    predictions_df = reasoner.stage2_text_reasoning(test_df, understanding_results)
-    
     # 保存结果
-    ensure_dir_exists(DATA_PATHS['output_dir'])
     output_path = os.path.join(DATA_PATHS['output_dir'], 'submission.csv')
+    if args.shard:
+        output_path = shard_output_path(shard_index, shard_count)
+    ensure_dir_exists(os.path.dirname(output_path))
     save_csv_data(predictions_df, output_path)
     
     print(f"\n两阶段推理完成！结果已保存到: {output_path}")
     print(f"预测样本数: {len(predictions_df)}")
     
-    # 显示预测结果示例
-    print("\n预测结果示例:")
-    print(predictions_df.head(10))
+    if not predictions_df.empty:
+        # 显示预测结果示例
+        print("\n预测结果示例:")
+        print(predictions_df.head(10))
+        
+        # 统计答案分布
+        print("\n答案分布:")
+        print(predictions_df['answer'].value_counts())
+    
+    # 失败条目统计
+    failed_vision = checkpoint.count(STAGE_VISION, STATUS_FAILED)
+    failed_text = checkpoint.count(STAGE_TEXT, STATUS_FAILED)
+    if failed_vision or failed_text:
+        print(f"\n失败条目：视觉 {failed_vision} 条，推理 {failed_text} 条，可使用 --resume 重试")
+    parked = (predictions_df['answer'] == "").sum()
+    if parked:
+        print(f"\n暂缓条目：{parked} 条因接口熔断未完成，答案留空，可使用 --resume 继续")
+    if args.shard:
+        print(f"\n全部分片完成后运行 python main.py --merge {shard_count} 合并结果")
     
-    # 统计答案分布
-    print("\n答案分布:")
-    print(predictions_df['answer'].value_counts())
+    # 缓存命中情况
+    response_cache = get_response_cache()
+    if response_cache:
+        print(f"\n响应缓存统计: {response_cache.stats()}")
+    print(f"图像编码缓存统计: {get_image_cache_stats()}")
+    print(f"token消耗统计: {reasoner.token_report()}")
+    if reasoner.router.enabled:
+        print(f"问题路由统计: {reasoner.route_report()}")
+    if reasoner.vision_api.hedger:
+        print(f"视觉对冲请求统计: {reasoner.vision_api.hedger.stats()}")
+    if reasoner.metrics:
+        print(f"分阶段耗时统计: {reasoner.metrics.summary()}")
+        if METRICS_CONFIG['prometheus_file']:
+            reasoner.metrics.write_prometheus(METRICS_CONFIG['prometheus_file'])
+            print(f"指标已导出: {METRICS_CONFIG['prometheus_file']}")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
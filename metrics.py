@@ -0,0 +1,388 @@
+# -*- coding: utf-8 -*-
+"""
+复杂图文逻辑推理挑战赛 - 耗时与吞吐量指标
+按数据条目与阶段记录图像编码耗时、本地排队等待、请求体大小、首字节时间、请求总耗时、token用量、重试与缓存命中；
+逐条写入JSONL追踪文件，并汇总为Prometheus文本格式（写入文件或通过HTTP提供/metrics）
+"""
+
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from app_logging import current_items, get_logger
+from config import METRICS_CONFIG
+from token_budget import estimate_prompt_tokens, estimate_tokens
+
+# 直方图分桶上界(秒)
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+ENCODE_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+# 指标名前缀
+METRIC_PREFIX = 'reasoner'
+
+logger = get_logger('metrics')
+
+class Histogram:
+    """
+    累积分桶直方图（Prometheus histogram语义）
+    """
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+
+    @property
+    def mean(self):
+        return self.sum / self.count if self.count else 0.0
+
+class CallTrace:
+    """
+    一次接口请求（一次尝试）的计时与用量，由MetricsRecorder.start_call在通过本地准入
+    （并发名额与限流配额）之后创建，latency与ttfb只包含请求发出后的时间
+    """
+
+    def __init__(self, recorder, stage, items, model, payload):
+        self.recorder = recorder
+        self.stage = stage
+        self.items = items
+        self.model = model
+        self.payload = payload
+        self.stream = bool(payload.get('stream'))
+        self.request_bytes = len(json.dumps(payload).encode('utf-8'))
+        self.start = time.perf_counter()
+        self.ttfb = None
+        self.usage = None
+        self.content = None
+
+    def first_byte(self, elapsed=None):
+        """
+        记录首字节时间，只记录第一次
+
+        Args:
+            elapsed (float): 已知的首字节耗时(秒)，默认按当前时间计算
+        """
+        if self.ttfb is None:
+            self.ttfb = elapsed if elapsed is not None else time.perf_counter() - self.start
+
+    def set_output(self, usage, content):
+        """
+        记录响应的usage与输出内容（usage缺失时用内容估算token）
+        """
+        self.usage = usage
+        self.content = content
+
+    def finish(self, status='ok'):
+        """
+        结束本次请求并提交记录
+
+        Args:
+            status (str): 'ok'或错误类型
+        """
+        latency = time.perf_counter() - self.start
+        usage = self.usage or {}
+        estimated = status == 'ok' and (
+            usage.get('prompt_tokens') is None or usage.get('completion_tokens') is None
+        )
+        prompt_tokens = usage.get('prompt_tokens')
+        completion_tokens = usage.get('completion_tokens')
+        if status == 'ok':
+            if prompt_tokens is None:
+                prompt_tokens = estimate_prompt_tokens(self.payload)
+            if completion_tokens is None:
+                completion_tokens = estimate_tokens(self.content)
+        self.recorder.record_request({
+            'stage': self.stage,
+            'items': self.items,
+            'model': self.model,
+            'stream': self.stream,
+            'status': status,
+            'request_bytes': self.request_bytes,
+            'ttfb': round(self.ttfb, 4) if self.ttfb is not None else None,
+            'latency': round(latency, 4),
+            'prompt_tokens': prompt_tokens or 0,
+            'completion_tokens': completion_tokens or 0,
+            'tokens_estimated': estimated
+        })
+
+class MetricsRecorder:
+    """
+    指标记录器：每个事件写入一行JSONL追踪，同时更新按阶段汇总的计数与直方图，线程安全
+    """
+
+    def __init__(self, trace_file=None):
+        """
+        Args:
+            trace_file (str): JSONL追踪文件路径，None表示不写追踪
+        """
+        self.trace_file = trace_file
+        self.run_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}"
+        self._lock = threading.Lock()
+        self._trace = None
+        self.counters = defaultdict(float)
+        self.histograms = {}
+
+    def _histogram(self, name, labels, buckets):
+        key = (name, labels)
+        if key not in self.histograms:
+            self.histograms[key] = Histogram(buckets)
+        return self.histograms[key]
+
+    def _write(self, event):
+        if not self.trace_file:
+            return
+        if self._trace is None:
+            directory = os.path.dirname(self.trace_file)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            # 行缓冲，中断时已记录的事件不丢失
+            self._trace = open(self.trace_file, 'a', encoding='utf-8', buffering=1)
+        self._trace.write(json.dumps(event, ensure_ascii=False) + '\n')
+
+    def _event(self, kind, fields):
+        return dict({'ts': round(time.time(), 3), 'run': self.run_id, 'event': kind}, **fields)
+
+    def start_call(self, stage, model, payload, items=None):
+        """
+        开始记录一次接口请求
+
+        Args:
+            stage (str): 阶段（vision/text）
+            model (str): 模型ID
+            payload (dict): 请求体
+            items (list): 数据条目id，默认取当前线程的条目
+
+        Returns:
+            CallTrace: 请求记录，结束时调用finish
+        """
+        return CallTrace(self, stage, current_items() if items is None else items, model, payload)
+
+    def record_request(self, fields):
+        stage = (('stage', fields['stage']),)
+        with self._lock:
+            self._write(self._event('request', fields))
+            self.counters[('requests_total', stage + (('status', fields['status']),))] += 1
+            self.counters[('request_bytes_total', stage)] += fields['request_bytes']
+            self.counters[('tokens_total', stage + (('direction', 'in'),))] += fields['prompt_tokens']
+            self.counters[('tokens_total', stage + (('direction', 'out'),))] += fields['completion_tokens']
+            self._histogram('request_seconds', stage, LATENCY_BUCKETS).observe(fields['latency'])
+            if fields['ttfb'] is not None:
+                self._histogram('ttfb_seconds', stage, LATENCY_BUCKETS).observe(fields['ttfb'])
+
+    def record_encode(self, seconds, size, items=None):
+        """
+        记录一次图像预处理与编码
+
+        Args:
+            seconds (float): 耗时(秒)
+            size (int): base64编码后的字节数，失败时为0
+            items (list): 数据条目id，默认取当前线程的条目
+        """
+        items = current_items() if items is None else items
+        with self._lock:
+            self._write(self._event('encode', {'items': items, 'seconds': round(seconds, 4), 'bytes': size}))
+            self.counters[('encoded_bytes_total', ())] += size
+            self._histogram('encode_seconds', (), ENCODE_BUCKETS).observe(seconds)
+
+    def record_wait(self, stage, seconds, items=None):
+        """
+        记录一次请求发出前的本地等待（并发名额与限流配额），不计入请求耗时
+
+        Args:
+            stage (str): 阶段
+            seconds (float): 等待时间(秒)
+            items (list): 数据条目id，默认取当前线程的条目
+        """
+        items = current_items() if items is None else items
+        with self._lock:
+            self._write(self._event('wait', {'stage': stage, 'items': items, 'seconds': round(seconds, 4)}))
+            self._histogram('local_wait_seconds', (('stage', stage),), LATENCY_BUCKETS).observe(seconds)
+
+    def record_retry(self, stage, failures, kind, wait, items=None):
+        """
+        记录一次重试
+
+        Args:
+            stage (str): 阶段
+            failures (int): 已失败次数
+            kind (str): 错误类型
+            wait (float): 重试前等待时间(秒)
+            items (list): 数据条目id，默认取当前线程的条目
+        """
+        items = current_items() if items is None else items
+        with self._lock:
+            self._write(self._event('retry', {
+                'stage': stage, 'items': items, 'failures': failures, 'kind': kind, 'wait': round(wait, 3)
+            }))
+            self.counters[('retries_total', (('stage', stage), ('kind', kind)))] += 1
+
+    def record_cache(self, stage, hit, items=None):
+        """
+        记录一次响应缓存查询
+
+        Args:
+            stage (str): 阶段
+            hit (bool): 是否命中
+            items (list): 数据条目id，默认取当前线程的条目
+        """
+        items = current_items() if items is None else items
+        with self._lock:
+            self._write(self._event('cache', {'stage': stage, 'items': items, 'hit': hit}))
+            result = 'hit' if hit else 'miss'
+            self.counters[('cache_lookups_total', (('stage', stage), ('result', result)))] += 1
+
+    def summary(self):
+        """
+        按阶段汇总的平均耗时与用量，用于运行结束时打印
+
+        Returns:
+            dict: {'encode': {...}, stage: {...}}
+        """
+        with self._lock:
+            result = {}
+            encode = self.histograms.get(('encode_seconds', ()))
+            if encode:
+                result['encode'] = {'count': encode.count, 'mean_seconds': round(encode.mean, 4)}
+            for (name, labels), histogram in self.histograms.items():
+                if name != 'request_seconds':
+                    continue
+                stage = dict(labels)['stage']
+                ttfb = self.histograms.get(('ttfb_seconds', labels))
+                local_wait = self.histograms.get(('local_wait_seconds', labels))
+                result[stage] = {
+                    'requests': histogram.count,
+                    'mean_latency': round(histogram.mean, 3),
+                    'mean_ttfb': round(ttfb.mean, 3) if ttfb else None,
+                    'mean_local_wait': round(local_wait.mean, 3) if local_wait else None,
+                    'request_bytes': int(self.counters[('request_bytes_total', labels)]),
+                    'tokens_in': int(self.counters[('tokens_total', labels + (('direction', 'in'),))]),
+                    'tokens_out': int(self.counters[('tokens_total', labels + (('direction', 'out'),))]),
+                    'retries': int(sum(
+                        value for (counter, counter_labels), value in self.counters.items()
+                        if counter == 'retries_total' and dict(counter_labels)['stage'] == stage
+                    ))
+                }
+            return result
+
+    def prometheus_text(self):
+        """
+        以Prometheus文本格式导出所有指标
+
+        Returns:
+            str: 指标文本
+        """
+        def format_labels(labels, extra=()):
+            pairs = list(labels) + list(extra)
+            if not pairs:
+                return ''
+            return '{' + ','.join(f'{key}="{value}"' for key, value in pairs) + '}'
+
+        lines = []
+        with self._lock:
+            typed = set()
+            for (name, labels), value in sorted(self.counters.items()):
+                metric = f"{METRIC_PREFIX}_{name}"
+                if metric not in typed:
+                    lines.append(f"# TYPE {metric} counter")
+                    typed.add(metric)
+                lines.append(f"{metric}{format_labels(labels)} {value:g}")
+
+            for (name, labels), histogram in sorted(self.histograms.items()):
+                metric = f"{METRIC_PREFIX}_{name}"
+                if metric not in typed:
+                    lines.append(f"# TYPE {metric} histogram")
+                    typed.add(metric)
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    lines.append(f"{metric}_bucket{format_labels(labels, (('le', f'{bound:g}'),))} {count}")
+                lines.append(f"{metric}_bucket{format_labels(labels, (('le', '+Inf'),))} {histogram.count}")
+                lines.append(f"{metric}_sum{format_labels(labels)} {histogram.sum:.6f}")
+                lines.append(f"{metric}_count{format_labels(labels)} {histogram.count}")
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path):
+        """
+        将指标写入Prometheus文本文件（可由node_exporter的textfile收集器读取）
+
+        Args:
+            path (str): 文件路径
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temp_path = f"{path}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            f.write(self.prometheus_text())
+        os.replace(temp_path, path)
+
+    def close(self):
+        with self._lock:
+            if self._trace is not None:
+                self._trace.close()
+                self._trace = None
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.rstrip('/') != '/metrics':
+            self.send_error(404)
+            return
+        body = self.server.recorder.prometheus_text().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+def serve_metrics(recorder, port, host='0.0.0.0'):
+    """
+    在后台线程中通过HTTP提供/metrics
+
+    Args:
+        recorder (MetricsRecorder): 指标记录器
+        port (int): 端口
+        host (str): 监听地址
+
+    Returns:
+        ThreadingHTTPServer: 服务对象，调用shutdown()停止
+    """
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    server.recorder = recorder
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+_recorder = None
+_recorder_lock = threading.Lock()
+
+def get_metrics():
+    """
+    获取进程内共享的指标记录器，首次调用时按METRICS_CONFIG创建（配置了http_port时同时启动/metrics服务）
+
+    Returns:
+        MetricsRecorder: 共享记录器，未启用时返回None
+    """
+    global _recorder
+    if not METRICS_CONFIG['enabled']:
+        return None
+    if _recorder is None:
+        with _recorder_lock:
+            if _recorder is None:
+                recorder = MetricsRecorder(METRICS_CONFIG['trace_file'])
+                if METRICS_CONFIG['http_port']:
+                    serve_metrics(recorder, METRICS_CONFIG['http_port'])
+                    logger.info("指标服务已启动: http://localhost:%s/metrics", METRICS_CONFIG['http_port'])
+                _recorder = recorder
+    return _recorder
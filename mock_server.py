@@ -0,0 +1,319 @@
+# -*- coding: utf-8 -*-
+"""
+复杂图文逻辑推理挑战赛 - 本地模拟MaaS服务
+在本机提供与讯飞MaaS兼容的/v1/chat/completions接口，按配置模拟响应延迟分布、
+服务端错误、429限流与内容审核拒绝，支持流式输出；用于离线压测，不消耗真实配额
+"""
+
+import argparse
+import json
+import math
+import random
+import re
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from config import MOCK_SERVER_CONFIG
+from token_budget import estimate_prompt_tokens, estimate_tokens
+
+# 模拟的内容审核拒绝信息（包含retry.MODERATION_KEYWORDS中的关键字）
+MODERATION_MESSAGE = '输入内容可能涉及相关法律法规，无法处理'
+
+# 批量视觉理解提示词中的问题编号行，例如"1. 问题"
+BATCH_QUESTION_PATTERN = re.compile(r'^(\d+)\. ', re.MULTILINE)
+
+# 模拟输出使用的填充文本
+FILLER_TEXT = '图片中包含标题、正文文字与若干数字，人物位于画面左侧，背景为浅色，表格中列出了时间与数量。'
+
+def _prompt_parts(payload):
+    """
+    取出请求中的提示词文本与是否带图像
+
+    Returns:
+        tuple: (提示词文本, 是否包含图像)
+    """
+    text, has_image = [], False
+    for message in payload.get('messages', []):
+        content = message.get('content', '')
+        if isinstance(content, str):
+            text.append(content)
+            continue
+        for part in content:
+            if part.get('type') == 'text':
+                text.append(part.get('text', ''))
+            elif part.get('type') == 'image_url':
+                has_image = True
+    return '\n'.join(text), has_image
+
+def _filler(chars):
+    repeats = chars // len(FILLER_TEXT) + 1
+    return (FILLER_TEXT * repeats)[:chars]
+
+def mock_reply(payload, description_chars=400):
+    """
+    按请求类型生成模拟输出：批量视觉理解返回按编号的JSON，视觉请求返回图像描述，
+    文本推理返回带答案标记的答案
+
+    Args:
+        payload (dict): chat/completions请求体
+        description_chars (int): 图像描述的长度(字)
+
+    Returns:
+        str: 模拟的模型输出
+    """
+    prompt, has_image = _prompt_parts(payload)
+    if has_image and 'JSON' in prompt:
+        numbers = BATCH_QUESTION_PATTERN.findall(prompt)
+        return json.dumps(
+            {number: f"问题{number}的分析：{_filler(description_chars)}" for number in numbers},
+            ensure_ascii=False
+        )
+    if has_image:
+        return _filler(description_chars)
+    return f"根据图像理解结果推理。\n答案：模拟答案{len(prompt) % 4}\n"
+
+class MockServerState:
+    """
+    模拟服务的配置、随机数与请求统计，线程安全
+    """
+
+    def __init__(self, config=None):
+        """
+        Args:
+            config (dict): 模拟服务配置，默认MOCK_SERVER_CONFIG
+        """
+        self.config = dict(MOCK_SERVER_CONFIG, **(config or {}))
+        self._random = random.Random(self.config['seed'])
+        self._lock = threading.Lock()
+        self.outcomes = Counter()
+        self.stream_requests = 0
+
+    def latency(self, request_bytes=0):
+        """
+        按配置的分布抽取一次响应延迟(秒)，再加上与请求体大小成正比的部分
+
+        Args:
+            request_bytes (int): 请求体字节数
+        """
+        distribution = self.config['latency']
+        median = self.config['latency_median']
+        size_latency = request_bytes / 1024 * self.config['latency_per_kb']
+        with self._lock:
+            if distribution == 'fixed':
+                return median + size_latency
+            if distribution == 'uniform':
+                return self._random.uniform(0, 2 * median) + size_latency
+            if distribution == 'lognormal':
+                return median * math.exp(self._random.gauss(0, self.config['latency_sigma'])) + size_latency
+        raise ValueError(f"未知的延迟分布: {distribution}")
+
+    def outcome(self):
+        """
+        按配置的比例抽取本次请求的结果：'ok'、'error'、'rate_limited'或'moderation'
+        """
+        with self._lock:
+            draw = self._random.random()
+        for name, key in (('error', 'error_rate'), ('rate_limited', 'rate_limit_rate'), ('moderation', 'moderation_rate')):
+            if draw < self.config[key]:
+                return name
+            draw -= self.config[key]
+        return 'ok'
+
+    def record(self, outcome, stream=False):
+        with self._lock:
+            self.outcomes[outcome] += 1
+            if stream:
+                self.stream_requests += 1
+
+    def stats(self):
+        """
+        获取请求统计
+
+        Returns:
+            dict: {'requests': 总请求数, 'stream_requests': 流式请求数, 'outcomes': {结果: 次数}}
+        """
+        with self._lock:
+            return {
+                'requests': sum(self.outcomes.values()),
+                'stream_requests': self.stream_requests,
+                'outcomes': dict(self.outcomes)
+            }
+
+class MockChatHandler(BaseHTTPRequestHandler):
+    """
+    /chat/completions请求处理
+    """
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        # 压测时不逐条打印访问日志
+        pass
+
+    def _send_json(self, status, body, headers=None):
+        data = json.dumps(body, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        state = self.server.state
+        length = int(self.headers.get('Content-Length') or 0)
+        try:
+            payload = json.loads(self.rfile.read(length) or b'{}')
+        except json.JSONDecodeError:
+            self._send_json(400, {'error': {'message': 'invalid json'}})
+            return
+        if not self.path.rstrip('/').endswith('/chat/completions'):
+            self._send_json(404, {'error': {'message': f'unknown path {self.path}'}})
+            return
+
+        stream = bool(payload.get('stream'))
+        outcome = state.outcome()
+        state.record(outcome, stream)
+        time.sleep(state.latency(length))
+
+        if outcome == 'error':
+            self._send_json(500, {'error': {'message': 'mock internal error'}})
+        elif outcome == 'rate_limited':
+            self._send_json(
+                429, {'error': {'message': 'Too Many Requests'}},
+                headers={'Retry-After': str(state.config['retry_after'])}
+            )
+        elif outcome == 'moderation':
+            self._send_json(400, {'error': {'message': MODERATION_MESSAGE}})
+        elif stream:
+            self._send_stream(payload)
+        else:
+            content = mock_reply(payload, state.config['description_chars'])
+            self._send_json(200, {
+                'id': 'mock',
+                'object': 'chat.completion',
+                'model': payload.get('model'),
+                'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': content}, 'finish_reason': 'stop'}],
+                'usage': self._usage(payload, content)
+            })
+
+    @staticmethod
+    def _usage(payload, content):
+        prompt_tokens = estimate_prompt_tokens(payload)
+        completion_tokens = estimate_tokens(content)
+        return {
+            'prompt_tokens': prompt_tokens,
+            'completion_tokens': completion_tokens,
+            'total_tokens': prompt_tokens + completion_tokens
+        }
+
+    def _send_stream(self, payload):
+        state = self.server.state
+        content = mock_reply(payload, state.config['description_chars'])
+        size = state.config['stream_chunk_chars']
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream; charset=utf-8')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+        def write_event(data):
+            event = f"data: {data}\n\n".encode('utf-8')
+            self.wfile.write(f"{len(event):x}\r\n".encode('ascii') + event + b"\r\n")
+            self.wfile.flush()
+
+        try:
+            for start in range(0, len(content), size):
+                chunk = {'choices': [{'index': 0, 'delta': {'content': content[start:start + size]}}]}
+                write_event(json.dumps(chunk, ensure_ascii=False))
+                time.sleep(state.config['stream_chunk_delay'])
+            write_event(json.dumps({'choices': [], 'usage': self._usage(payload, content)}))
+            write_event('[DONE]')
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            # 客户端提前结束读取（已得到答案）
+            self.close_connection = True
+
+class MockMaaSServer:
+    """
+    在后台线程中运行的模拟MaaS服务
+    """
+
+    def __init__(self, config=None):
+        """
+        Args:
+            config (dict): 覆盖MOCK_SERVER_CONFIG的配置项
+        """
+        self.state = MockServerState(config)
+        self._server = ThreadingHTTPServer(
+            (self.state.config['host'], self.state.config['port']), MockChatHandler
+        )
+        self._server.daemon_threads = True
+        self._server.state = self.state
+        self._thread = None
+
+    @property
+    def api_url(self):
+        """
+        与VISION_MODEL_CONFIG['api_url']格式一致的接口地址（不含/chat/completions）
+        """
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+def parse_args(argv=None):
+    """
+    解析命令行参数，未指定的项使用MOCK_SERVER_CONFIG
+    """
+    parser = argparse.ArgumentParser(description='本地模拟MaaS服务')
+    parser.add_argument('--host')
+    parser.add_argument('--port', type=int)
+    parser.add_argument('--latency', choices=['fixed', 'uniform', 'lognormal'], help='延迟分布')
+    parser.add_argument('--latency-median', type=float, help='延迟中位数(秒)')
+    parser.add_argument('--latency-sigma', type=float, help='lognormal的对数标准差')
+    parser.add_argument('--latency-per-kb', type=float, help='每KB请求体增加的延迟(秒)')
+    parser.add_argument('--error-rate', type=float, help='返回500的比例')
+    parser.add_argument('--rate-limit-rate', type=float, help='返回429的比例')
+    parser.add_argument('--moderation-rate', type=float, help='返回内容审核拒绝的比例')
+    return parser.parse_args(argv)
+
+def config_from_args(args):
+    """
+    将命令行参数转换为覆盖MOCK_SERVER_CONFIG的配置项
+    """
+    return {
+        key: value for key, value in vars(args).items()
+        if key in MOCK_SERVER_CONFIG and value is not None
+    }
+
+def main(argv=None):
+    args = parse_args(argv)
+    server = MockMaaSServer(config_from_args(args))
+    print(f"模拟MaaS服务已启动: {server.api_url}/chat/completions（Ctrl+C结束）")
+    try:
+        server._server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server._server.server_close()
+        print(f"请求统计: {server.state.stats()}")
+
+if __name__ == "__main__":
+    main()
@@ -3,7 +3,11 @@ import base64
 import csv
 import os
 import time
-import requests
+
+from response_cache import get_response_cache, make_cache_key
+from utils import encode_image_for_api
+from retry import APIError, post_chat_completion
+from config import MODEL_CONFIG
 
 # ========== 与主脚本完全一致 ==========
 TEST_CSV   = r"D:\Desktop\作品\2025\2025讯飞系列\复杂图文的逻辑推理挑战赛\test.csv"
@@ -14,16 +18,21 @@ API_KEY = "sk-iBuVfdtBDgb27dhAE25f548fD77a47B086D94dFdBc8a775c"
 URL     = "http://maas-api.cn-huabei-1.xf-yun.com/v1/chat/completions"
 MODEL   = "xqwen2d5s32bvl"
 
+# (连接超时, 读取超时)
+TIMEOUT = (MODEL_CONFIG["connect_timeout"], MODEL_CONFIG["read_timeout"])
+
 HEADERS = {
     "Authorization": f"Bearer {API_KEY}",
     "Content-Type": "application/json"
 }
 
 def image_to_base64(path: str) -> str:
-    with open(path, "rb") as f:
-        data = f.read()
-    encoded = base64.b64encode(data).decode("utf-8")
-    return f"data:image/png;base64,{encoded}"
+    encoded, mime = encode_image_for_api(path)   # 预处理结果在进程内缓存，重试时不再重复编码
+    if encoded is None:
+        with open(path, "rb") as f:
+            encoded = base64.b64encode(f.read()).decode("utf-8")
+        mime = "image/png"
+    return f"data:{mime};base64,{encoded}"
 
 def call_qwen(question: str, image_b64: str, max_retry: int = 5) -> str:
     full_prompt = (
@@ -45,15 +54,30 @@ def call_qwen(question: str, image_b64: str, max_retry: int = 5) -> str:
         "temperature": 0.2,
         "stream": False
     }
-    for attempt in range(max_retry):
-        try:
-            r = requests.post(URL, headers=HEADERS, json=payload, timeout=60)
-            r.raise_for_status()
-            return r.json()["choices"][0]["message"]["content"].strip()
-        except Exception as e:
-            print(f"⚠️ 第{attempt+1}次调用失败：{e}")
-            time.sleep(3)
-    return ""        # 重试完仍失败就留空
+    # qwen.py与qwen2.py的提示词一致，共用同一缓存版本
+    cache = get_response_cache()
+    cache_key = make_cache_key(
+        MODEL, "qwen-direct-v1", question,
+        {"max_tokens": payload["max_tokens"], "temperature": payload["temperature"]},
+        image=image_b64
+    )
+    if cache:
+        cached = cache.get(cache_key)
+        if cached is not None:
+            return cached
+    # 指数退避 + 抖动；内容审核拒绝等确定性错误不重试
+    try:
+        answer = post_chat_completion(
+            URL, HEADERS, payload, TIMEOUT, max_retry,
+            on_retry=lambda n, e, wait: print(f"⚠️ 第{n}次调用失败（{e.kind}）：{e}，{wait:.1f}s后重试")
+        )
+    except APIError as e:
+        print(f"❌ 调用失败（{e.kind}）：{e}")
+        return ""        # 重试完仍失败就留空
+
+    if cache:
+        cache.put(cache_key, answer)
+    return answer
 
 # ---------------- 主逻辑 ----------------
 def main():
@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+"""
+复杂图文逻辑推理挑战赛 - 令牌桶限流器
+按接口限制每秒请求数与每分钟token数，所有并发线程共享同一限流器，
+遇到429或配额错误时自动降速，成功后逐步恢复
+"""
+
+import threading
+import time
+
+# 单张图片按固定token数估算（实际消耗以响应中的usage为准）
+IMAGE_TOKEN_ESTIMATE = 1024
+
+# 服务端限流/配额错误的关键字
+THROTTLE_KEYWORDS = ['quota', 'rate limit', 'too many requests', '限流', '配额', 'qps']
+
+class TokenBucket:
+    """
+    令牌桶：以固定速率补充令牌，允许预支（余额为负时后续请求排队等待）
+    """
+
+    def __init__(self, rate, capacity):
+        """
+        Args:
+            rate (float): 每秒补充的令牌数
+            capacity (float): 桶容量（允许的突发量）
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self.rate_factor = 1.0
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate * self.rate_factor)
+        self.updated_at = now
+
+    def set_rate_factor(self, rate_factor, now):
+        """
+        调整速率系数，调整前按旧速率结算已补充的令牌
+
+        Args:
+            rate_factor (float): 新的速率系数
+            now (float): 当前时间(time.monotonic)
+        """
+        self._refill(now)
+        self.rate_factor = rate_factor
+
+    def reserve(self, amount, now):
+        """
+        预留令牌，返回需要等待的秒数
+
+        Args:
+            amount (float): 需要的令牌数
+            now (float): 当前时间(time.monotonic)
+
+        Returns:
+            float: 需要等待的时间(秒)
+        """
+        self._refill(now)
+        self.tokens -= amount
+        return -self.tokens / (self.rate * self.rate_factor) if self.tokens < 0 else 0.0
+
+    def refund(self, amount):
+        """
+        归还（或在amount为负时追扣）令牌，用于按实际用量修正预估
+
+        Args:
+            amount (float): 令牌数
+        """
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+class RateLimiter:
+    """
+    接口限流器：请求数令牌桶 + token数令牌桶，线程安全
+    """
+
+    def __init__(self, requests_per_second=None, tokens_per_minute=None, burst=1,
+                 min_rate_factor=0.1, backoff_factor=0.5, recovery_step=0.05):
+        """
+        Args:
+            requests_per_second (float): 每秒请求数上限，None表示不限制
+            tokens_per_minute (float): 每分钟token数上限，None表示不限制
+            burst (float): 请求桶容量（允许的突发请求数）
+            min_rate_factor (float): 自适应降速的最低速率系数
+            backoff_factor (float): 每次被限流时速率系数的乘数
+            recovery_step (float): 每次成功后速率系数的增量
+        """
+        self.request_bucket = TokenBucket(requests_per_second, burst) if requests_per_second else None
+        self.token_bucket = (
+            TokenBucket(tokens_per_minute / 60.0, tokens_per_minute) if tokens_per_minute else None
+        )
+        self.min_rate_factor = min_rate_factor
+        self.backoff_factor = backoff_factor
+        self.recovery_step = recovery_step
+        self.rate_factor = 1.0
+        self.blocked_until = 0.0
+        self.throttled_count = 0
+        self._lock = threading.Lock()
+
+    def _set_rate_factor(self, rate_factor):
+        now = time.monotonic()
+        self.rate_factor = rate_factor
+        for bucket in (self.request_bucket, self.token_bucket):
+            if bucket:
+                bucket.set_rate_factor(rate_factor, now)
+
+    def acquire(self, tokens=0):
+        """
+        获取一次请求的配额，必要时阻塞等待
+
+        Args:
+            tokens (int): 本次请求预估消耗的token数
+
+        Returns:
+            float: 实际等待的时间(秒)
+        """
+        with self._lock:
+            now = time.monotonic()
+            wait = max(0.0, self.blocked_until - now)
+            if self.request_bucket:
+                wait = max(wait, self.request_bucket.reserve(1, now))
+            if self.token_bucket and tokens:
+                wait = max(wait, self.token_bucket.reserve(tokens, now))
+
+        # 在锁外等待，预留已生效，其他线程会排在后面
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def record_usage(self, estimated_tokens, actual_tokens):
+        """
+        用响应中的实际token用量修正预估值
+
+        Args:
+            estimated_tokens (int): 请求前的预估值
+            actual_tokens (int): 响应usage中的实际值
+        """
+        if not self.token_bucket or actual_tokens is None:
+            return
+        with self._lock:
+            self.token_bucket.refund(estimated_tokens - actual_tokens)
+
+    def on_success(self):
+        """
+        请求成功，逐步恢复速率
+        """
+        with self._lock:
+            self._set_rate_factor(min(1.0, self.rate_factor + self.recovery_step))
+
+    def on_throttled(self, retry_after=None):
+        """
+        被服务端限流，降低速率；若给出Retry-After则在此之前暂停所有请求
+
+        Args:
+            retry_after (float): 服务端建议的等待时间(秒)
+        """
+        with self._lock:
+            self.throttled_count += 1
+            self._set_rate_factor(max(self.min_rate_factor, self.rate_factor * self.backoff_factor))
+            if retry_after:
+                self.blocked_until = max(self.blocked_until, time.monotonic() + retry_after)
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+def get_rate_limiter(name, config):
+    """
+    获取指定接口的共享限流器，同名接口在所有线程间共用一个实例
+
+    Args:
+        name (str): 接口名称
+        config (dict): 限流配置，包含requests_per_second/tokens_per_minute等，None表示不限流
+
+    Returns:
+        RateLimiter: 限流器，未配置时返回None
+    """
+    if not config:
+        return None
+    with _limiters_lock:
+        if name not in _limiters:
+            _limiters[name] = RateLimiter(**config)
+        return _limiters[name]
+
+def estimate_request_tokens(payload):
+    """
+    粗略估算一次对话请求消耗的token数（输入 + 最大输出）
+
+    Args:
+        payload (dict): chat/completions请求体
+
+    Returns:
+        int: 预估token数
+    """
+    tokens = payload.get('max_tokens', 0)
+    for message in payload.get('messages', []):
+        content = message.get('content', '')
+        if isinstance(content, str):
+            tokens += len(content)
+            continue
+        for part in content:
+            if part.get('type') == 'text':
+                tokens += len(part.get('text', ''))
+            elif part.get('type') == 'image_url':
+                tokens += IMAGE_TOKEN_ESTIMATE
+    return tokens
+
+def is_throttled(status_code, text):
+    """
+    判断响应是否为限流或配额错误
+
+    Args:
+        status_code (int): HTTP状态码
+        text (str): 响应内容
+
+    Returns:
+        bool: 是否被限流
+    """
+    if status_code == 429:
+        return True
+    if status_code == 200:
+        return False
+    lowered = (text or '').lower()
+    return any(keyword in lowered for keyword in THROTTLE_KEYWORDS)
+
+def parse_retry_after(headers):
+    """
+    解析Retry-After响应头（秒数形式）
+
+    Args:
+        headers (dict): 响应头
+
+    Returns:
+        float: 等待秒数，无法解析时返回None
+    """
+    value = headers.get('Retry-After') if headers else None
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+"""
+复杂图文逻辑推理挑战赛 - 模型响应缓存
+以(模型、提示词版本、图像内容、问题、采样参数)的哈希为键，将成功的API响应持久化到SQLite，
+按总大小做LRU淘汰，重复运行时不再重复付费调用
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from config import CACHE_CONFIG
+from utils import ensure_dir_exists
+
+def hash_bytes(data):
+    """
+    计算内容哈希
+
+    Args:
+        data (str|bytes): 内容（如base64图像）
+
+    Returns:
+        str: sha256十六进制摘要
+    """
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    return hashlib.sha256(data).hexdigest()
+
+def make_cache_key(model_id, prompt_version, question, params, image=None, context=None):
+    """
+    生成内容寻址的缓存键
+
+    Args:
+        model_id (str): 模型ID
+        prompt_version (str): 提示词模板版本，修改提示词时需同步修改
+        question (str): 问题文本
+        params (dict): 采样参数（temperature、max_tokens等）
+        image (str|bytes): 图像内容（base64或原始字节），可选
+        context (str): 其他输入（如第一阶段的图像理解结果），可选
+
+    Returns:
+        str: 缓存键
+    """
+    parts = {
+        'model_id': model_id,
+        'prompt_version': prompt_version,
+        'question': question,
+        'params': params,
+        'image': hash_bytes(image) if image is not None else None,
+        'context': hash_bytes(context) if context is not None else None
+    }
+    return hash_bytes(json.dumps(parts, sort_keys=True, ensure_ascii=False))
+
+class ResponseCache:
+    """
+    基于SQLite的持久化响应缓存，线程安全，按总字节数做LRU淘汰
+    """
+
+    def __init__(self, path, max_bytes=256 * 1024 * 1024, bypass=False):
+        """
+        Args:
+            path (str): SQLite文件路径
+            max_bytes (int): 缓存内容总大小上限(字节)
+            bypass (bool): 为True时跳过读取（仍写入新结果），用于强制刷新
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self.bypass = bypass
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+        ensure_dir_exists(os.path.dirname(path) or '.')
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS responses ('
+            'key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, accessed REAL NOT NULL)'
+        )
+        self._conn.execute('CREATE INDEX IF NOT EXISTS idx_accessed ON responses(accessed)')
+        self._conn.commit()
+        self.total_bytes = self._conn.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+
+    def get(self, key):
+        """
+        读取缓存
+
+        Args:
+            key (str): 缓存键
+
+        Returns:
+            str: 缓存的响应内容，未命中返回None
+        """
+        if self.bypass:
+            return None
+        with self._lock:
+            row = self._conn.execute('SELECT value FROM responses WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute('UPDATE responses SET accessed = ? WHERE key = ?', (time.time(), key))
+            self._conn.commit()
+            self.hits += 1
+            return row[0]
+
+    def put(self, key, value):
+        """
+        写入缓存，超出大小上限时淘汰最久未访问的条目
+
+        Args:
+            key (str): 缓存键
+            value (str): 响应内容
+        """
+        size = len(value.encode('utf-8'))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._conn.execute('SELECT size FROM responses WHERE key = ?', (key,)).fetchone()
+            self._conn.execute(
+                'INSERT OR REPLACE INTO responses (key, value, size, accessed) VALUES (?, ?, ?, ?)',
+                (key, value, size, time.time())
+            )
+            self.total_bytes += size - (old[0] if old else 0)
+            self.writes += 1
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        while self.total_bytes > self.max_bytes:
+            rows = self._conn.execute(
+                'SELECT key, size FROM responses ORDER BY accessed LIMIT 64'
+            ).fetchall()
+            if not rows:
+                break
+            for key, size in rows:
+                if self.total_bytes <= self.max_bytes:
+                    break
+                self._conn.execute('DELETE FROM responses WHERE key = ?', (key,))
+                self.total_bytes -= size
+                self.evictions += 1
+
+    def stats(self):
+        """
+        获取缓存统计信息
+
+        Returns:
+            dict: 命中、未命中、写入、淘汰次数与当前大小
+        """
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'writes': self.writes,
+            'evictions': self.evictions,
+            'total_bytes': self.total_bytes
+        }
+
+    def close(self):
+        """
+        关闭数据库连接
+        """
+        with self._lock:
+            self._conn.close()
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_response_cache():
+    """
+    获取进程内共享的响应缓存，首次调用时按CACHE_CONFIG创建
+
+    Returns:
+        ResponseCache: 共享缓存，未启用时返回None
+    """
+    global _cache
+    if not CACHE_CONFIG['enabled']:
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ResponseCache(
+                    CACHE_CONFIG['path'],
+                    max_bytes=CACHE_CONFIG['max_bytes'],
+                    bypass=CACHE_CONFIG['bypass']
+                )
+    return _cache
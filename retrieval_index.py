@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+"""
+复杂图文逻辑推理挑战赛 - 训练集检索索引
+对train.csv中已解答的样本建立索引（问题字符片段位图 + 图像感知哈希），持久化为.npy文件，
+为每条测试数据返回最相似的k个样本，作为文本推理的少样本示例；
+索引在首次查询时才以内存映射方式加载，不影响启动速度
+"""
+
+import json
+import os
+import threading
+
+import numpy as np
+
+from app_logging import get_logger
+from config import DATA_PATHS, RETRIEVAL_CONFIG
+from image_hash import HASH_BITS, cached_dhash, hamming_distances
+from similarity import JaccardIndex
+from utils import atomic_directory, load_csv_data, validate_image_path
+
+logger = get_logger('retrieval_index')
+
+# 索引格式版本，修改文件内容时需同步修改
+INDEX_VERSION = 1
+
+# 索引文件
+QUESTION_BITS_FILE = 'question_bits.npy'
+QUESTION_COUNTS_FILE = 'question_counts.npy'
+IMAGE_HASHES_FILE = 'image_hashes.npy'
+HAS_IMAGE_FILE = 'has_image.npy'
+META_FILE = 'meta.json'
+
+def source_signature(path):
+    """
+    训练集文件的签名（大小与修改时间），文件变化时索引需要重建
+
+    Returns:
+        list: [大小, 修改时间]，文件不存在返回None
+    """
+    if not os.path.exists(path):
+        return None
+    stat = os.stat(path)
+    return [stat.st_size, int(stat.st_mtime)]
+
+def build_retrieval_index(train_csv, image_dir, index_dir, shingle_size=2):
+    """
+    由训练集构建并保存检索索引
+
+    Args:
+        train_csv (str): 训练集CSV路径（需包含id/image/question/answer列）
+        image_dir (str): 图像目录
+        index_dir (str): 索引保存目录
+        shingle_size (int): 问题文本的片段长度
+
+    Returns:
+        int: 索引的样本数，训练集无法读取时返回0
+    """
+    train_df = load_csv_data(train_csv)
+    if train_df is None:
+        return 0
+    rows = train_df.dropna(subset=['question', 'answer']).to_dict('records')
+
+    questions = JaccardIndex([str(row['question']) for row in rows], k=shingle_size)
+    hashes = np.zeros(len(rows), dtype=np.uint64)
+    has_image = np.zeros(len(rows), dtype=bool)
+    for i, row in enumerate(rows):
+        image_path = validate_image_path(row['image'], image_dir)
+        image_hash = cached_dhash(image_path) if image_path else None
+        if image_hash is not None:
+            hashes[i] = image_hash
+            has_image[i] = True
+
+    # 词表按列号顺序保存
+    vocabulary = sorted(questions.vocabulary, key=questions.vocabulary.get)
+    meta = {
+        'version': INDEX_VERSION,
+        'source': source_signature(train_csv),
+        'shingle_size': shingle_size,
+        'vocabulary': vocabulary,
+        'examples': [
+            {'id': str(row['id']), 'question': str(row['question']), 'answer': str(row['answer'])}
+            for row in rows
+        ]
+    }
+    # 写入临时目录后整体替换，同时启动的分片不会读到写了一半的索引
+    with atomic_directory(index_dir) as temp_dir:
+        np.save(os.path.join(temp_dir, QUESTION_BITS_FILE), questions.packed)
+        np.save(os.path.join(temp_dir, QUESTION_COUNTS_FILE), questions.counts)
+        np.save(os.path.join(temp_dir, IMAGE_HASHES_FILE), hashes)
+        np.save(os.path.join(temp_dir, HAS_IMAGE_FILE), has_image)
+        with open(os.path.join(temp_dir, META_FILE), 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False)
+
+    logger.info("检索索引已构建: %d 条样本，保存到 %s", len(rows), index_dir)
+    return len(rows)
+
+class RetrievalIndex:
+    """
+    训练集检索索引，首次查询时加载（索引缺失或训练集变化时先重建），线程安全
+    """
+
+    def __init__(self, index_dir, train_csv, image_dir, config=None):
+        """
+        Args:
+            index_dir (str): 索引目录
+            train_csv (str): 训练集CSV路径
+            image_dir (str): 图像目录（训练与测试图像共用）
+            config (dict): 检索配置，默认RETRIEVAL_CONFIG
+        """
+        config = config or RETRIEVAL_CONFIG
+        self.index_dir = index_dir
+        self.train_csv = train_csv
+        self.image_dir = image_dir
+        self.shingle_size = config['shingle_size']
+        self.question_weight = config['question_weight']
+        self.image_weight = config['image_weight']
+        self.min_score = config['min_score']
+        self.examples = None
+        self._questions = None
+        self._hashes = None
+        self._has_image = None
+        self._lock = threading.Lock()
+
+    def _is_current(self):
+        meta_path = os.path.join(self.index_dir, META_FILE)
+        if not os.path.exists(meta_path):
+            return None
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        if (
+            meta.get('version') != INDEX_VERSION
+            or meta.get('shingle_size') != self.shingle_size
+            or meta.get('source') != source_signature(self.train_csv)
+        ):
+            return None
+        return meta
+
+    def _load(self):
+        if self.examples is not None:
+            return
+        with self._lock:
+            if self.examples is not None:
+                return
+            meta = self._is_current()
+            if meta is None:
+                build_retrieval_index(self.train_csv, self.image_dir, self.index_dir, self.shingle_size)
+                meta = self._is_current()
+            if meta is None:
+                logger.warning("检索索引不可用，不使用少样本示例")
+                self.examples = []
+                return
+
+            def load_array(name):
+                return np.load(os.path.join(self.index_dir, name), mmap_mode='r')
+
+            vocabulary = {shingle: i for i, shingle in enumerate(meta['vocabulary'])}
+            self._questions = JaccardIndex.from_arrays(
+                vocabulary, load_array(QUESTION_BITS_FILE), load_array(QUESTION_COUNTS_FILE),
+                k=self.shingle_size
+            )
+            self._hashes = load_array(IMAGE_HASHES_FILE)
+            self._has_image = load_array(HAS_IMAGE_FILE)
+            self.examples = meta['examples']
+
+    def query(self, question, image_path=None, k=3):
+        """
+        检索与问题（及图像）最相似的已解答样本
+
+        Args:
+            question (str): 问题文本
+            image_path (str): 图像路径，可选
+            k (int): 返回数量
+
+        Returns:
+            list: [{'id', 'question', 'answer', 'score'}, ...]，按相似度从高到低排列
+        """
+        self._load()
+        if not self.examples or k <= 0:
+            return []
+
+        scores = self.question_weight * self._questions.similarity(question)
+        image_hash = cached_dhash(image_path) if image_path else None
+        if image_hash is not None:
+            image_similarity = 1.0 - hamming_distances(image_hash, self._hashes) / HASH_BITS
+            scores += self.image_weight * np.where(self._has_image, image_similarity, 0.0)
+
+        k = min(k, len(scores))
+        best = np.argpartition(-scores, k - 1)[:k]
+        best = best[np.argsort(-scores[best], kind='stable')]
+        return [
+            dict(self.examples[i], score=float(scores[i]))
+            for i in best if scores[i] >= self.min_score
+        ]
+
+    def query_row(self, row, k=3):
+        """
+        为一条数据检索少样本示例
+
+        Args:
+            row (dict): 数据行（包含image与question）
+            k (int): 返回数量
+
+        Returns:
+            list: 见query
+        """
+        image_path = validate_image_path(row['image'], self.image_dir) if row.get('image') else None
+        return self.query(row['question'], image_path, k)
+
+_index = None
+_index_lock = threading.Lock()
+
+def get_retrieval_index():
+    """
+    获取进程内共享的训练集检索索引（只创建对象，首次查询时才加载）
+
+    Returns:
+        RetrievalIndex: 索引，未启用时返回None
+    """
+    global _index
+    if not RETRIEVAL_CONFIG['enabled']:
+        return None
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = RetrievalIndex(
+                    RETRIEVAL_CONFIG['index_dir'], DATA_PATHS['train_csv'], DATA_PATHS['image_dir']
+                )
+    return _index
+
+if __name__ == "__main__":
+    # 预先构建索引：python retrieval_index.py
+    build_retrieval_index(
+        DATA_PATHS['train_csv'], DATA_PATHS['image_dir'],
+        RETRIEVAL_CONFIG['index_dir'], RETRIEVAL_CONFIG['shingle_size']
+    )
@@ -0,0 +1,267 @@
+# -*- coding: utf-8 -*-
+"""
+复杂图文逻辑推理挑战赛 - 重试策略
+对API错误分类：内容审核等确定性失败不重试，5xx、超时、限流按指数退避加随机抖动重试，
+并遵循服务端的Retry-After
+"""
+
+import json
+import random
+import time
+
+import requests
+
+from config import MODEL_CONFIG
+from http_client import get_http_client
+from rate_limiter import is_throttled, parse_retry_after
+
+# httpx为可选依赖（HTTP/2），其异常同样需要分类
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+# 错误类型
+ERROR_MODERATION = 'moderation'  # 内容审核拒绝
+ERROR_RATE_LIMITED = 'rate_limited'  # 429或配额限制
+ERROR_SERVER = 'server'  # 5xx
+ERROR_TIMEOUT = 'timeout'  # 连接或读取超时
+ERROR_CONNECTION = 'connection'  # 连接失败
+ERROR_FORMAT = 'format'  # 响应格式错误
+ERROR_CLIENT = 'client'  # 其他4xx
+ERROR_CIRCUIT_OPEN = 'circuit_open'  # 接口熔断中，请求未发出
+ERROR_UNEXPECTED = 'unexpected'  # 无法识别的异常（通常是程序错误），不重试也不计入熔断
+
+# 可重试的错误类型
+RETRYABLE_ERRORS = {ERROR_RATE_LIMITED, ERROR_SERVER, ERROR_TIMEOUT, ERROR_CONNECTION, ERROR_FORMAT}
+
+# 内容审核拒绝的关键字
+MODERATION_KEYWORDS = ['相关法律法规', '内容审核']
+
+class APIError(Exception):
+    """
+    已分类的API错误
+    """
+
+    def __init__(self, kind, message, status_code=None, retry_after=None):
+        """
+        Args:
+            kind (str): 错误类型
+            message (str): 错误信息
+            status_code (int): HTTP状态码
+            retry_after (float): 服务端建议的等待时间(秒)
+        """
+        super().__init__(message)
+        self.kind = kind
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+    @property
+    def retryable(self):
+        return self.kind in RETRYABLE_ERRORS
+
+def is_moderation_rejection(text):
+    """
+    判断响应内容是否为内容审核拒绝
+
+    Args:
+        text (str): 响应内容
+
+    Returns:
+        bool: 是否被内容审核拒绝
+    """
+    return any(keyword in (text or '') for keyword in MODERATION_KEYWORDS)
+
+def classify_response(status_code, text):
+    """
+    对HTTP响应分类
+
+    Args:
+        status_code (int): HTTP状态码
+        text (str): 响应内容
+
+    Returns:
+        str: 错误类型，成功响应返回None
+    """
+    if status_code == 200:
+        return None
+    if is_moderation_rejection(text):
+        return ERROR_MODERATION
+    if is_throttled(status_code, text):
+        return ERROR_RATE_LIMITED
+    if status_code >= 500:
+        return ERROR_SERVER
+    if status_code == 408:
+        return ERROR_TIMEOUT
+    return ERROR_CLIENT
+
+def classify_exception(error):
+    """
+    对请求过程中抛出的异常分类
+
+    Args:
+        error (Exception): 异常
+
+    Returns:
+        str: 错误类型
+    """
+    if isinstance(error, APIError):
+        return error.kind
+    if isinstance(error, requests.Timeout) or (httpx and isinstance(error, httpx.TimeoutException)):
+        return ERROR_TIMEOUT
+    if isinstance(error, json.JSONDecodeError):
+        # 响应体不是合法JSON（requests的JSONDecodeError也是其子类）
+        return ERROR_FORMAT
+    if isinstance(error, requests.RequestException) or (httpx and isinstance(error, httpx.TransportError)):
+        return ERROR_CONNECTION
+    return ERROR_UNEXPECTED
+
+def extract_message_content(result):
+    """
+    从chat/completions响应中取出模型输出
+
+    Args:
+        result (dict): 响应JSON
+
+    Returns:
+        str: 模型输出内容
+
+    Raises:
+        APIError: 响应缺少choices/message/content（ERROR_FORMAT，可重试）
+    """
+    try:
+        return result['choices'][0]['message']['content']
+    except (KeyError, IndexError, TypeError) as e:
+        raise APIError(ERROR_FORMAT, f"响应格式错误，缺少输出内容: {str(result)[:200]}") from e
+
+def raise_for_response(response):
+    """
+    响应不成功时抛出已分类的APIError
+
+    Args:
+        response: HTTP响应对象
+
+    Raises:
+        APIError: 响应状态不是200
+    """
+    kind = classify_response(response.status_code, response.text)
+    if kind:
+        raise APIError(
+            kind,
+            f"状态码 {response.status_code}: {response.text[:200]}",
+            status_code=response.status_code,
+            retry_after=parse_retry_after(response.headers)
+        )
+
+class RetryPolicy:
+    """
+    指数退避 + 随机抖动的重试策略
+    """
+
+    def __init__(self, max_retries=3, base_delay=1.0, max_delay=30.0, jitter=True):
+        """
+        Args:
+            max_retries (int): 首次请求之后的最大重试次数
+            base_delay (float): 第一次重试的基础等待时间(秒)
+            max_delay (float): 单次等待时间上限(秒)
+            jitter (bool): 是否使用全抖动（在0到退避上限之间随机取值）
+        """
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+
+    def delay(self, retry_index, retry_after=None):
+        """
+        计算第retry_index次重试前的等待时间
+
+        Args:
+            retry_index (int): 重试序号，从0开始
+            retry_after (float): 服务端建议的等待时间(秒)
+
+        Returns:
+            float: 等待时间(秒)
+        """
+        backoff = min(self.max_delay, self.base_delay * (2 ** retry_index))
+        if self.jitter:
+            backoff = random.uniform(0, backoff)
+        if retry_after:
+            backoff = max(backoff, min(retry_after, self.max_delay))
+        return backoff
+
+    def call(self, func, on_retry=None):
+        """
+        执行func，失败时按错误类型决定是否重试
+
+        Args:
+            func (callable): 无参函数，失败时抛出异常
+            on_retry (callable): 重试前回调 on_retry(已失败次数, 错误, 等待秒数)
+
+        Returns:
+            func的返回值
+
+        Raises:
+            APIError: 不可重试的错误，或重试次数用尽
+        """
+        retry_index = 0
+        while True:
+            try:
+                return func()
+            except Exception as e:
+                error = e if isinstance(e, APIError) else APIError(classify_exception(e), str(e))
+                if not error.retryable or retry_index >= self.max_retries:
+                    if error is e:
+                        raise
+                    raise error from e
+                wait = self.delay(retry_index, error.retry_after)
+                retry_index += 1
+                if on_retry:
+                    on_retry(retry_index, error, wait)
+                time.sleep(wait)
+
+def default_retry_policy(model_config):
+    """
+    按MODEL_CONFIG创建重试策略
+
+    Args:
+        model_config (dict): MODEL_CONFIG
+
+    Returns:
+        RetryPolicy: 重试策略
+    """
+    return RetryPolicy(
+        max_retries=model_config['max_retries'],
+        base_delay=model_config['retry_base_delay'],
+        max_delay=model_config['retry_max_delay']
+    )
+
+def post_chat_completion(url, headers, payload, timeout, max_attempts, on_retry=None):
+    """
+    发送非流式chat/completions请求并按重试策略处理失败（qwen.py与qwen2.py共用），
+    重试间隔按MODEL_CONFIG；响应不是JSON或缺少输出内容时按格式错误重试
+
+    Args:
+        url (str): chat/completions接口地址
+        headers (dict): 请求头
+        payload (dict): 请求体
+        timeout (float|tuple): 超时时间(秒)或(连接超时, 读取超时)
+        max_attempts (int): 最多尝试次数（含首次请求）
+        on_retry (callable): 重试前回调 on_retry(已失败次数, 错误, 等待秒数)
+
+    Returns:
+        str: 模型输出内容（去除首尾空白）
+
+    Raises:
+        APIError: 不可重试的错误，或重试次数用尽
+    """
+    def attempt():
+        response = get_http_client().post(url, headers=headers, json=payload, timeout=timeout)
+        raise_for_response(response)
+        return extract_message_content(response.json()).strip()
+
+    policy = RetryPolicy(
+        max_retries=max_attempts - 1,
+        base_delay=MODEL_CONFIG['retry_base_delay'],
+        max_delay=MODEL_CONFIG['retry_max_delay']
+    )
+    return policy.call(attempt, on_retry=on_retry)
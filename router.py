@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""
+复杂图文逻辑推理挑战赛 - 问题路由
+按问题特征决定每条数据的处理路径：简单的查找类问题由视觉模型直接作答（一次调用），
+其余问题走两阶段；直接作答失败或答案不确定时升级为两阶段
+"""
+
+from collections import Counter
+
+from config import ROUTER_CONFIG
+from token_budget import question_categories
+
+# 处理路径
+ROUTE_SINGLE = 'single'  # 视觉模型直接作答
+ROUTE_TWO_STAGE = 'two_stage'  # 视觉理解 + 文本推理
+ROUTE_ESCALATED = 'escalated'  # 直接作答不可用，升级为两阶段
+
+class QuestionRouter:
+    """
+    基于问题文本特征的路由器
+    """
+
+    def __init__(self, config=None):
+        """
+        Args:
+            config (dict): 路由配置，默认ROUTER_CONFIG
+        """
+        config = config or ROUTER_CONFIG
+        self.enabled = config['enabled']
+        self.direct_categories = set(config['direct_categories'])
+        self.complex_categories = set(config['complex_categories'])
+        self.complex_markers = config['complex_markers']
+        self.max_question_length = config['max_question_length']
+        self.escalation_keywords = config['escalation_keywords']
+
+    def route(self, question):
+        """
+        决定问题的初始处理路径
+
+        Args:
+            question (str): 问题文本
+
+        Returns:
+            str: ROUTE_SINGLE或ROUTE_TWO_STAGE
+        """
+        if not self.enabled or not question:
+            return ROUTE_TWO_STAGE
+
+        categories = set(question_categories(question))
+        if (
+            categories
+            and categories <= self.direct_categories
+            and not categories & self.complex_categories
+            and len(question) <= self.max_question_length
+            and not any(marker in question for marker in self.complex_markers)
+        ):
+            return ROUTE_SINGLE
+        return ROUTE_TWO_STAGE
+
+    def needs_escalation(self, answer):
+        """
+        判断直接作答的结果是否需要升级为两阶段
+
+        Args:
+            answer (str): 视觉模型的直接答案，失败时为None
+
+        Returns:
+            bool: 答案为空或包含不确定表述时返回True
+        """
+        if not answer or not answer.strip():
+            return True
+        return any(keyword in answer for keyword in self.escalation_keywords)
+
+def summarize_routes(routes):
+    """
+    统计各处理路径的条数
+
+    Args:
+        routes (dict): {id: route}
+
+    Returns:
+        dict: {route: 条数}
+    """
+    return dict(Counter(routes.values()))
@@ -0,0 +1,280 @@
+# -*- coding: utf-8 -*-
+"""
+复杂图文逻辑推理挑战赛 - 任务调度
+按预估耗时对视觉与文本请求排序后再提交给线程池：上次失败或暂缓的条目优先，
+其余按最长处理时间优先(LPT)，避免排在CSV末尾的大图、长问题拖长整次运行的尾部；
+预估耗时优先使用最近几次运行的指标追踪中请求发出后的实际耗时（不含本地排队），
+没有历史的条目按图像大小与文本长度估算；
+同时按接口地址限制同时进行的请求数
+"""
+
+import json
+import os
+import threading
+
+import numpy as np
+
+from app_logging import get_logger
+from checkpoint import STAGE_TEXT, STAGE_VISION, STATUS_FAILED, STATUS_PARKED
+from config import METRICS_CONFIG, SCHEDULER_CONFIG
+
+logger = get_logger('scheduler')
+
+# 排序方式
+ORDER_INPUT = 'input'
+ORDER_LPT = 'lpt'
+
+def _read_lines_reversed(path, block_size=1 << 16):
+    """
+    从文件末尾开始逐行读取（只读取需要的部分）
+
+    Yields:
+        str: 行内容，从最后一行到第一行
+    """
+    with open(path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        position = f.tell()
+        remainder = b''
+        while position > 0:
+            size = min(block_size, position)
+            position -= size
+            f.seek(position)
+            lines = (f.read(size) + remainder).split(b'\n')
+            # 第一段可能是被块边界截断的行，留到读取前一块时拼接
+            remainder = lines.pop(0)
+            for line in reversed(lines):
+                yield line.decode('utf-8', errors='replace')
+        yield remainder.decode('utf-8', errors='replace')
+
+def load_latency_history(trace_file, max_runs=5):
+    """
+    从指标追踪文件末尾读取最近max_runs次运行中每条数据各阶段最近一次成功请求的耗时，
+    多条数据共享的请求按条均摊；只使用记录了本地等待（wait事件）的运行，
+    其请求耗时从通过限流与并发名额之后开始计时，不含本地排队
+
+    Args:
+        trace_file (str): metrics.py写入的JSONL追踪文件
+        max_runs (int): 最多读取的最近运行次数
+
+    Returns:
+        dict: {stage: {id: 耗时(秒)}}
+    """
+    history = {STAGE_VISION: {}, STAGE_TEXT: {}}
+    if not trace_file or not os.path.exists(trace_file):
+        return history
+
+    runs = []
+    timed_runs = set()
+    records = []
+    for line in _read_lines_reversed(trace_file):
+        # 先按文本过滤，跳过编码、重试与缓存事件的解析
+        is_wait = '"wait"' in line
+        if not is_wait and ('"request"' not in line or '"ok"' not in line):
+            continue
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError:
+            continue
+        run = record.get('run')
+        if run not in runs:
+            if len(runs) >= max_runs:
+                break
+            runs.append(run)
+        if record.get('event') == 'wait':
+            timed_runs.add(run)
+        elif record.get('event') == 'request' and record.get('status') == 'ok':
+            records.append(record)
+
+    # 从新到旧，每条数据取最近一次
+    for record in records:
+        items = record.get('items') or []
+        latencies = history.get(record.get('stage'))
+        if record['run'] not in timed_runs or latencies is None or not items:
+            continue
+        share = record['latency'] / len(items)
+        for item_id in items:
+            latencies.setdefault(str(item_id), share)
+    return history
+
+class WorkScheduler:
+    """
+    请求调度器：估算每个请求单元的耗时与优先级，给出提交顺序
+    """
+
+    def __init__(self, checkpoint=None, config=None, history=None):
+        """
+        Args:
+            checkpoint (CheckpointStore): 检查点，用于找出上次失败或暂缓的条目，可选
+            config (dict): 调度配置，默认SCHEDULER_CONFIG
+            history (dict): 历史耗时 {stage: {id: 秒}}，默认读取METRICS_CONFIG['trace_file']中最近几次运行
+        """
+        config = config or SCHEDULER_CONFIG
+        if config['order'] not in (ORDER_INPUT, ORDER_LPT):
+            raise ValueError(f"未知的调度顺序: {config['order']}")
+        self.order_mode = config['order']
+        self.failed_first = config['failed_first']
+        self.min_history = config['min_history']
+        self.history_runs = config['history_runs']
+        self.default_coefficients = config['default_coefficients']
+        self.checkpoint = checkpoint
+        self._history = history
+        self._image_bytes = {}
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.order_mode != ORDER_INPUT or self.failed_first
+
+    @property
+    def history(self):
+        if self._history is None:
+            with self._lock:
+                if self._history is None:
+                    self._history = load_latency_history(METRICS_CONFIG['trace_file'], self.history_runs)
+        return self._history
+
+    def _image_size(self, image_path):
+        if image_path not in self._image_bytes:
+            try:
+                self._image_bytes[image_path] = os.path.getsize(image_path)
+            except OSError:
+                self._image_bytes[image_path] = 0
+        return self._image_bytes[image_path]
+
+    def features(self, rows, stage, image_dir=None, understanding_results=None):
+        """
+        请求单元的耗时特征：视觉阶段为[1, 图像MB数, 问题千字数]（共享一张图像），
+        文本阶段为[1, 问题千字数, 图像描述千字数]
+
+        Args:
+            rows (list): 请求单元的数据行
+            stage (str): 阶段名称
+            image_dir (str): 图像目录（视觉阶段）
+            understanding_results (dict): 第一阶段的理解结果（文本阶段）
+
+        Returns:
+            list: 特征
+        """
+        question_chars = sum(len(str(row['question'])) for row in rows) / 1000
+        if stage == STAGE_VISION:
+            image_bytes = self._image_size(os.path.join(image_dir, rows[0]['image'])) if image_dir else 0
+            return [1.0, image_bytes / 1e6, question_chars]
+        understanding_chars = sum(
+            len(str((understanding_results or {}).get(row['id']) or '')) for row in rows
+        ) / 1000
+        return [1.0, question_chars, understanding_chars]
+
+    def estimate(self, units, stage, image_dir=None, understanding_results=None):
+        """
+        估算各请求单元的耗时：全部条目都有历史耗时的单元取历史值之和，
+        其余用线性模型按特征估算（有足够历史样本时按本批数据拟合，否则用默认系数）
+
+        Args:
+            units (list): 请求单元列表，每个单元是数据行列表
+            stage (str): 阶段名称
+            image_dir (str): 图像目录（视觉阶段）
+            understanding_results (dict): 第一阶段的理解结果（文本阶段）
+
+        Returns:
+            np.ndarray: 各单元的预估耗时(秒)
+        """
+        latencies = self.history.get(stage, {})
+        features = np.array(
+            [self.features(unit, stage, image_dir, understanding_results) for unit in units], dtype=np.float64
+        ).reshape(len(units), 3)
+        observed = np.array([
+            sum(latencies[str(row['id'])] for row in unit)
+            if all(str(row['id']) in latencies for row in unit) else np.nan
+            for unit in units
+        ], dtype=np.float64)
+
+        known = ~np.isnan(observed)
+        coefficients = np.asarray(self.default_coefficients[stage], dtype=np.float64)
+        if known.sum() >= self.min_history:
+            coefficients = np.linalg.lstsq(features[known], observed[known], rcond=None)[0]
+        return np.where(known, observed, features @ coefficients)
+
+    def priorities(self, units, stage):
+        """
+        请求单元的优先级：含上次失败或暂缓条目的单元为1，其余为0
+        """
+        if not self.failed_first or self.checkpoint is None:
+            return np.zeros(len(units), dtype=np.int64)
+        retried = (STATUS_FAILED, STATUS_PARKED)
+        return np.array([
+            int(any((self.checkpoint.get(row['id'], stage) or {}).get('status') in retried for row in unit))
+            for unit in units
+        ], dtype=np.int64)
+
+    def order(self, units, stage, image_dir=None, understanding_results=None):
+        """
+        给出请求单元的提交顺序：优先级高的在前，同优先级按预估耗时从长到短（LPT），
+        相同时保持输入顺序
+
+        Args:
+            units (list): 请求单元列表，元素为数据行或数据行列表
+            stage (str): 阶段名称
+            image_dir (str): 图像目录（视觉阶段）
+            understanding_results (dict): 第一阶段的理解结果（文本阶段）
+
+        Returns:
+            list: 按提交顺序排列的units
+        """
+        if not self.enabled or len(units) < 2:
+            return list(units)
+        unit_rows = [unit if isinstance(unit, list) else [unit] for unit in units]
+        priorities = self.priorities(unit_rows, stage)
+        if self.order_mode == ORDER_LPT:
+            estimates = self.estimate(unit_rows, stage, image_dir, understanding_results)
+        else:
+            estimates = np.zeros(len(units))
+        # lexsort以最后一个键为主键
+        positions = np.lexsort((np.arange(len(units)), -estimates, -priorities))
+
+        retried = int(priorities.sum())
+        if retried:
+            logger.info("调度：%d 个请求含上次失败或暂缓的条目，优先处理", retried)
+        if self.order_mode == ORDER_LPT:
+            logger.info(
+                "调度：%s阶段 %d 个请求按预估耗时从长到短提交（预估 %.1f-%.1f 秒）",
+                stage, len(units), float(estimates.min()), float(estimates.max())
+            )
+        return [units[i] for i in positions]
+
+class EndpointSlots:
+    """
+    同一接口地址同时进行的请求数上限（视觉与文本模型共用同一地址时共享）
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self._semaphore = threading.BoundedSemaphore(limit)
+
+    def __enter__(self):
+        self._semaphore.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._semaphore.release()
+
+_slots = {}
+_slots_lock = threading.Lock()
+
+def get_endpoint_slots(api_url):
+    """
+    获取接口地址的共享并发上限，同一地址在所有客户端与线程间共用一个实例
+
+    Args:
+        api_url (str): 接口地址
+
+    Returns:
+        EndpointSlots: 并发上限，未配置时返回None
+    """
+    limits = SCHEDULER_CONFIG['endpoint_concurrency']
+    limit = limits.get(api_url, limits.get('default'))
+    if not limit:
+        return None
+    with _slots_lock:
+        if api_url not in _slots:
+            _slots[api_url] = EndpointSlots(limit)
+        return _slots[api_url]
@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+"""
+复杂图文逻辑推理挑战赛 - 分片运行
+按id的稳定哈希把测试集分给多个进程或机器（--shard i/N），每个分片使用独立的检查点、
+输出文件与可选的API密钥/地址；全部分片完成后合并为一个提交文件，并检查缺失与重复的id
+"""
+
+import argparse
+import hashlib
+import os
+
+import pandas as pd
+
+from app_logging import get_logger
+from config import SHARD_CONFIG, TEXT_MODEL_CONFIG, VISION_MODEL_CONFIG
+from utils import load_csv_data
+
+logger = get_logger('sharding')
+
+# 可按分片覆盖的模型配置
+MODEL_CONFIGS = {
+    'vision': VISION_MODEL_CONFIG,
+    'text': TEXT_MODEL_CONFIG
+}
+
+def parse_shard_spec(spec):
+    """
+    解析分片参数"i/N"（i从0开始）
+
+    Args:
+        spec (str): 分片参数，例如"0/4"
+
+    Returns:
+        tuple: (分片序号, 分片总数)
+
+    Raises:
+        argparse.ArgumentTypeError: 格式错误或序号超出范围
+    """
+    try:
+        index, count = (int(part) for part in spec.split('/'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"分片参数应为 i/N 形式，例如 0/4: {spec}")
+    if count < 1 or not 0 <= index < count:
+        raise argparse.ArgumentTypeError(f"分片序号应满足 0 <= i < N: {spec}")
+    return index, count
+
+def parse_shard_count(value):
+    """
+    解析分片总数（--merge N）
+
+    Args:
+        value (str): 命令行参数
+
+    Returns:
+        int: 分片总数
+
+    Raises:
+        argparse.ArgumentTypeError: 不是大于等于1的整数
+    """
+    try:
+        count = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"分片总数应为整数: {value}")
+    if count < 1:
+        raise argparse.ArgumentTypeError(f"分片总数应大于等于1: {value}")
+    return count
+
+def shard_of(item_id, count):
+    """
+    计算数据条目所属的分片（md5哈希，与进程、机器与Python版本无关）
+
+    Args:
+        item_id: 数据条目id
+        count (int): 分片总数
+
+    Returns:
+        int: 分片序号
+    """
+    digest = hashlib.md5(str(item_id).strip().encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'big') % count
+
+def select_shard(df, index, count):
+    """
+    选出属于指定分片的数据行
+
+    Args:
+        df (pd.DataFrame): 数据框（含id列）
+        index (int): 分片序号
+        count (int): 分片总数
+
+    Returns:
+        pd.DataFrame: 该分片的数据行，保持原顺序
+    """
+    mask = df['id'].map(lambda item_id: shard_of(item_id, count) == index)
+    return df[mask].reset_index(drop=True)
+
+def shard_path(path, index, count):
+    """
+    在文件名（扩展名之前）加上分片后缀，例如submission.csv -> submission.shard-0-of-4.csv
+
+    Args:
+        path (str): 原文件路径
+        index (int): 分片序号
+        count (int): 分片总数
+
+    Returns:
+        str: 分片文件路径
+    """
+    root, extension = os.path.splitext(path)
+    return f"{root}.shard-{index}-of-{count}{extension}"
+
+def shard_output_path(index, count):
+    """
+    分片结果文件路径
+    """
+    return shard_path(os.path.join(SHARD_CONFIG['output_dir'], 'submission.csv'), index, count)
+
+def apply_model_overrides(index, cli_overrides=None):
+    """
+    按SHARD_CONFIG['overrides']与命令行参数覆盖本分片的模型配置（API密钥、地址等），
+    需在创建模型客户端之前调用
+
+    Args:
+        index (int): 分片序号，None表示未分片（只应用命令行参数）
+        cli_overrides (dict): 命令行给出的覆盖项 {'vision': {...}, 'text': {...}}，优先于配置
+
+    Returns:
+        list: 被覆盖的配置项，例如['vision.api_key']（不含取值）
+    """
+    applied = []
+    layers = [SHARD_CONFIG['overrides'].get(index, {}) if index is not None else {}, cli_overrides or {}]
+    for layer in layers:
+        for name, overrides in layer.items():
+            if name not in MODEL_CONFIGS:
+                raise ValueError(f"未知的模型配置: {name}，可选 {list(MODEL_CONFIGS)}")
+            for key, value in overrides.items():
+                if value is None:
+                    continue
+                MODEL_CONFIGS[name][key] = value
+                applied.append(f"{name}.{key}")
+    return sorted(set(applied))
+
+def merge_shard_outputs(test_df, count):
+    """
+    合并各分片的结果，按test.csv的顺序排列
+
+    Args:
+        test_df (pd.DataFrame): 测试数据（含id列）
+        count (int): 分片总数
+
+    Returns:
+        tuple: (合并后的DataFrame，检查不通过时为None, 检查报告)；报告包含
+            missing_files（缺少或无法读取的分片文件）、missing（缺失的id）、
+            duplicates（在多个分片中出现且答案一致的id）、conflicts（答案不一致的重复id）
+    """
+    report = {'missing_files': [], 'missing': [], 'duplicates': [], 'conflicts': []}
+    frames = []
+    for index in range(count):
+        path = shard_output_path(index, count)
+        if not os.path.exists(path):
+            report['missing_files'].append(path)
+            continue
+        # 没有分到数据的分片只有表头，视为有效结果
+        frame = load_csv_data(path)
+        if frame is None or not {'id', 'answer'}.issubset(frame.columns):
+            report['missing_files'].append(path)
+            continue
+        frames.append(frame)
+    if report['missing_files']:
+        return None, report
+
+    # 统一按字符串比较id，保留空答案（熔断暂缓的条目）
+    combined = pd.concat(frames, ignore_index=True)
+    combined['id'] = combined['id'].astype(str).str.strip()
+    combined['answer'] = combined['answer'].fillna('').astype(str)
+
+    answers = combined.groupby('id')['answer'].agg(lambda values: sorted(set(values)))
+    counts = combined['id'].value_counts()
+    for item_id, occurrences in counts[counts > 1].items():
+        key = 'conflicts' if len(answers[item_id]) > 1 else 'duplicates'
+        report[key].append(item_id)
+
+    expected = test_df['id'].astype(str).str.strip()
+    report['missing'] = [item_id for item_id in expected if item_id not in answers.index]
+    extra = set(answers.index) - set(expected)
+    if extra:
+        logger.warning("分片结果中有 %d 个id不在测试集中，已忽略", len(extra))
+
+    if report['missing'] or report['conflicts']:
+        return None, report
+
+    merged = pd.DataFrame({
+        'id': test_df['id'].values,
+        'answer': [answers[item_id][0] for item_id in expected]
+    })
+    return merged, report
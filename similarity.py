@@ -0,0 +1,340 @@
+# -*- coding: utf-8 -*-
+"""
+复杂图文逻辑推理挑战赛 - 批量相似度计算
+将字符串编码为字符片段(shingle)位图，用NumPy批量计算精确的Jaccard相似度（一对多、top-k、成对），
+并提供MinHash签名与LSH索引，在大规模数据上以亚二次复杂度筛选候选对
+"""
+
+import hashlib
+from collections import defaultdict
+
+import numpy as np
+
+# 0-255每个字节中1的个数
+POPCOUNT_TABLE = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+# MinHash使用的梅森素数与32位哈希上限
+MERSENNE_PRIME = (1 << 61) - 1
+MAX_HASH = (1 << 32) - 1
+
+def shingles(text, k=1):
+    """
+    将字符串切分为长度为k的字符片段集合
+
+    Args:
+        text (str): 字符串
+        k (int): 片段长度，k=1时与calculate_jaccard_similarity的字符集合一致
+
+    Returns:
+        set: 片段集合，空字符串返回空集合
+    """
+    if not text:
+        return set()
+    if k == 1:
+        return set(text)
+    if len(text) < k:
+        return {text}
+    return {text[i:i + k] for i in range(len(text) - k + 1)}
+
+class JaccardIndex:
+    """
+    基于片段位图的精确Jaccard相似度索引
+    """
+
+    def __init__(self, texts, k=1, lsh=None):
+        """
+        Args:
+            texts (list): 被检索的字符串列表
+            k (int): 片段长度
+            lsh (MinHashLSH): 可选的LSH索引，提供时top_k只在候选中精确计算
+        """
+        self.k = k
+        self.texts = list(texts)
+        shingle_sets = [shingles(text, k) for text in self.texts]
+
+        self.vocabulary = {}
+        for shingle_set in shingle_sets:
+            for shingle in shingle_set:
+                self.vocabulary.setdefault(shingle, len(self.vocabulary))
+
+        # 按位打包存储，每个片段占1位；逐行直接置位（与np.packbits的高位在前一致），
+        # 不分配未打包的bool矩阵
+        self.packed = np.zeros((len(self.texts), (len(self.vocabulary) + 7) // 8), dtype=np.uint8)
+        for row, shingle_set in enumerate(shingle_sets):
+            columns = np.fromiter(
+                (self.vocabulary[shingle] for shingle in shingle_set), dtype=np.int64, count=len(shingle_set)
+            )
+            np.bitwise_or.at(self.packed[row], columns >> 3, (0x80 >> (columns & 7)).astype(np.uint8))
+        self.counts = np.array([len(shingle_set) for shingle_set in shingle_sets], dtype=np.int64)
+
+        self.lsh = lsh
+        if lsh is not None:
+            for row, shingle_set in enumerate(shingle_sets):
+                lsh.insert(row, lsh.hasher.signature(shingle_set))
+
+    @classmethod
+    def from_arrays(cls, vocabulary, packed, counts, k=1):
+        """
+        由持久化的数组构建索引（数组可以是np.load(mmap_mode='r')返回的内存映射）
+
+        Args:
+            vocabulary (dict): {片段: 列号}
+            packed (np.ndarray): 打包的位图，形状为(字符串数, 词表位数/8)
+            counts (np.ndarray): 每个字符串的片段数
+            k (int): 片段长度
+
+        Returns:
+            JaccardIndex: 索引（不含原始字符串与LSH）
+        """
+        index = cls.__new__(cls)
+        index.k = k
+        index.texts = None
+        index.vocabulary = vocabulary
+        index.packed = packed
+        index.counts = counts
+        index.lsh = None
+        return index
+
+    def __len__(self):
+        return len(self.counts)
+
+    def _encode(self, text):
+        """
+        编码查询字符串
+
+        Returns:
+            tuple: (打包的位图, 片段总数（含不在词表中的片段）)
+        """
+        shingle_set = shingles(text, self.k)
+        bits = np.zeros(len(self.vocabulary), dtype=bool)
+        known = [self.vocabulary[s] for s in shingle_set if s in self.vocabulary]
+        bits[known] = True
+        return np.packbits(bits), len(shingle_set)
+
+    def similarity(self, text, rows=None):
+        """
+        一对多：计算text与索引中每个字符串的Jaccard相似度
+
+        Args:
+            text (str): 查询字符串
+            rows (np.ndarray): 只计算这些行，默认全部
+
+        Returns:
+            np.ndarray: 相似度数组，任一方为空字符串时为0
+        """
+        query, query_count = self._encode(text)
+        packed = self.packed if rows is None else self.packed[rows]
+        counts = self.counts if rows is None else self.counts[rows]
+
+        intersection = POPCOUNT_TABLE[packed & query].sum(axis=1, dtype=np.int64)
+        union = counts + query_count - intersection
+        scores = np.zeros(len(counts), dtype=np.float64)
+        valid = (counts > 0) & (query_count > 0)
+        np.divide(intersection, union, out=scores, where=valid)
+        return scores
+
+    def top_k(self, text, k=5):
+        """
+        查找与text最相似的k个字符串
+
+        Args:
+            text (str): 查询字符串
+            k (int): 返回数量
+
+        Returns:
+            list: [(行号, 相似度), ...]，按相似度从高到低排列；查询没有任何词表内的片段时为空列表
+        """
+        if not any(shingle in self.vocabulary for shingle in shingles(text, self.k)):
+            # 与所有字符串的相似度都为0，不返回任意行
+            return []
+        if self.lsh is not None:
+            candidates = self.lsh.query(self.lsh.hasher.signature(shingles(text, self.k)))
+            rows = np.array(sorted(candidates), dtype=np.int64)
+            if len(rows) == 0:
+                return []
+            scores = self.similarity(text, rows)
+        else:
+            rows = np.arange(len(self))
+            scores = self.similarity(text)
+
+        k = min(k, len(rows))
+        if k <= 0:
+            return []
+        best = np.argpartition(-scores, k - 1)[:k]
+        best = best[np.lexsort((rows[best], -scores[best]))]
+        return [(int(rows[i]), float(scores[i])) for i in best]
+
+    def similar_pairs(self, threshold, chunk_size=1024):
+        """
+        查找索引内相似度不低于threshold的所有字符串对；有LSH时只验证候选对，
+        否则按块用矩阵乘法精确计算
+
+        Args:
+            threshold (float): 相似度阈值
+            chunk_size (int): 精确计算时每块的行数
+
+        Returns:
+            list: [(行号i, 行号j, 相似度), ...]，i < j
+        """
+        if self.lsh is not None:
+            pairs = []
+            for i, j in sorted(self.lsh.candidate_pairs()):
+                score = self._pair_score(i, j)
+                if score >= threshold:
+                    pairs.append((i, j, score))
+            return pairs
+
+        pairs = []
+        n = len(self)
+        for start_i in range(0, n, chunk_size):
+            block_i = self._unpack(start_i, chunk_size)
+            for start_j in range(start_i, n, chunk_size):
+                block_j = self._unpack(start_j, chunk_size)
+                intersection = block_i @ block_j.T
+                union = (
+                    self.counts[start_i:start_i + chunk_size, None]
+                    + self.counts[None, start_j:start_j + chunk_size]
+                    - intersection
+                )
+                scores = np.zeros_like(intersection)
+                np.divide(intersection, union, out=scores, where=union > 0)
+                for i, j in zip(*np.nonzero(scores >= threshold)):
+                    row_i, row_j = start_i + i, start_j + j
+                    if row_i < row_j and self.counts[row_i] and self.counts[row_j]:
+                        pairs.append((int(row_i), int(row_j), float(scores[i, j])))
+        return pairs
+
+    def _unpack(self, start, size):
+        packed = self.packed[start:start + size]
+        return np.unpackbits(packed, axis=1, count=len(self.vocabulary)).astype(np.float32)
+
+    def _pair_score(self, i, j):
+        if not self.counts[i] or not self.counts[j]:
+            return 0.0
+        intersection = int(POPCOUNT_TABLE[self.packed[i] & self.packed[j]].sum())
+        return intersection / (self.counts[i] + self.counts[j] - intersection)
+
+def _stable_hash(shingle):
+    # 内置hash()在进程间随机化，签名需要可复现
+    return int.from_bytes(hashlib.blake2b(shingle.encode('utf-8'), digest_size=4).digest(), 'little')
+
+class MinHasher:
+    """
+    MinHash签名：签名中相等位置的比例是Jaccard相似度的无偏估计
+    """
+
+    def __init__(self, num_perm=128, seed=42):
+        """
+        Args:
+            num_perm (int): 签名长度（哈希函数个数），越大估计越准
+            seed (int): 随机种子，相同种子的签名才能比较
+        """
+        self.num_perm = num_perm
+        generator = np.random.RandomState(seed)
+        self.a = generator.randint(1, MAX_HASH, size=num_perm, dtype=np.uint64)
+        self.b = generator.randint(0, MAX_HASH, size=num_perm, dtype=np.uint64)
+
+    def signature(self, shingle_set):
+        """
+        计算片段集合的签名
+
+        Args:
+            shingle_set (set): 片段集合
+
+        Returns:
+            np.ndarray: 长度为num_perm的uint64签名，空集合时全为MAX_HASH
+        """
+        if not shingle_set:
+            return np.full(self.num_perm, MAX_HASH, dtype=np.uint64)
+        hashes = np.array([_stable_hash(s) for s in shingle_set], dtype=np.uint64)
+        permuted = (np.outer(hashes, self.a) + self.b) % np.uint64(MERSENNE_PRIME) & np.uint64(MAX_HASH)
+        return permuted.min(axis=0)
+
+    def signatures(self, texts, k=1):
+        """
+        批量计算字符串的签名
+
+        Returns:
+            np.ndarray: 形状为(字符串数, num_perm)的签名矩阵
+        """
+        if not texts:
+            return np.empty((0, self.num_perm), dtype=np.uint64)
+        return np.vstack([self.signature(shingles(text, k)) for text in texts])
+
+    @staticmethod
+    def estimate(signature, signatures):
+        """
+        用签名估计一对多的Jaccard相似度
+
+        Args:
+            signature (np.ndarray): 查询签名
+            signatures (np.ndarray): 签名矩阵
+
+        Returns:
+            np.ndarray: 估计的相似度
+        """
+        return (np.atleast_2d(signatures) == signature).mean(axis=1)
+
+class MinHashLSH:
+    """
+    MinHash的分段(banding)LSH索引：签名分为bands段，任一段完全相同的字符串成为候选，
+    相似度约高于(1/bands)^(1/rows)的字符串大概率成为候选
+    """
+
+    def __init__(self, hasher=None, bands=32):
+        """
+        Args:
+            hasher (MinHasher): 签名生成器，签名长度需能被bands整除
+            bands (int): 分段数
+        """
+        self.hasher = hasher or MinHasher()
+        if self.hasher.num_perm % bands:
+            raise ValueError(f"签名长度 {self.hasher.num_perm} 不能被分段数 {bands} 整除")
+        self.bands = bands
+        self.rows = self.hasher.num_perm // bands
+        self.buckets = [defaultdict(list) for _ in range(bands)]
+
+    def _band_keys(self, signature):
+        for band in range(self.bands):
+            yield band, signature[band * self.rows:(band + 1) * self.rows].tobytes()
+
+    def insert(self, key, signature):
+        """
+        加入一个签名
+
+        Args:
+            key: 签名对应的键（如行号）
+            signature (np.ndarray): 签名
+        """
+        for band, band_key in self._band_keys(signature):
+            self.buckets[band][band_key].append(key)
+
+    def query(self, signature):
+        """
+        查询候选
+
+        Args:
+            signature (np.ndarray): 查询签名
+
+        Returns:
+            set: 至少一段签名相同的键
+        """
+        candidates = set()
+        for band, band_key in self._band_keys(signature):
+            candidates.update(self.buckets[band].get(band_key, ()))
+        return candidates
+
+    def candidate_pairs(self):
+        """
+        索引内所有候选对
+
+        Returns:
+            set: {(key_i, key_j), ...}，key_i < key_j
+        """
+        pairs = set()
+        for buckets in self.buckets:
+            for keys in buckets.values():
+                for index, key_i in enumerate(keys):
+                    for key_j in keys[index + 1:]:
+                        pairs.add((min(key_i, key_j), max(key_i, key_j)))
+        return pairs
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""
+复杂图文逻辑推理挑战赛 - 流式响应解析
+解析chat/completions的SSE(server-sent events)流，逐段取出模型输出，
+并在输出中已出现完整答案时提前结束读取
+"""
+
+import json
+import re
+
+# 答案标记，与文本推理提示词中的"答案："一致
+ANSWER_MARKER = '答案：'
+
+# 第一行只有单个选项字母（可带句末标点），例如"B\n"、"B。\n"；"B，因为……"等自由作答不算完整答案
+OPTION_ANSWER_PATTERN = re.compile(r'^\s*([A-Z])[ \t]*[。．.!！]?[ \t]*\n')
+
+def iter_sse_data(lines):
+    """
+    从SSE文本行中取出每个事件的data内容，遇到[DONE]结束
+
+    Args:
+        lines (iterable): 响应的文本行
+
+    Yields:
+        str: 事件的data内容
+    """
+    for line in lines:
+        if isinstance(line, bytes):
+            line = line.decode('utf-8')
+        line = line.strip()
+        if not line.startswith('data:'):
+            # 空行分隔事件，":"开头为注释，其余字段(event/id)不需要
+            continue
+        data = line[len('data:'):].strip()
+        if data == '[DONE]':
+            return
+        yield data
+
+def iter_chat_chunks(lines):
+    """
+    解析chat/completions流式响应
+
+    Args:
+        lines (iterable): 响应的文本行
+
+    Yields:
+        tuple: (本段输出文本, usage字典)，usage仅在服务端返回用量的事件中非None
+    """
+    for data in iter_sse_data(lines):
+        chunk = json.loads(data)
+        choices = chunk.get('choices') or []
+        delta = (choices[0].get('delta') or {}) if choices else {}
+        yield delta.get('content') or '', chunk.get('usage')
+
+def extract_early_answer(text):
+    """
+    判断已输出的文本中是否已有完整答案：答案标记后已有一整行，
+    或第一行只有单个选项字母（可带句末标点）并已换行
+
+    Args:
+        text (str): 目前为止的模型输出
+
+    Returns:
+        str: 截止到答案结束处的输出，答案尚不完整时返回None
+    """
+    marker = text.rfind(ANSWER_MARKER)
+    if marker >= 0:
+        start = marker + len(ANSWER_MARKER)
+        tail = text[start:]
+        stripped = tail.lstrip()
+        end = stripped.find('\n')
+        if end > 0:
+            return text[:start + len(tail) - len(stripped) + end]
+        return None
+
+    match = OPTION_ANSWER_PATTERN.match(text)
+    if match:
+        return match.group(1)
+    return None
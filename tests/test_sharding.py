@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+"""
+分片运行与合并：分片数多于数据条数时，未分到数据的分片也应写出可合并的结果
+"""
+
+import pandas as pd
+from PIL import Image
+
+import main
+from config import CACHE_CONFIG, DATA_PATHS, METRICS_CONFIG, TEXT_MODEL_CONFIG, VISION_MODEL_CONFIG
+from mock_server import MockMaaSServer
+from sharding import select_shard, shard_output_path
+
+SHARD_COUNT = 8
+
+def test_shard_more_shards_than_rows_then_merge(tmp_path, monkeypatch):
+    # 相对路径（检查点、缓存、日志、指标与输出）都落在临时目录中，不存在train.csv时跳过流程验证
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setitem(CACHE_CONFIG, 'enabled', False)
+    for model_config in (VISION_MODEL_CONFIG, TEXT_MODEL_CONFIG):
+        monkeypatch.setitem(model_config, 'api_url', model_config['api_url'])
+        monkeypatch.setitem(model_config, 'api_key', model_config['api_key'])
+    metrics_files = {key: METRICS_CONFIG[key] for key in ('trace_file', 'prometheus_file')}
+    for key, path in metrics_files.items():
+        monkeypatch.setitem(METRICS_CONFIG, key, path)
+
+    image_dir = tmp_path / DATA_PATHS['image_dir'] / 'image'
+    image_dir.mkdir(parents=True)
+    Image.new('RGB', (32, 32), 'white').save(image_dir / 'sample.png')
+    test_df = pd.DataFrame({
+        'id': [101, 102, 103],
+        'image': ['image/sample.png'] * 3,
+        'question': ['图中的标题是什么？', '表格中有几列？', '人物位于画面哪一侧？']
+    })
+    test_df.to_csv(tmp_path / DATA_PATHS['test_csv'], index=False)
+    empty_shards = [index for index in range(SHARD_COUNT) if select_shard(test_df, index, SHARD_COUNT).empty]
+    assert empty_shards
+
+    server_config = {
+        'port': 0, 'latency': 'fixed', 'latency_median': 0.0, 'stream_chunk_delay': 0.0,
+        'error_rate': 0.0, 'rate_limit_rate': 0.0, 'moderation_rate': 0.0
+    }
+    with MockMaaSServer(server_config) as server:
+        for index in range(SHARD_COUNT):
+            # main()按分片改写指标文件路径，每个分片从原路径开始
+            METRICS_CONFIG.update(metrics_files)
+            main.main([
+                '--shard', f'{index}/{SHARD_COUNT}',
+                '--vision-api-url', server.api_url, '--text-api-url', server.api_url
+            ])
+
+    for index in empty_shards:
+        shard_df = pd.read_csv(shard_output_path(index, SHARD_COUNT))
+        assert list(shard_df.columns) == ['id', 'answer']
+        assert shard_df.empty
+
+    main.main(['--merge', str(SHARD_COUNT)])
+    merged = pd.read_csv(tmp_path / DATA_PATHS['output_dir'] / 'submission.csv')
+    assert merged['id'].tolist() == test_df['id'].tolist()
+    assert merged['answer'].notna().all()
@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+"""
+复杂图文逻辑推理挑战赛 - token预算
+估算提示词与描述的token数，按问题类型设置每次调用的输出上限，
+将过长的图像描述按与问题的相关性抽取到预算以内，并统计每条数据实际消耗的token
+"""
+
+import math
+import re
+import threading
+
+from config import FEATURE_CONFIG, TOKEN_BUDGET_CONFIG
+from rate_limiter import IMAGE_TOKEN_ESTIMATE
+from utils import extract_text_features
+
+# 中日韩字符（约1个token/字），其余字符约4个/token
+CJK_PATTERN = re.compile(r'[\u3000-\u303f\u3400-\u4dbf\u4e00-\u9fff\uff00-\uffef]')
+
+# 描述的分句边界：换行或中文句末标点
+SENTENCE_PATTERN = re.compile(r'[^\n。！？；]*[。！？；]?\n?')
+
+def estimate_tokens(text):
+    """
+    粗略估算文本的token数
+
+    Args:
+        text (str): 文本
+
+    Returns:
+        int: 预估token数
+    """
+    if not text:
+        return 0
+    cjk = len(CJK_PATTERN.findall(text))
+    return cjk + math.ceil((len(text) - cjk) / 4)
+
+def estimate_prompt_tokens(payload):
+    """
+    估算chat/completions请求的输入token数
+
+    Args:
+        payload (dict): 请求体
+
+    Returns:
+        int: 预估token数
+    """
+    tokens = 0
+    for message in payload.get('messages', []):
+        content = message.get('content', '')
+        if isinstance(content, str):
+            tokens += estimate_tokens(content)
+            continue
+        for part in content:
+            if part.get('type') == 'text':
+                tokens += estimate_tokens(part.get('text', ''))
+            elif part.get('type') == 'image_url':
+                tokens += IMAGE_TOKEN_ESTIMATE
+    return tokens
+
+def question_categories(question):
+    """
+    按FEATURE_CONFIG['question_keywords']判断问题类型
+
+    Args:
+        question (str): 问题文本
+
+    Returns:
+        list: 命中的类型名称
+    """
+    features = extract_text_features(question)
+    return [
+        category for category in FEATURE_CONFIG['question_keywords']
+        if features.get(f'has_{category}')
+    ]
+
+def max_tokens_for(question, stage, default):
+    """
+    按问题类型确定某阶段调用的输出上限，命中多个类型时取最大值
+
+    Args:
+        question (str): 问题文本
+        stage (str): 'vision'或'text'
+        default (int): 未启用预算时使用的上限
+
+    Returns:
+        int: max_tokens
+    """
+    if not TOKEN_BUDGET_CONFIG['enabled']:
+        return default
+    budgets = TOKEN_BUDGET_CONFIG[f'{stage}_max_tokens']
+    matched = [budgets[category] for category in question_categories(question) if category in budgets]
+    return max(matched) if matched else budgets['default']
+
+def _split_sentences(text):
+    return [sentence for sentence in SENTENCE_PATTERN.findall(text) if sentence.strip()]
+
+def _bigrams(text):
+    text = re.sub(r'\s+', '', text)
+    return {text[i:i + 2] for i in range(len(text) - 1)}
+
+def fit_description(description, question, budget=None):
+    """
+    将图像描述压缩到token预算以内：保留开头一句（通常是整体概述），
+    其余句子按与问题的字符二元组重合度选取，保持原文顺序
+
+    Args:
+        description (str): 第一阶段的图像描述
+        question (str): 问题文本
+        budget (int): token预算，默认按TOKEN_BUDGET_CONFIG
+
+    Returns:
+        str: 未超出预算时原样返回，否则为抽取后的描述
+    """
+    if not TOKEN_BUDGET_CONFIG['enabled'] or not description:
+        return description
+    budget = budget or TOKEN_BUDGET_CONFIG['description_budget']
+    if estimate_tokens(description) <= budget:
+        return description
+
+    sentences = _split_sentences(description)
+    question_bigrams = _bigrams(question)
+    ranked = sorted(
+        range(1, len(sentences)),
+        key=lambda i: (-len(_bigrams(sentences[i]) & question_bigrams), i)
+    )
+
+    selected = set()
+    used = 0
+    for index in [0] + ranked:
+        tokens = estimate_tokens(sentences[index])
+        if used + tokens > budget:
+            continue
+        selected.add(index)
+        used += tokens
+
+    if not selected:
+        # 单句即超出预算时按字符截断
+        return sentences[0][:budget] if sentences else description[:budget]
+    return ''.join(sentences[i] for i in sorted(selected)).strip()
+
+class TokenUsage:
+    """
+    累计一次或多次调用消耗的token，服务端未返回usage时使用估算值，线程安全
+    """
+
+    def __init__(self):
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.calls = 0
+        self.estimated = False
+        self._lock = threading.Lock()
+
+    def add(self, usage, payload, content):
+        """
+        记录一次调用
+
+        Args:
+            usage (dict): 响应中的usage，可为None
+            payload (dict): 请求体
+            content (str): 模型输出
+        """
+        usage = usage or {}
+        prompt = usage.get('prompt_tokens')
+        completion = usage.get('completion_tokens')
+        with self._lock:
+            if prompt is None or completion is None:
+                self.estimated = True
+            self.prompt_tokens += prompt if prompt is not None else estimate_prompt_tokens(payload)
+            self.completion_tokens += completion if completion is not None else estimate_tokens(content)
+            self.calls += 1
+
+    @property
+    def total_tokens(self):
+        return self.prompt_tokens + self.completion_tokens
@@ -5,12 +5,24 @@
 """
 
 import base64
+import hashlib
+import io
+import json
 import re
 import os
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
 import pandas as pd
 import numpy as np
 from pathlib import Path
-from config import FEATURE_CONFIG
+from PIL import Image
+from app_logging import get_logger
+from config import FEATURE_CONFIG, IMAGE_CONFIG
+
+logger = get_logger('utils')
 
 def encode_image_to_base64(image_path):
     """
@@ -27,9 +39,420 @@ def encode_image_to_base64(image_path):
             image_data = f.read()
         return base64.b64encode(image_data).decode('utf-8')
     except Exception as e:
-        print(f"图像编码失败 {image_path}: {e}")
+        logger.warning("图像编码失败 %s: %s", image_path, e)
         return None
 
+# 输出格式对应的Pillow格式名与MIME类型
+_OUTPUT_FORMATS = {
+    'png': ('PNG', 'image/png'),
+    'jpeg': ('JPEG', 'image/jpeg'),
+    'webp': ('WEBP', 'image/webp')
+}
+
+def detect_image_mime(image_data):
+    """
+    根据文件内容检测图像的MIME类型
+    
+    Args:
+        image_data (bytes): 图像数据
+        
+    Returns:
+        str: MIME类型，无法识别时返回image/png
+    """
+    try:
+        with Image.open(io.BytesIO(image_data)) as img:
+            return Image.MIME.get(img.format, 'image/png')
+    except Exception:
+        return 'image/png'
+
+def _compress_image(image_data, config):
+    """
+    按配置缩放并重新编码图像
+    
+    Args:
+        image_data (bytes): 原始图像数据
+        config (dict): 图像预处理配置
+        
+    Returns:
+        tuple: (图像数据, MIME类型)
+    """
+    with Image.open(io.BytesIO(image_data)) as img:
+        img.load()
+        source_mime = Image.MIME.get(img.format, 'image/png')
+        target = config['format']
+        if target == 'auto':
+            target = {'image/jpeg': 'jpeg', 'image/webp': 'webp'}.get(source_mime, 'png')
+        pil_format, mime = _OUTPUT_FORMATS[target]
+        
+        resized = False
+        max_side = config['max_side']
+        if max_side and max(img.size) > max_side:
+            img.thumbnail((max_side, max_side), Image.LANCZOS)
+            resized = True
+        
+        if pil_format == 'PNG':
+            # 颜色数不超过256时转为调色板图，无损且体积更小
+            if img.mode in ('RGB', 'RGBA', 'L') and img.getcolors(256) is not None:
+                img = img.quantize(colors=256, method=Image.FASTOCTREE if img.mode == 'RGBA' else Image.MEDIANCUT)
+            save_kwargs = {'optimize': True}
+        else:
+            if img.mode not in ('RGB', 'L'):
+                # JPEG不支持透明通道，铺白底
+                background = Image.new('RGB', img.size, (255, 255, 255))
+                rgba = img.convert('RGBA')
+                background.paste(rgba, mask=rgba.getchannel('A'))
+                img = background
+            save_kwargs = {'quality': config['quality']}
+            if pil_format == 'JPEG':
+                save_kwargs['optimize'] = True
+        
+        buffer = io.BytesIO()
+        img.save(buffer, format=pil_format, **save_kwargs)
+        processed = buffer.getvalue()
+    
+    # 未缩放且格式不变时，若处理后反而更大则保留原图
+    if not resized and mime == source_mime and len(processed) >= len(image_data):
+        return image_data, source_mime
+    return processed, mime
+
+def preprocess_image(image_path, config=None):
+    """
+    读取并预处理图像：检测格式、按最长边缩放、PNG调色板优化或JPEG/WebP重编码，
+    结果按(路径, 修改时间, 大小, 配置)缓存到磁盘
+    
+    Args:
+        image_path (str): 图像文件路径
+        config (dict): 图像预处理配置，默认使用IMAGE_CONFIG
+        
+    Returns:
+        tuple: (图像数据bytes, MIME类型)，失败返回(None, None)
+    """
+    config = config or IMAGE_CONFIG
+    try:
+        with open(image_path, 'rb') as f:
+            image_data = f.read()
+        if not config['enabled']:
+            return image_data, detect_image_mime(image_data)
+        
+        cache_path = None
+        if config['cache_dir']:
+            stat = os.stat(image_path)
+            key_source = json.dumps(
+                [os.path.abspath(image_path), stat.st_mtime_ns, stat.st_size,
+                 config['max_side'], config['format'], config['quality']]
+            )
+            cache_key = hashlib.sha256(key_source.encode('utf-8')).hexdigest()
+            cache_path = Path(config['cache_dir']) / cache_key
+            if cache_path.exists():
+                cached = cache_path.read_bytes()
+                return cached, detect_image_mime(cached)
+        
+        processed, mime = _compress_image(image_data, config)
+        
+        if cache_path is not None:
+            ensure_dir_exists(config['cache_dir'])
+            _write_cache_file(cache_path, processed)
+        return processed, mime
+    except Exception as e:
+        logger.warning("图像预处理失败 %s: %s", image_path, e)
+        return None, None
+
+def _write_cache_file(cache_path, data):
+    """
+    原子写入磁盘缓存：每个写入者使用独立的临时文件再重命名，
+    多个线程或分片进程同时写入同一缓存时互不影响；写入失败只影响缓存，不影响本次结果
+    """
+    temp_path = None
+    try:
+        with tempfile.NamedTemporaryFile(dir=cache_path.parent, prefix=f"{cache_path.name}.", suffix='.tmp', delete=False) as f:
+            temp_path = f.name
+            f.write(data)
+        os.replace(temp_path, cache_path)
+    except OSError as e:
+        logger.debug("图像缓存写入失败 %s: %s", cache_path, e)
+        if temp_path and os.path.exists(temp_path):
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+
+class ImageEncodingCache:
+    """
+    进程内的图像编码缓存：以(真实路径, 修改时间, 大小)为键保存base64结果，
+    按总字节数做LRU淘汰；多个线程同时请求同一图像时只读取和编码一次
+    """
+    
+    def __init__(self, max_bytes=128 * 1024 * 1024):
+        """
+        Args:
+            max_bytes (int): 缓存的base64字符串总大小上限(字节)
+        """
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._loading = {}
+        self._lock = threading.Lock()
+    
+    def get(self, image_path, loader):
+        """
+        获取图像的编码结果，未命中时调用loader加载
+        
+        Args:
+            image_path (str): 图像文件路径
+            loader (callable): loader(image_path) -> (base64字符串, MIME类型)
+            
+        Returns:
+            tuple: (base64字符串, MIME类型)，失败返回(None, None)
+        """
+        try:
+            stat = os.stat(image_path)
+        except OSError:
+            return None, None
+        key = (os.path.realpath(image_path), stat.st_mtime_ns, stat.st_size)
+        
+        while True:
+            with self._lock:
+                if key in self._entries:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return self._entries[key]
+                event = self._loading.get(key)
+                if event is None:
+                    # 由当前线程负责加载
+                    event = self._loading[key] = threading.Event()
+                    self.misses += 1
+                    break
+            # 其他线程正在加载同一图像，等待其完成
+            event.wait()
+        
+        try:
+            value = loader(image_path)
+            if value[0] is not None:
+                self._store(key, value)
+            return value
+        finally:
+            with self._lock:
+                del self._loading[key]
+            event.set()
+    
+    def _store(self, key, value):
+        size = len(value[0])
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            self._entries[key] = value
+            self.total_bytes += size
+            while self.total_bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.total_bytes -= len(evicted[0])
+    
+    def stats(self):
+        """
+        获取缓存统计信息
+        
+        Returns:
+            dict: 命中、未命中次数、条目数与当前大小
+        """
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'entries': len(self._entries),
+            'total_bytes': self.total_bytes
+        }
+
+_image_cache = ImageEncodingCache(IMAGE_CONFIG['memory_cache_bytes'])
+
+def _load_image_for_api(image_path):
+    image_data, mime = preprocess_image(image_path)
+    if image_data is None:
+        return None, None
+    return base64.b64encode(image_data).decode('utf-8'), mime
+
+def encode_image_for_api(image_path):
+    """
+    预处理图像并编码为base64，供视觉API使用；同一进程内每张图像只读取和编码一次
+    
+    Args:
+        image_path (str): 图像文件路径
+        
+    Returns:
+        tuple: (base64字符串, MIME类型)，失败返回(None, None)
+    """
+    return _image_cache.get(image_path, _load_image_for_api)
+
+def get_image_cache_stats():
+    """
+    获取进程内图像编码缓存的统计信息
+    
+    Returns:
+        dict: 缓存统计
+    """
+    return _image_cache.stats()
+
+def group_rows_by_image(rows, key=None):
+    """
+    按图像对数据行分组，找出共享同一图像的行
+    
+    Args:
+        rows (list): 数据行列表（含image字段）
+        key (callable): 由数据行得到分组图像的函数，默认取image字段
+        
+    Returns:
+        dict: {image: [row, ...]}，按首次出现的顺序排列
+    """
+    key = key or (lambda row: row['image'])
+    groups = OrderedDict()
+    for row in rows:
+        groups.setdefault(key(row), []).append(row)
+    return groups
+
+# 知识图谱边使用的关键词（extract_knowledge_graph_edges）
+KG_COLOR_WORDS = ['红色', '蓝色', '绿色', '黄色', '黑色', '白色', '灰色', '紫色', '橙色', '粉色']
+KG_ENTITY_WORDS = [
+    ('人物', ['人', '男', '女', '人物', '小孩', '成人']),
+    ('文字', ['文字', '字', '文本', '标题']),
+    ('表格', ['表格', '表', '图表']),
+    ('按钮', ['按钮'])
+]
+
+# 数字（整数或小数）
+NUMBER_PATTERN = re.compile(r'\d+(?:\.\d+)?')
+
+def _compile_alternation(words):
+    # 只判断是否出现，任一候选命中即可，与逐词any(word in text)等价
+    words = sorted(set(words), key=lambda word: (-len(word), word))
+    return re.compile('|'.join(re.escape(word) for word in words))
+
+class KeywordScan:
+    """
+    单个文本的关键词查询结果，供问题特征、描述特征与知识图谱边共用，
+    每个关键词分组、数字与颜色对同一文本最多查找一次
+    """
+    
+    __slots__ = ('text', 'matcher', '_groups', '_numbers', '_colors')
+    
+    def __init__(self, text, matcher):
+        self.text = text
+        self.matcher = matcher
+        self._groups = {}
+        self._numbers = None
+        self._colors = None
+    
+    def has_any(self, group):
+        """
+        判断某分组的关键词是否出现
+        
+        Args:
+            group (str): 分组名
+            
+        Returns:
+            int: 出现返回1，否则返回0
+        """
+        found = self._groups.get(group)
+        if found is None:
+            found = 1 if self.matcher.groups[group].search(self.text) else 0
+            self._groups[group] = found
+        return found
+    
+    @property
+    def numbers(self):
+        if self._numbers is None:
+            self._numbers = NUMBER_PATTERN.findall(self.text)
+        return self._numbers
+    
+    @property
+    def colors(self):
+        if self._colors is None:
+            self._colors = self.matcher.color_pattern.findall(self.text)
+        return self._colors
+
+class KeywordMatcher:
+    """
+    预编译的关键词匹配器：每个关键词分组编译为一个正则（一次扫描代替逐词查找），
+    颜色按出现顺序提取；构建一次，所有文本共用
+    """
+    
+    def __init__(self, keyword_groups, colors):
+        """
+        Args:
+            keyword_groups (dict): {分组名: 关键词列表}
+            colors (list): 颜色词列表，按出现顺序提取
+        """
+        self.groups = {name: _compile_alternation(words) for name, words in keyword_groups.items()}
+        # 与原有的颜色提取正则保持相同的候选顺序
+        self.color_pattern = re.compile('(' + '|'.join(re.escape(color) for color in colors) + ')')
+    
+    def scan(self, text):
+        """
+        构建文本的关键词查询结果（按需查找并缓存）
+        
+        Args:
+            text (str): 文本
+            
+        Returns:
+            KeywordScan: 查询结果
+        """
+        return KeywordScan(text, self)
+
+_keyword_matcher = None
+
+def get_keyword_matcher():
+    """
+    获取由FEATURE_CONFIG与知识图谱关键词构建的共享匹配器，首次调用时构建
+    
+    Returns:
+        KeywordMatcher: 匹配器
+    """
+    global _keyword_matcher
+    if _keyword_matcher is None:
+        groups = {}
+        for category, words in FEATURE_CONFIG['question_keywords'].items():
+            groups[f'question_{category}'] = words
+        for category, words in FEATURE_CONFIG['description_keywords'].items():
+            groups[f'description_{category}'] = words
+        for entity, words in KG_ENTITY_WORDS:
+            groups[f'kg_{entity}'] = words
+        _keyword_matcher = KeywordMatcher(groups, KG_COLOR_WORDS)
+    return _keyword_matcher
+
+def _text_features_from_scan(text, scan):
+    features = {
+        'length': len(text),
+        'has_number': 1 if scan.numbers else 0
+    }
+    
+    # 检查关键词（"number"类关键词同样写入has_number）
+    for category in FEATURE_CONFIG['question_keywords']:
+        features[f'has_{category}'] = scan.has_any(f'question_{category}')
+    
+    return features
+
+def _description_features_from_scan(description, scan):
+    features = {
+        'desc_length': len(description),
+        'desc_has_number': 1 if scan.numbers else 0
+    }
+    
+    # 检查描述关键词
+    for category in FEATURE_CONFIG['description_keywords']:
+        features[f'desc_has_{category}'] = scan.has_any(f'description_{category}')
+    
+    return features
+
+def _knowledge_graph_edges_from_scan(scan):
+    # 数字与颜色关系
+    edges = [('图片', '包含数字', num) for num in scan.numbers]
+    edges.extend(('图片', '包含颜色', color) for color in scan.colors)
+    
+    # 人物、文字、表格、按钮关系
+    for entity, _ in KG_ENTITY_WORDS:
+        if scan.has_any(f'kg_{entity}'):
+            edges.append(('图片', '包含', entity))
+    
+    return edges
+
 def extract_text_features(text):
     """
     从文本中提取特征
@@ -51,18 +474,7 @@ def extract_text_features(text):
             'has_number_keyword': 0
         }
     
-    features = {
-        'length': len(text),
-        'has_number': 1 if re.search(r'\d+', text) else 0
-    }
-    
-    # 检查关键词
-    keywords = FEATURE_CONFIG['question_keywords']
-    for category, words in keywords.items():
-        feature_name = f'has_{category}'
-        features[feature_name] = 1 if any(word in text for word in words) else 0
-    
-    return features
+    return _text_features_from_scan(text, get_keyword_matcher().scan(text))
 
 def extract_description_features(description):
     """
@@ -84,18 +496,7 @@ def extract_description_features(description):
             'desc_has_object': 0
         }
     
-    features = {
-        'desc_length': len(description),
-        'desc_has_number': 1 if re.search(r'\d+', description) else 0
-    }
-    
-    # 检查描述关键词
-    keywords = FEATURE_CONFIG['description_keywords']
-    for category, words in keywords.items():
-        feature_name = f'desc_has_{category}'
-        features[feature_name] = 1 if any(word in description for word in words) else 0
-    
-    return features
+    return _description_features_from_scan(description, get_keyword_matcher().scan(description))
 
 def extract_knowledge_graph_edges(description):
     """
@@ -110,35 +511,7 @@ def extract_knowledge_graph_edges(description):
     if not description:
         return []
     
-    edges = []
-    
-    # 提取数字关系
-    numbers = re.findall(r'\d+(?:\.\d+)?', description)
-    for num in numbers:
-        edges.append(('图片', '包含数字', num))
-    
-    # 提取颜色关系
-    colors = re.findall(r'(红色|蓝色|绿色|黄色|黑色|白色|灰色|紫色|橙色|粉色)', description)
-    for color in colors:
-        edges.append(('图片', '包含颜色', color))
-    
-    # 提取人物关系
-    if any(word in description for word in ['人', '男', '女', '人物', '小孩', '成人']):
-        edges.append(('图片', '包含', '人物'))
-    
-    # 提取文字关系
-    if any(word in description for word in ['文字', '字', '文本', '标题']):
-        edges.append(('图片', '包含', '文字'))
-    
-    # 提取表格关系
-    if any(word in description for word in ['表格', '表', '图表']):
-        edges.append(('图片', '包含', '表格'))
-    
-    # 提取按钮关系
-    if '按钮' in description:
-        edges.append(('图片', '包含', '按钮'))
-    
-    return edges
+    return _knowledge_graph_edges_from_scan(get_keyword_matcher().scan(description))
 
 def calculate_jaccard_similarity(str1, str2):
     """
@@ -179,13 +552,14 @@ def create_feature_vector(question, description):
     question_features = extract_text_features(question)
     features.update({f'question_{k}': v for k, v in question_features.items()})
     
-    # 描述特征
-    desc_features = extract_description_features(description)
-    features.update(desc_features)
-    
-    # 知识图谱特征
-    edges = extract_knowledge_graph_edges(description)
-    features['kg_edge_count'] = len(edges)
+    # 描述特征与知识图谱特征共用一次扫描
+    if description:
+        scan = get_keyword_matcher().scan(description)
+        features.update(_description_features_from_scan(description, scan))
+        features['kg_edge_count'] = len(_knowledge_graph_edges_from_scan(scan))
+    else:
+        features.update(extract_description_features(description))
+        features['kg_edge_count'] = 0
     
     # 交互特征
     features['has_description'] = 1 if description else 0
@@ -196,6 +570,85 @@ def create_feature_vector(question, description):
     
     return features
 
+def get_feature_columns():
+    """
+    获取特征矩阵的列名，与create_feature_vector（问题非空时）的键及顺序一致
+    
+    Returns:
+        list: 列名列表
+    """
+    return list(create_feature_vector('问题', '描述'))
+
+def _feature_chunk(questions, descriptions, columns):
+    """
+    对一块数据用pandas向量化字符串操作计算特征
+    
+    Returns:
+        np.ndarray: 特征矩阵，列顺序与columns一致
+    """
+    matcher = get_keyword_matcher()
+    
+    def contains(series, pattern):
+        return series.str.contains(pattern.pattern, regex=True).to_numpy(dtype=np.float32)
+    
+    values = {}
+    
+    # 问题特征（"number"类关键词同样写入has_number）
+    question_length = questions.str.len().to_numpy(dtype=np.float32)
+    values['question_length'] = question_length
+    values['question_has_number'] = contains(questions, NUMBER_PATTERN)
+    for category in FEATURE_CONFIG['question_keywords']:
+        values[f'question_has_{category}'] = contains(questions, matcher.groups[f'question_{category}'])
+    
+    # 描述特征
+    desc_length = descriptions.str.len().to_numpy(dtype=np.float32)
+    values['desc_length'] = desc_length
+    values['desc_has_number'] = contains(descriptions, NUMBER_PATTERN)
+    for category in FEATURE_CONFIG['description_keywords']:
+        values[f'desc_has_{category}'] = contains(descriptions, matcher.groups[f'description_{category}'])
+    
+    # 知识图谱边数：数字、颜色各一条，人物/文字/表格/按钮出现各一条
+    edge_count = (
+        descriptions.str.count(NUMBER_PATTERN.pattern).to_numpy(dtype=np.float32)
+        + descriptions.str.count(matcher.color_pattern.pattern).to_numpy(dtype=np.float32)
+    )
+    for entity, _ in KG_ENTITY_WORDS:
+        edge_count += contains(descriptions, matcher.groups[f'kg_{entity}'])
+    values['kg_edge_count'] = edge_count
+    
+    # 交互特征
+    has_description = desc_length > 0
+    values['has_description'] = has_description.astype(np.float32)
+    ratio = np.zeros_like(question_length)
+    np.divide(question_length, desc_length, out=ratio, where=has_description)
+    values['question_desc_length_ratio'] = ratio
+    
+    return np.column_stack([values[column] for column in columns])
+
+def create_feature_matrix(questions, descriptions, chunk_size=10000):
+    """
+    批量创建特征矩阵：按块使用向量化字符串操作，内存占用与块大小成正比
+    
+    Args:
+        questions (pd.Series|list): 问题文本
+        descriptions (pd.Series|list): 图像描述，与questions等长，缺失值视为空描述
+        chunk_size (int): 每块处理的行数
+        
+    Returns:
+        np.ndarray: 形状为(行数, 列数)的float32矩阵，列名见get_feature_columns()
+    """
+    questions = pd.Series(questions).reset_index(drop=True).fillna('').astype(str)
+    descriptions = pd.Series(descriptions).reset_index(drop=True).fillna('').astype(str)
+    if len(questions) != len(descriptions):
+        raise ValueError(f"问题数 {len(questions)} 与描述数 {len(descriptions)} 不一致")
+    
+    columns = get_feature_columns()
+    matrix = np.empty((len(questions), len(columns)), dtype=np.float32)
+    for start in range(0, len(questions), chunk_size):
+        end = start + chunk_size
+        matrix[start:end] = _feature_chunk(questions[start:end], descriptions[start:end], columns)
+    return matrix
+
 def ensure_dir_exists(dir_path):
     """
     确保目录存在，如果不存在则创建
@@ -205,6 +658,42 @@ def ensure_dir_exists(dir_path):
     """
     Path(dir_path).mkdir(parents=True, exist_ok=True)
 
+@contextmanager
+def atomic_directory(dir_path):
+    """
+    在同级的临时目录中写入全部文件，正常结束后整体替换dir_path；
+    多个进程（如同时启动的分片）同时构建时，读取方只会看到完整的目录
+
+    Args:
+        dir_path (str): 目标目录路径
+
+    Yields:
+        str: 临时目录路径，文件应写入其中
+    """
+    dir_path = os.path.normpath(dir_path)
+    parent = os.path.dirname(os.path.abspath(dir_path))
+    ensure_dir_exists(parent)
+    temp_dir = tempfile.mkdtemp(dir=parent, prefix=f".{os.path.basename(dir_path)}.")
+    try:
+        yield temp_dir
+    except BaseException:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        raise
+
+    # 目录不能直接覆盖非空目录：先移走旧目录，再把新目录重命名到位
+    old_dir = f"{temp_dir}.old"
+    try:
+        os.rename(dir_path, old_dir)
+    except FileNotFoundError:
+        old_dir = None
+    try:
+        os.rename(temp_dir, dir_path)
+    except OSError:
+        # 其他进程已先放入了完整目录，丢弃本次结果
+        shutil.rmtree(temp_dir, ignore_errors=True)
+    if old_dir:
+        shutil.rmtree(old_dir, ignore_errors=True)
+
 def load_csv_data(file_path):
     """
     加载CSV数据文件
@@ -218,7 +707,7 @@ def load_csv_data(file_path):
     try:
         return pd.read_csv(file_path, encoding='utf-8')
     except Exception as e:
-        print(f"加载CSV文件失败 {file_path}: {e}")
+        logger.error("加载CSV文件失败 %s: %s", file_path, e)
         return None
 
 def save_csv_data(df, file_path):
@@ -232,9 +721,9 @@ def save_csv_data(df, file_path):
     try:
         ensure_dir_exists(os.path.dirname(file_path))
         df.to_csv(file_path, index=False, encoding='utf-8')
-        print(f"数据已保存到: {file_path}")
+        logger.info("数据已保存到: %s", file_path)
     except Exception as e:
-        print(f"保存CSV文件失败 {file_path}: {e}")
+        logger.error("保存CSV文件失败 %s: %s", file_path, e)
 
 def validate_image_path(image_path, base_dir):
     """